@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+from pivot_engine import EPOCH
+
+# Climatologie journalière des piézomètres : effectif, moyenne et somme des carrés des écarts (M2) par
+# (jour de l'année, station), mises à jour par lots (Welford / Chan) à l'arrivée de nouvelles mesures,
+# sans relire l'historique ; courbes annuelles normalisées et lissées calculées d'un bloc sur la matrice
+
+# Définition des paramètres
+N_DOY = 366
+SMOOTHING_WINDOW = 14  # Fenêtre (jours) de la moyenne glissante des courbes annuelles
+STATE_FILES = ("codes", "count", "mean", "m2", "present")
+STATE_VERSION = 1
+
+
+# Jour de l'année (0..365) d'ordinaux journaliers
+def day_of_year(days):
+    return pd.DatetimeIndex(EPOCH + np.asarray(days).astype("timedelta64[D]")).dayofyear.to_numpy() - 1
+
+
+# État vide ; present : jours de l'année ayant au moins un jour dans les données (lignes des courbes)
+def empty_state(codes):
+    shape = (N_DOY, len(codes))
+    return {"codes": np.asarray(codes, dtype=str), "count": np.zeros(shape, dtype=np.int64),
+            "mean": np.zeros(shape), "m2": np.zeros(shape), "present": np.zeros(N_DOY, dtype=bool)}
+
+
+# Ajout de stations (colonnes insérées dans l'ordre des codes)
+def with_stations(state, codes):
+    all_codes = np.union1d(state["codes"], np.asarray(codes, dtype=str))
+    if len(all_codes) == len(state["codes"]):
+        return state
+    expanded = empty_state(all_codes)
+    columns = np.searchsorted(all_codes, state["codes"])
+    for key in ("count", "mean", "m2"):
+        expanded[key][:, columns] = state[key]
+    expanded["present"] = state["present"].copy()
+    return expanded
+
+
+# Mise à jour par un lot de mesures (jours, codes stations, valeurs ; NaN ignorées) : statistiques du lot
+# par (jour de l'année, station) puis fusion avec l'état (formule de Chan, généralisation de Welford)
+def update(state, days, codes, values):
+    state = with_stations(state, codes)
+    days, values = np.asarray(days), np.asarray(values, dtype=np.float64)
+    state["present"][day_of_year(days)] = True
+    finite = ~np.isnan(values)
+    n_stations = len(state["codes"])
+    keys = day_of_year(days[finite]) * n_stations + np.searchsorted(state["codes"], np.asarray(codes)[finite])
+    values = values[finite]
+
+    size = N_DOY * n_stations
+    count_b = np.bincount(keys, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_b = np.bincount(keys, weights=values, minlength=size) / count_b
+    m2_b = np.bincount(keys, weights=(values - mean_b[keys]) ** 2, minlength=size)
+
+    count_a = state["count"].reshape(-1)
+    mean, m2 = state["mean"].reshape(-1).copy(), state["m2"].reshape(-1).copy()
+    count = count_a + count_b
+    cells = count_b > 0
+    delta = mean_b[cells] - mean[cells]
+    mean[cells] += delta * count_b[cells] / count[cells]
+    m2[cells] += m2_b[cells] + delta ** 2 * count_a[cells] * count_b[cells] / count[cells]
+    state.update(count=count.reshape(N_DOY, n_stations), mean=mean.reshape(N_DOY, n_stations),
+                 m2=m2.reshape(N_DOY, n_stations))
+    return state
+
+
+# État complet d'une matrice jours x stations (jours sans mesure compris dans present)
+def from_matrix(days, codes, matrix):
+    matrix = np.asarray(matrix)
+    rows, cols = np.nonzero(~np.isnan(matrix))
+    state = update(empty_state(codes), days[rows], np.asarray(codes, dtype=str)[cols], matrix[rows, cols])
+    state["present"][day_of_year(days)] = True
+    return state
+
+
+def load_state(directory):
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return None
+    with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != STATE_VERSION:
+        return None
+    for key in STATE_FILES:
+        state[key] = np.load(os.path.join(directory, f"{key}.npy"))
+    return state
+
+
+# Écriture dans un dossier temporaire puis remplacement : l'état et sa génération restent cohérents
+def save_state(state, directory):
+    tmp_dir = directory + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for key in STATE_FILES:
+        np.save(os.path.join(tmp_dir, f"{key}.npy"), state[key])
+    state["generation"] = uuid.uuid4().hex
+    with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": STATE_VERSION, "generation": state["generation"]}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return state["generation"]
+
+
+# Moyenne par jour de l'année (jours présents, numérotés 1..366) : matrice jours x stations float32
+def annual_means(state):
+    present = np.flatnonzero(state["present"])
+    means = np.where(state["count"][present] > 0, state["mean"][present], np.nan)
+    return present + 1, means.astype(np.float32)
+
+
+# Centrage-réduction de chaque colonne (écart-type ddof=1, valeurs manquantes ignorées)
+def normalize(matrix):
+    valid = ~np.isnan(matrix)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(valid, matrix, 0).sum(axis=0, dtype=np.float64) / count
+        std = np.sqrt(np.where(valid, (matrix - mean) ** 2, 0).sum(axis=0) / (count - 1))
+        return ((matrix - mean) / np.where(count > 1, std, np.nan)).astype(np.float32)
+
+
+# Moyenne glissante centrée de toutes les colonnes en une opération, circulaire sur l'année (la fin de
+# décembre est lissée avec le début de janvier) ; une fenêtre contenant une valeur manquante donne NaN
+def smooth(matrix, window=SMOOTHING_WINDOW):
+    before, after = window // 2, window - 1 - window // 2
+    padded = np.concatenate([matrix[len(matrix) - before:], matrix, matrix[:after]])
+    return sliding_window_view(padded, window, axis=0).mean(axis=-1).astype(np.float32)
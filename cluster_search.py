@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial.distance import pdist, squareform
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.neighbors import NearestNeighbors
+from threadpoolctl import threadpool_limits
+
+from station_executor import MAX_WORKERS
+
+# Définition des paramètres
+SILHOUETTE_SAMPLE = 4000  # Au-delà, silhouette calculée sur un échantillon de points tiré une fois
+RANDOM_STATE = 0
+KMEANS_RANDOM_STATE = 42
+KMEANS_N_INIT = 10
+MINIBATCH_MIN = 20000  # Au-delà de ce nombre de points, MiniBatchKMeans remplace KMeans
+MINIBATCH_SIZE = 4096
+MINIBATCH_N_INIT = 3
+
+
+# Distances calculées une seule fois pour toute la recherche
+# - graphe des voisins à moins de max_eps (point lui-même compris), sous forme de listes (ligne, colonne, distance) :
+#   le voisinage de chaque point pour n'importe quel eps <= max_eps s'en déduit par simple seuillage
+# - matrice complète des distances pour la silhouette, sur tous les points ou sur un échantillon fixe
+def distance_cache(X, max_eps, sample_size=SILHOUETTE_SAMPLE):
+    X = np.asarray(X, dtype=np.float64)
+    distances, indices = NearestNeighbors(radius=max_eps).fit(X).radius_neighbors(X)
+    counts = np.array([len(row) for row in indices], dtype=np.int64)
+    index_dtype = np.int32 if counts.sum() < np.iinfo(np.int32).max else np.int64
+    rows = np.repeat(np.arange(len(X), dtype=index_dtype), counts)
+    cols = np.concatenate(indices).astype(index_dtype)
+    order = np.lexsort((cols, rows))  # Voisins triés par indice dans chaque ligne (matrices CSR sans tri)
+    return {
+        "n": len(X),
+        "rows": rows,
+        "cols": cols[order],
+        "distances": np.concatenate(distances)[order],
+        **silhouette_cache(X, sample_size),
+    }
+
+
+# Matrice des distances servant à toutes les silhouettes : tous les points, ou un échantillon tiré une fois
+def silhouette_cache(X, sample_size=SILHOUETTE_SAMPLE):
+    sample = None
+    if len(X) > sample_size:
+        sample = np.sort(np.random.default_rng(RANDOM_STATE).choice(len(X), sample_size, replace=False))
+    return {"silhouette": squareform(pdist(X if sample is None else X[sample])), "sample": sample}
+
+
+# Étiquetages DBSCAN pour un eps et plusieurs min_samples, à partir du graphe en cache (mêmes étiquettes que
+# sklearn.cluster.DBSCAN) : points centraux (au moins min_samples voisins), clusters = composantes connexes
+# des points centraux numérotées dans l'ordre de leur premier point, point de bordure rattaché au premier
+# cluster (plus petit numéro) parmi ses voisins centraux, bruit -1
+def dbscan_labels(cache, eps, min_samples_values):
+    n = cache["n"]
+    within = cache["distances"] <= eps
+    cols = cache["cols"][within]
+    n_neighbors = np.bincount(cache["rows"][within], minlength=n)  # Chaque point est son propre voisin
+    indptr = np.concatenate([[0], np.cumsum(n_neighbors)]).astype(cols.dtype)
+
+    results, core, labels = [], None, None
+    for min_samples in min_samples_values:
+        previous_core, core = core, n_neighbors >= min_samples
+        if previous_core is not None and np.array_equal(core, previous_core):
+            results.append(labels.copy())  # Mêmes points centraux : même étiquetage
+            continue
+        labels = np.full(n, -1, dtype=np.int64)
+        if core.any():
+            # Arêtes entre points centraux uniquement (copies : eliminate_zeros modifie les tableaux en place)
+            linked = np.repeat(core, n_neighbors) & core[cols]
+            adjacency = csr_matrix((linked.view(np.int8), cols.copy(), indptr.copy()), shape=(n, n))
+            adjacency.has_sorted_indices = True
+            adjacency.eliminate_zeros()
+            # Graphe symétrique : composantes fortement connexes = composantes connexes (algorithme plus rapide)
+            _, component = connected_components(adjacency, directed=True, connection="strong")
+            _, first_point, cluster = np.unique(component[core], return_index=True, return_inverse=True)
+            labels[core] = np.argsort(np.argsort(first_point))[cluster]
+
+            # Points non centraux : moins de min_samples voisins chacun, seules leurs lignes sont parcourues
+            others = np.flatnonzero(~core)
+            if len(others):
+                counts = n_neighbors[others]
+                offsets = np.cumsum(counts) - counts
+                neighbors = cols[np.repeat(indptr[others] - offsets, counts) + np.arange(counts.sum())]
+                first = np.minimum.reduceat(np.where(core[neighbors], labels[neighbors], n), offsets)
+                labels[others[first < n]] = first[first < n]
+        results.append(labels)
+    return results
+
+
+# Silhouette d'un étiquetage à partir des distances en cache, None si elle n'est pas définie
+def cached_silhouette(cache, labels):
+    if cache["sample"] is not None:
+        labels = labels[cache["sample"]]
+    _, clusters, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    if len(sizes) < 2 or len(sizes) >= len(labels):
+        return None
+    # Même définition que sklearn.metrics.silhouette_score, les sommes de distances par cluster
+    # étant obtenues en un seul produit matriciel
+    one_hot = np.zeros((len(labels), len(sizes)))
+    one_hot[np.arange(len(labels)), clusters] = 1
+    mean_distances = cache["silhouette"] @ one_hot
+    own = np.arange(len(labels)), clusters
+    intra = mean_distances[own] / np.maximum(sizes[clusters] - 1, 1)
+    mean_distances /= sizes
+    mean_distances[own] = np.inf
+    nearest = mean_distances.min(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scores = np.nan_to_num((nearest - intra) / np.maximum(intra, nearest))
+    scores[sizes[clusters] == 1] = 0
+    return float(scores.mean())
+
+
+# Recherche des paramètres DBSCAN (eps, min_samples) maximisant la silhouette
+# Le graphe de voisinage est calculé une fois, les valeurs d'eps sont évaluées en parallèle (threads, graphe partagé)
+# et la silhouette n'est calculée qu'une fois par étiquetage distinct
+# Les étiquetages à un seul cluster, ou avec du bruit si allow_noise est faux, sont écartés
+# En cas d'égalité, le premier candidat (eps puis min_samples croissants) l'emporte
+# Retourne le meilleur candidat (dict eps, min_samples, score, labels ; None si aucun) et le tableau des candidats
+def search_dbscan(X, eps_values, min_samples_values, allow_noise=False, max_workers=MAX_WORKERS):
+    eps_values = [float(eps) for eps in eps_values]
+    min_samples_values = list(min_samples_values)
+    candidates = [(eps, min_samples) for eps in eps_values for min_samples in min_samples_values]
+    cache = distance_cache(X, max(eps_values))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        by_eps = executor.map(lambda eps: dbscan_labels(cache, eps, min_samples_values), eps_values)
+        labelings = [labels for eps_labels in by_eps for labels in eps_labels]
+
+        unique, keys = {}, []
+        for labels in labelings:
+            key = labels.tobytes()
+            keys.append(key)
+            if key not in unique and len(np.unique(labels)) > 1 and (allow_noise or -1 not in labels):
+                unique[key] = labels
+        scores = dict(zip(unique, executor.map(lambda labels: cached_silhouette(cache, labels), unique.values())))
+
+    df_candidates = pd.DataFrame({
+        "eps": [eps for eps, _ in candidates],
+        "min_samples": [min_samples for _, min_samples in candidates],
+        "n_clusters": [len(set(labels) - {-1}) for labels in labelings],
+        "n_noise": [int((labels == -1).sum()) for labels in labelings],
+        "score": [scores.get(key) for key in keys],
+    })
+
+    best = None
+    for (eps, min_samples), labels, key in zip(candidates, labelings, keys):
+        score = scores.get(key)
+        if score is not None and (best is None or score > best["score"]):
+            best = {"eps": eps, "min_samples": min_samples, "score": score, "labels": labels}
+    return best, df_candidates
+
+
+def fit_kmeans(X, k, minibatch):
+    if minibatch:
+        model = MiniBatchKMeans(n_clusters=k, random_state=KMEANS_RANDOM_STATE, n_init=MINIBATCH_N_INIT,
+                                batch_size=MINIBATCH_SIZE)
+    else:
+        model = KMeans(n_clusters=k, random_state=KMEANS_RANDOM_STATE, n_init=KMEANS_N_INIT)
+    return model.fit(X)
+
+
+# Choix du nombre de clusters KMeans : chaque k est ajusté une seule fois (inertie pour la méthode du coude,
+# silhouette sur les distances en cache, étiquettes), les valeurs de k étant évaluées en parallèle (threads,
+# un seul thread de calcul par ajustement) ; MiniBatchKMeans au-delà de MINIBATCH_MIN points
+# Les k supérieurs ou égaux au nombre de points sont ignorés ; en cas d'égalité, le plus petit k l'emporte
+# Retourne le meilleur candidat (dict k, score, labels, model ; None si aucun) et le tableau des candidats
+def search_kmeans(X, k_values, minibatch=None, max_workers=MAX_WORKERS):
+    X = np.asarray(X, dtype=np.float64)
+    if minibatch is None:
+        minibatch = len(X) > MINIBATCH_MIN
+    k_values = [k for k in k_values if 2 <= k < len(X)]
+    cache = silhouette_cache(X)
+
+    def evaluate(k):
+        model = fit_kmeans(X, k, minibatch)
+        return model, cached_silhouette(cache, model.labels_)
+
+    with threadpool_limits(limits=1 if max_workers > 1 else None), \
+            ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        fits = list(executor.map(evaluate, k_values))
+
+    df_candidates = pd.DataFrame({
+        "k": k_values,
+        "inertia": [model.inertia_ for model, _ in fits],
+        "score": [score for _, score in fits],
+    })
+
+    best = None
+    for k, (model, score) in zip(k_values, fits):
+        if score is not None and (best is None or score > best["score"]):
+            best = {"k": k, "score": score, "labels": model.labels_, "model": model}
+    return best, df_candidates
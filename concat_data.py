@@ -1,38 +1,151 @@
+import hashlib
+import io
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from incremental import clear_marks, load_marks, save_marks
+from storage import TableWriter, append_segment, table_version
 
 # Définition des paramètres
 INPUT_DIR = "data"  # Dossier contenant les fichiers CSV
 OUTPUT_DIR = "data_all"  # Dossier de sortie
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, "nappes_concatenees.csv")
+OUTPUT_TABLE = os.path.join(OUTPUT_DIR, "nappes_concatenees")  # Table typée (Parquet par défaut, cf. storage.py)
+COLUMNS = ["code_bss", "date_mesure", "niveau_nappe_eau"]  # Seules colonnes lues dans les chroniques
+DTYPES = {"code_bss": str, "date_mesure": str, "niveau_nappe_eau": "float32"}
+MAX_WORKERS = os.cpu_count() or 1  # Lecture des fichiers en parallèle
+MAX_PENDING = 2 * MAX_WORKERS  # Nombre maximal de fichiers lus en avance (borne la mémoire)
+STAGE = "concat_data"  # Nom de la marque de progression (cf. incremental.py)
+TAIL_BYTES = 4096  # Octets précédant la fin déjà lue, comparés pour vérifier qu'un fichier n'a fait que grandir
 
-# Vérifier et créer le dossier de sortie si nécessaire
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
 
-# Récupérer tous les fichiers CSV dans le dossier INPUT_DIR
-csv_files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".csv")]
+# Vérification de l'en-tête (une seule fois, sur le premier fichier)
+def check_header(file_path):
+    header = pd.read_csv(file_path, sep=";", nrows=0).columns
+    missing = [col for col in COLUMNS if col not in header]
+    if missing:
+        raise ValueError(f"Colonnes absentes de {file_path} : {', '.join(missing)}")
 
-# Initialiser une liste pour stocker les DataFrames
-df_list = []
 
-# Charger et concaténer les fichiers
-for file in csv_files:
-    file_path = os.path.join(INPUT_DIR, file)
+# Lecture d'un fichier : uniquement les colonnes utiles, directement typées
+# offset, size : lecture des seules lignes ajoutées entre ces deux octets (l'en-tête est relu en tête de fichier)
+def read_chronicle(file_path, offset=0, size=None):
+    source = file_path
+    if offset:
+        with open(file_path, "rb") as f:
+            header = f.readline()
+            f.seek(offset)
+            source = io.BytesIO(header + f.read(size - offset))
+    df = pd.read_csv(source, sep=";", usecols=COLUMNS, dtype=DTYPES)
+    df["date_mesure"] = pd.to_datetime(df["date_mesure"], format="%Y-%m-%d", errors="coerce")
+    return df[COLUMNS]
+
+
+# Écriture du plus ancien fichier en cours de lecture ; retourne le fichier s'il n'a pas pu être lu
+def write_next(pending, writer):
+    file, future = pending.popleft()
     try:
-        df = pd.read_csv(file_path, sep=";", dtype=str)  # Charger en tant que chaînes pour éviter les erreurs
-        df = df[["code_bss", "date_mesure", "niveau_nappe_eau"]]  # Ne garder que les colonnes spécifiées
-        df_list.append(df)
+        writer.write(future.result())
         print(f"Fichier chargé : {file}")
     except Exception as e: #en cas d'erreur, on abandonne la lecture du csv en quetion
         print(f"Erreur lors de la lecture de {file}: {e}")
+        return file
+    return None
+
+
+# Empreinte d'un fichier : taille, inode et condensé des TAIL_BYTES octets précédant sa fin
+# Les chroniques de data/ ne font que grandir (ajouts en fin de fichier, cf. hubeau.py)
+def file_mark(file_path, size=None):
+    stat = os.stat(file_path)
+    size = stat.st_size if size is None else size
+    with open(file_path, "rb") as f:
+        f.seek(max(size - TAIL_BYTES, 0))
+        tail = f.read(size - max(size - TAIL_BYTES, 0))
+    return {"size": size, "inode": stat.st_ino, "tail": hashlib.blake2b(tail, digest_size=16).hexdigest()}
+
+
+# Octet à partir duquel relire chaque fichier (0 : fichier nouveau), ou None si un fichier déjà lu a été
+# supprimé, remplacé ou modifié ailleurs qu'en fin de fichier (reconstruction complète)
+def delta_offsets(csv_files, marks):
+    if marks is None or marks.get("table") != table_version(OUTPUT_TABLE):
+        return None
+    if set(marks["files"]) - set(csv_files):
+        return None
+    offsets = {}
+    for file in csv_files:
+        previous = marks["files"].get(file)
+        path = os.path.join(INPUT_DIR, file)
+        if previous is None:
+            offsets[file] = 0
+            continue
+        if os.stat(path).st_size < previous["size"] or file_mark(path, previous["size"]) != previous:
+            return None
+        if os.stat(path).st_size > previous["size"]:
+            offsets[file] = previous["size"]
+    return offsets
+
+
+def main():
+    # Vérifier et créer le dossier de sortie si nécessaire
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    # Récupérer tous les fichiers CSV dans le dossier INPUT_DIR
+    csv_files = sorted(f for f in os.listdir(INPUT_DIR) if f.endswith(".csv"))
+    if not csv_files:
+        print("Aucun fichier CSV valide trouvé pour la concaténation.")
+        return
+    check_header(os.path.join(INPUT_DIR, csv_files[0]))
+    marks = {file: file_mark(os.path.join(INPUT_DIR, file)) for file in csv_files}
+
+    # Mode incrémental : seules les lignes ajoutées aux fichiers depuis la dernière exécution sont lues,
+    # puis ajoutées à la table en un nouveau segment
+    # (un fichier illisible garde sa marque précédente : il sera relu à partir du même octet)
+    previous = load_marks(STAGE)
+    offsets = delta_offsets(csv_files, previous)
+    if offsets is not None:
+        delta = []
+        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [(file, executor.submit(read_chronicle, os.path.join(INPUT_DIR, file), offset,
+                                              marks[file]["size"])) for file, offset in offsets.items()]
+            for file, future in futures:
+                try:
+                    delta.append(future.result())
+                except Exception as e:
+                    print(f"Erreur lors de la lecture de {file}: {e}")
+                    if file in previous["files"]:
+                        marks[file] = previous["files"][file]
+                    else:
+                        del marks[file]
+        delta = pd.concat(delta, ignore_index=True) if delta else pd.DataFrame(columns=COLUMNS)
+        version = table_version(OUTPUT_TABLE)
+        if not delta.empty:
+            version = append_segment(delta, OUTPUT_TABLE, column="date_mesure")
+        save_marks(STAGE, {"table": version, "files": marks})
+        print(f"{len(delta)} ligne(s) ajoutée(s) à {OUTPUT_TABLE} depuis {len(offsets)} fichier(s) modifié(s)")
+        return
+
+    # Lecture parallèle, écriture incrémentale dans l'ordre des fichiers :
+    # au plus MAX_PENDING fichiers sont en mémoire, jamais le jeu de données complet
+    # (fichiers illisibles exclus de la marque : ils seront relus en entier à la prochaine exécution)
+    clear_marks(STAGE)
+    failed = []
+    with TableWriter(OUTPUT_TABLE) as writer, ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque()
+        for file in csv_files:
+            pending.append((file, executor.submit(read_chronicle, os.path.join(INPUT_DIR, file))))
+            if len(pending) >= MAX_PENDING:
+                failed.append(write_next(pending, writer))
+        while pending:
+            failed.append(write_next(pending, writer))
+
+    if writer.rows:
+        marks = {file: mark for file, mark in marks.items() if file not in failed}
+        save_marks(STAGE, {"table": table_version(OUTPUT_TABLE), "files": marks})
+        print(f"Données concaténées enregistrées dans {writer.path} ({writer.rows} lignes)")
+    else:
+        print("Aucun fichier CSV valide trouvé pour la concaténation.")
+
 
-# Concaténer toutes les données en un seul DataFrame
-if df_list:
-    df_all = pd.concat(df_list, ignore_index=True)
-    
-    # Sauvegarder le fichier final
-    df_all.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
-    print(f"Données concaténées enregistrées dans {OUTPUT_FILE}")
-else:
-    print("Aucun fichier CSV valide trouvé pour la concaténation.")
+if __name__ == "__main__":
+    main()
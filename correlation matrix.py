@@ -1,33 +1,47 @@
 import os
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+from correlation_engine import correlation_graph, plot_correlation, top_k_neighbors
+from storage import load_table, save_table, table_exists
 
 # Définition des paramètres
-INPUT_FILE = "data_all/nappes_preprocessed_agg_smoothed.csv"  # Fichier des données agrégées
+INPUT_TABLE = "data_all/nappes_preprocessed_agg_smoothed"  # Table des données agrégées
 OUTPUT_FILE = "graphs/correlation_matrix.png"  # Fichier de sortie pour la matrice de corrélation
+OUTPUT_NEIGHBORS = "data_all/correlation_neighbors"  # k piézomètres les plus corrélés à chacun
+OUTPUT_GRAPH = "data_all/correlation_graph"  # Paires de piézomètres fortement corrélés (graphe creux)
+TOP_K = int(os.environ.get("CORRELATION_TOP_K", "10"))
+THRESHOLD = float(os.environ.get("CORRELATION_THRESHOLD", "0.9"))  # |corrélation| minimale d'une arête du graphe
 
-# Charger les données
-if not os.path.exists(INPUT_FILE):
-    raise FileNotFoundError(f"Le fichier {INPUT_FILE} est introuvable.")
 
-df = pd.read_csv(INPUT_FILE, sep=";", dtype=float)
+def main():
+    # Charger les données
+    if not table_exists(INPUT_TABLE):
+        raise FileNotFoundError(f"La table {INPUT_TABLE} est introuvable.")
 
-# Vérifier si les données sont bien chargées
-if df.empty:
-    raise ValueError("Le fichier chargé est vide.")
+    df = load_table(INPUT_TABLE)
 
-# Calcul de la matrice de corrélation
-corr_matrix = df.iloc[:, 1:].corr()  # Exclure 'jour_annee' si présent
+    # Vérifier si les données sont bien chargées
+    if df.empty:
+        raise ValueError("Le fichier chargé est vide.")
 
-# Visualisation de la matrice de corrélation
-plt.figure(figsize=(12, 8))
-sns.heatmap(corr_matrix, annot=True, cmap="coolwarm", fmt=".2f", linewidths=0.5)
-plt.title("Matrice de corrélation des niveaux des nappes phréatiques")
+    # Corrélations par blocs de piézomètres (cf. correlation_engine.py), valeurs manquantes traitées paire par paire
+    stations = list(df.columns[1:])  # Exclure 'jour_annee' si présent
+    values = df[stations].to_numpy(np.float32)
 
-# Sauvegarder la figure
-plt.savefig(OUTPUT_FILE, dpi=300, bbox_inches='tight')
-# plt.show()
+    neighbors = top_k_neighbors(values, stations, TOP_K)
+    save_table(neighbors, OUTPUT_NEIGHBORS)
+    print(f"{TOP_K} piézomètres les plus corrélés à chacun enregistrés dans {OUTPUT_NEIGHBORS} "
+          f"({len(neighbors)} lignes)")
 
-print(f"Matrice de corrélation enregistrée sous {OUTPUT_FILE}")
\ No newline at end of file
+    graph = correlation_graph(values, stations, THRESHOLD)
+    save_table(graph, OUTPUT_GRAPH)
+    print(f"Graphe des corrélations >= {THRESHOLD} enregistré dans {OUTPUT_GRAPH} ({len(graph)} paires)")
+
+    # Visualisation de la matrice de corrélation (annotée, ordonnée par classification ou réduite par blocs)
+    plot_correlation(values, stations, OUTPUT_FILE, "Matrice de corrélation des niveaux des nappes phréatiques")
+
+    print(f"Matrice de corrélation enregistrée sous {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
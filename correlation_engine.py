@@ -0,0 +1,177 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from scipy.cluster.hierarchy import leaves_list, linkage
+from scipy.spatial.distance import squareform
+
+# Corrélations entre stations (colonnes d'une matrice jours x stations) par produits matriciels float32
+# par blocs de stations, sur les colonnes centrées-réduites ; les valeurs manquantes sont traitées paire
+# par paire (seuls les jours renseignés pour les deux stations comptent, comme DataFrame.corr)
+
+# Définition des paramètres
+BLOCK_SIZE = 1024  # Stations par bloc (voisins et graphe calculés sans construire la matrice complète)
+MIN_PERIODS = 2  # Jours communs minimaux pour qu'une corrélation soit définie
+MAX_ANNOTATED = 30  # En dessous, heatmap annotée de toutes les valeurs
+MAX_CLUSTERED = 5000  # En dessous, stations ordonnées par classification hiérarchique (voisines à l'écran)
+HEATMAP_BINS = 400  # Au-delà, la matrice est réduite à HEATMAP_BINS x HEATMAP_BINS moyennes de blocs
+
+
+# Colonnes centrées-réduites (float32, 0 là où la valeur manque) et masque des valeurs renseignées
+# Une colonne de moins de MIN_PERIODS valeurs ou constante est entièrement masquée (corrélations NaN)
+def standardize(values):
+    values = np.asarray(values, dtype=np.float64)
+    mask = ~np.isnan(values)
+    count = mask.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(mask, values, 0).sum(axis=0) / count
+        std = np.sqrt(np.where(mask, (values - mean) ** 2, 0).sum(axis=0) / (count - 1))
+    usable = (count >= MIN_PERIODS) & (std > 0)
+    mask &= usable
+    z = np.where(mask, (values - mean) / np.where(usable, std, 1), 0)
+    return z.astype(np.float32), mask.astype(np.float32)
+
+
+# Corrélations du bloc de stations [i0, i1) x [j0, j1) et nombre de jours communs de chaque paire
+# Données complètes : un seul produit (z centrées-réduites, ddof=1) ; sinon sommes restreintes aux jours
+# communs à chaque paire, obtenues par produits avec les masques
+def block_correlation(z, mask, i0, i1, j0, j1, complete=False):
+    a, b = z[:, i0:i1], z[:, j0:j1]
+    if complete:
+        n = np.full((i1 - i0, j1 - j0), len(z), dtype=np.float64)
+        corr = (a.T @ b).astype(np.float64) / (len(z) - 1)
+    else:
+        ma, mb = mask[:, i0:i1], mask[:, j0:j1]
+        n = (ma.T @ mb).astype(np.float64)
+        sx, sy = (a.T @ mb).astype(np.float64), (ma.T @ b).astype(np.float64)
+        sxx, syy = ((a * a).T @ mb).astype(np.float64), (ma.T @ (b * b)).astype(np.float64)
+        sxy = (a.T @ b).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    corr = np.where(n >= MIN_PERIODS, np.clip(corr, -1, 1), np.nan)
+    return corr.astype(np.float32), n.astype(np.int64)
+
+
+# Parcours des blocs du triangle supérieur (j0 >= i0) : (i0, j0, corrélations, jours communs)
+def iter_blocks(values, block_size=BLOCK_SIZE):
+    z, mask = standardize(values)
+    complete = bool(mask.all())
+    m = z.shape[1]
+    for i0 in range(0, m, block_size):
+        for j0 in range(i0, m, block_size):
+            i1, j1 = min(i0 + block_size, m), min(j0 + block_size, m)
+            corr, n = block_correlation(z, mask, i0, i1, j0, j1, complete)
+            yield i0, j0, corr, n
+
+
+# Matrice complète (stations x stations, float32)
+def correlation_matrix(values, block_size=BLOCK_SIZE):
+    m = np.asarray(values).shape[1]
+    matrix = np.empty((m, m), dtype=np.float32)
+    for i0, j0, corr, _ in iter_blocks(values, block_size):
+        matrix[i0:i0 + corr.shape[0], j0:j0 + corr.shape[1]] = corr
+        matrix[j0:j0 + corr.shape[1], i0:i0 + corr.shape[0]] = corr.T
+    return matrix
+
+
+# k stations les plus corrélées à chacune (corrélation la plus forte, la station elle-même exclue),
+# sans construire la matrice complète : table longue CODE_BSS, rang, voisin, correlation, n_communs
+def top_k_neighbors(values, codes, k, block_size=BLOCK_SIZE):
+    codes = np.asarray(codes)
+    m = len(codes)
+    k = min(k, m - 1)
+    columns = ["CODE_BSS", "rang", "voisin", "correlation", "n_communs"]
+    if k <= 0:
+        return pd.DataFrame(columns=columns)
+    best = np.full((m, k), -np.inf, dtype=np.float32)
+    best_index = np.full((m, k), -1, dtype=np.int64)
+    best_n = np.zeros((m, k), dtype=np.int64)
+
+    def merge(rows, cols, corr, n):
+        candidates = np.concatenate([best[rows], np.where(np.isnan(corr), -np.inf, corr)], axis=1)
+        index = np.concatenate([best_index[rows], np.broadcast_to(cols, corr.shape)], axis=1)
+        counts = np.concatenate([best_n[rows], n], axis=1)
+        keep = np.argpartition(-candidates, k - 1, axis=1)[:, :k]
+        best[rows] = np.take_along_axis(candidates, keep, axis=1)
+        best_index[rows] = np.take_along_axis(index, keep, axis=1)
+        best_n[rows] = np.take_along_axis(counts, keep, axis=1)
+
+    for i0, j0, corr, n in iter_blocks(values, block_size):
+        rows, cols = np.arange(i0, i0 + corr.shape[0]), np.arange(j0, j0 + corr.shape[1])
+        if i0 == j0:
+            np.fill_diagonal(corr, np.nan)
+        merge(rows, cols, corr, n)
+        if i0 != j0:
+            merge(cols, rows, corr.T, n.T)
+
+    order = np.argsort(-best, axis=1, kind="stable")
+    best, best_index, best_n = (np.take_along_axis(a, order, axis=1) for a in (best, best_index, best_n))
+    station, rank = np.nonzero(np.isfinite(best))
+    return pd.DataFrame({"CODE_BSS": codes[station], "rang": rank + 1, "voisin": codes[best_index[station, rank]],
+                         "correlation": best[station, rank], "n_communs": best_n[station, rank]}, columns=columns)
+
+
+# Graphe creux : paires de stations dont la corrélation atteint threshold en valeur absolue
+# (une ligne par paire, station_a < station_b dans l'ordre des colonnes)
+def correlation_graph(values, codes, threshold, block_size=BLOCK_SIZE):
+    codes = np.asarray(codes)
+    frames = []
+    for i0, j0, corr, n in iter_blocks(values, block_size):
+        rows, cols = np.nonzero(np.abs(np.nan_to_num(corr)) >= threshold)
+        keep = i0 + rows < j0 + cols
+        rows, cols = rows[keep], cols[keep]
+        frames.append(pd.DataFrame({"station_a": codes[i0 + rows], "station_b": codes[j0 + cols],
+                                    "correlation": corr[rows, cols], "n_communs": n[rows, cols]}))
+    return pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=["station_a", "station_b", "correlation", "n_communs"])
+
+
+# Ordre des stations par classification hiérarchique (distance 1 - corrélation, lien moyen)
+def cluster_order(matrix):
+    distance = 1 - np.nan_to_num(matrix, nan=0.0).astype(np.float64)
+    distance = (distance + distance.T) / 2
+    np.fill_diagonal(distance, 0)
+    return leaves_list(linkage(squareform(np.clip(distance, 0, 2), checks=False), method="average"))
+
+
+# Matrice réduite : moyenne des corrélations de chaque bloc (groupes de stations consécutives dans order)
+def binned_matrix(values, order, n_bins, block_size=BLOCK_SIZE):
+    m = len(order)
+    group = np.empty(m, dtype=np.int64)
+    group[order] = np.arange(m) * n_bins // m
+    sums, counts = np.zeros(n_bins * n_bins), np.zeros(n_bins * n_bins)
+    for i0, j0, corr, _ in iter_blocks(values, block_size):
+        rows, cols = group[i0:i0 + corr.shape[0]], group[j0:j0 + corr.shape[1]]
+        valid = ~np.isnan(corr)
+        # Bloc du triangle supérieur et, hors diagonale, son symétrique
+        upper, lower = rows[:, None] * n_bins + cols[None, :], cols[None, :] * n_bins + rows[:, None]
+        for keys in ((upper, lower) if i0 != j0 else (upper,)):
+            sums += np.bincount(keys[valid], weights=corr[valid], minlength=n_bins * n_bins)
+            counts += np.bincount(keys[valid], minlength=n_bins * n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_bins, n_bins)
+
+
+# Heatmap adaptée au nombre de stations : annotée (peu de stations), complète ordonnée par classification,
+# ou réduite à HEATMAP_BINS blocs (stations ordonnées par classification jusqu'à MAX_CLUSTERED)
+def plot_correlation(values, codes, output_file, title):
+    m = len(codes)
+    plt.figure(figsize=(12, 8))
+    if m <= MAX_ANNOTATED:
+        matrix = pd.DataFrame(correlation_matrix(values), index=codes, columns=codes)
+        sns.heatmap(matrix, annot=True, cmap="coolwarm", fmt=".2f", linewidths=0.5)
+    else:
+        matrix = correlation_matrix(values) if m <= MAX_CLUSTERED else None
+        order = cluster_order(matrix) if matrix is not None else np.arange(m)
+        if m <= HEATMAP_BINS:
+            shown = matrix[np.ix_(order, order)]
+            labels = np.asarray(codes)[order] if m <= 2 * MAX_ANNOTATED else False
+        else:
+            shown = binned_matrix(values, order, HEATMAP_BINS)
+            labels = False
+            title = f"{title} ({m} stations, moyennes par blocs de {m / HEATMAP_BINS:.1f} stations)"
+        sns.heatmap(shown, cmap="coolwarm", vmin=-1, vmax=1, xticklabels=labels, yticklabels=labels,
+                    rasterized=True)
+    plt.title(title)
+    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    plt.close()
@@ -0,0 +1,74 @@
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft
+
+MAX_LAG = 400  # Décalage maximal testé par défaut (jours)
+BATCH_SIZE = 256  # Nombre de stations traitées par appel FFT (borne la mémoire)
+
+
+# Empilement de séries de longueurs différentes dans une matrice complétée par des zéros
+def pad_series(series_list, width):
+    batch = np.zeros((len(series_list), width), dtype=np.float64)
+    for i, series in enumerate(series_list):
+        batch[i, :len(series)] = series
+    return batch
+
+
+# Sommes cumulées avec un zéro en tête : cumsum[:, j] = somme des j premières valeurs
+def prefix_sums(batch):
+    sums = np.zeros((batch.shape[0], batch.shape[1] + 1), dtype=np.float64)
+    np.cumsum(batch, axis=1, out=sums[:, 1:])
+    return sums
+
+
+# Corrélation de Pearson entre x[t] et y[t + k] pour tous les décalages k = 1..max_lag
+# et toutes les stations d'un lot, en un seul passage FFT :
+#  - le terme croisé sum(x[t] * y[t + k]) vient de la corrélation croisée par FFT ;
+#  - les sommes et sommes de carrés de chaque fenêtre recouvrante viennent de sommes cumulées,
+#    ce qui donne la normalisation exacte de chaque décalage (identique à np.corrcoef)
+# Retourne une matrice (stations x max_lag) ; NaN si le décalage dépasse la série ou si l'écart-type est nul
+def lagged_correlation(x_list, y_list, max_lag=MAX_LAG):
+    lengths = np.array([len(x) for x in x_list])
+    width = int(lengths.max())
+    lags = np.arange(1, max_lag + 1)
+
+    # Centrage par station pour limiter les erreurs d'arrondi (la corrélation n'en dépend pas)
+    x = pad_series([np.asarray(s, dtype=np.float64) - np.mean(s) for s in x_list], width)
+    y = pad_series([np.asarray(s, dtype=np.float64) - np.mean(s) for s in y_list], width)
+
+    nfft = next_fast_len(width + max_lag + 1)
+    cross = irfft(np.conj(rfft(x, nfft, axis=1)) * rfft(y, nfft, axis=1), nfft, axis=1)[:, 1:max_lag + 1]
+
+    cx, cxx = prefix_sums(x), prefix_sums(x * x)
+    cy, cyy = prefix_sums(y), prefix_sums(y * y)
+
+    # Fenêtre du décalage k : x[0 : n - k] et y[k : n]
+    end_x = np.clip(lengths[:, None] - lags[None, :], 0, None)
+    start_y = np.minimum(lags[None, :], lengths[:, None])
+    end_y = np.broadcast_to(lengths[:, None], end_x.shape)
+    count = end_x.astype(np.float64)
+
+    sx = np.take_along_axis(cx, end_x, axis=1)
+    sxx = np.take_along_axis(cxx, end_x, axis=1)
+    sy = np.take_along_axis(cy, end_y, axis=1) - np.take_along_axis(cy, start_y, axis=1)
+    syy = np.take_along_axis(cyy, end_y, axis=1) - np.take_along_axis(cyy, start_y, axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = count * cross - sx * sy
+        var = (count * sxx - sx * sx) * (count * syy - sy * sy)
+        corr = cov / np.sqrt(var)
+    corr[(count < 2) | ~(var > 0)] = np.nan
+    return corr
+
+
+# Meilleur décalage (en jours, à partir de 1) et corrélation associée pour chaque station
+# Les stations sont traitées par lots de BATCH_SIZE pour borner la mémoire des FFT
+def best_lags(x_list, y_list, max_lag=MAX_LAG, batch_size=BATCH_SIZE):
+    best_lag = np.full(len(x_list), -1, dtype=np.int64)
+    best_corr = np.full(len(x_list), np.nan)
+    for start in range(0, len(x_list), batch_size):
+        corr = lagged_correlation(x_list[start:start + batch_size], y_list[start:start + batch_size], max_lag)
+        valid = ~np.all(np.isnan(corr), axis=1)
+        index = np.flatnonzero(valid) + start
+        best_lag[index] = np.nanargmax(corr[valid], axis=1) + 1  # +1 car on commence à 1 jour de décalage
+        best_corr[index] = np.nanmax(corr[valid], axis=1)
+    return best_lag, best_corr
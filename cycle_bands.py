@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Définition des paramètres
+# Bandes de périodes (jours, bornes incluses) : nom, borne basse, borne haute
+DEFAULT_BANDS = [
+    ("Hebdomadaire", 7 - 2, 7 + 2),  # 7 jours ± 2 jours
+    ("Mensuel", 30 - 5, 30 + 5),  # 30 jours ± 5 jours
+    ("Saisonnalité Courte", 180 - 20, 180 + 20),  # 180 jours ± 20 jours
+    ("Annuel", 365 - 30, 365 + 30),  # 365 jours ± 30 jours
+    ("Cycle ENSO", 730 - 100, 730 + 100),  # 2 ans ± 100 jours
+    ("Cycle Long", 3650 - 500, 3650 + 500),  # 10 ans ± 500 jours
+]
+# Fichier CSV optionnel remplaçant les bandes par défaut (colonnes nom;min;max, séparateur ";")
+BANDS_FILE = os.environ.get("CYCLE_BANDS_FILE", "")
+
+
+# Table des bandes : noms, bornes basses et hautes triées par borne basse
+# Les bandes ne doivent pas se chevaucher (chaque période appartient à au plus une bande)
+def band_table(bands=None):
+    if bands is None:
+        bands = load_bands(BANDS_FILE) if BANDS_FILE else DEFAULT_BANDS
+    if not len(bands):
+        raise ValueError("Aucune bande de cycle définie")
+    names = [name for name, _, _ in bands]
+    lows = np.array([low for _, low, _ in bands], dtype=np.float64)
+    highs = np.array([high for _, _, high in bands], dtype=np.float64)
+    if len(set(names)) != len(names):
+        raise ValueError(f"Noms de bandes en double : {names}")
+    if (highs < lows).any():
+        raise ValueError("Bande de cycle avec une borne haute inférieure à la borne basse")
+    order = np.argsort(lows, kind="stable")
+    lows, highs = lows[order], highs[order]
+    if (lows[1:] <= highs[:-1]).any():
+        raise ValueError("Les bandes de cycle se chevauchent")
+    return [names[i] for i in order], lows, highs
+
+
+def load_bands(path):
+    df = pd.read_csv(path, sep=";")
+    return list(df[["nom", "min", "max"]].itertuples(index=False, name=None))
+
+
+# Bande de chaque période (indice dans la table), -1 si la période ne tombe dans aucune bande
+def classify(periods, lows, highs):
+    periods = np.asarray(periods, dtype=np.float64)
+    band = np.searchsorted(lows, periods, side="right") - 1
+    inside = (band >= 0) & (periods <= highs[np.maximum(band, 0)])
+    return np.where(inside, band, -1)
+
+
+# Mise à plat des pics de toutes les séries : périodes et indice de la série de chaque pic
+def flatten_peaks(peaks_per_series):
+    lengths = np.array([len(peaks) for peaks in peaks_per_series], dtype=np.int64)
+    if not lengths.sum():
+        return np.empty(0), np.empty(0, dtype=np.int64)
+    periods = np.concatenate([np.asarray(peaks, dtype=np.float64) for peaks in peaks_per_series])
+    return periods, np.repeat(np.arange(len(lengths)), lengths)
+
+
+# Matrice de présence (séries x bandes, uint8) : 1 si au moins un pic de la série tombe dans la bande
+def presence_matrix(periods, series, n_series, lows, highs):
+    band = classify(periods, lows, highs)
+    matched = band >= 0
+    matrix = np.zeros((n_series, len(lows)), dtype=np.uint8)
+    matrix[series[matched], band[matched]] = 1
+    return matrix
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+
+# Définition des paramètres
+FIGURE_FORMAT = os.environ.get("FIGURE_FORMAT", "png")  # "png" ou "svg"
+MAX_WORKERS = os.cpu_count() or 1
+TASKS_PER_WORKER = 4  # Découpage des figures en lots, pour équilibrer la charge entre processus
+MANIFEST_FILE = ".figures.json"  # Empreinte des données de chaque figure, par dossier de sortie
+
+# Figures réutilisées d'un rendu à l'autre dans un même processus (une par taille)
+_figures = {}
+
+# Empreinte du code de rendu : toute modification de ce fichier invalide les figures déjà produites
+with open(__file__, "rb") as f:
+    RENDERER_DIGEST = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+
+# Spécification d'une figure : type de tracé, fichier de sortie (sans extension), données et options
+def figure_spec(kind, path, data, **options):
+    return {"kind": kind, "path": path, "data": data, "options": options}
+
+
+def get_figure(figsize):
+    fig = _figures.get(figsize)
+    if fig is None:
+        fig = _figures[figsize] = Figure(figsize=figsize)
+    else:
+        fig.clear()
+    return fig
+
+
+# Tracés disponibles : chacun dessine dans une figure réutilisée (sans pyplot) et la retourne
+def draw_line(data, options):
+    fig = get_figure(options.get("figsize", (6.4, 4.8)))
+    ax = fig.subplots()
+    ax.plot(data["x"], data["y"], label=options.get("label"), color=options.get("color", "blue"))
+    if "title" in options:
+        ax.set_title(options["title"])
+    return fig
+
+
+# Composantes précalculées (cf. spectral.decompose)
+def draw_decomposition(data, options):
+    fig = get_figure((12, 8))
+    axes = fig.subplots(4, 1, sharex=True)
+    for ax, name, title in zip(axes, ["observed", "trend", "seasonal", "resid"],
+                               ["Série originale", "Tendance", "Saisonnalité", "Résidu"]):
+        ax.plot(data["x"], data[name])
+        ax.set_title(title)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return fig
+
+
+# ACF précalculée (cf. spectral.acf), avec l'intervalle de confiance à 95 % de Bartlett comme plot_acf
+def draw_acf(data, options):
+    values = data["acf"][~np.isnan(data["acf"])]
+    lags = np.arange(len(values))
+    variance = np.ones(len(values)) / data["n"]
+    variance[2:] *= 1 + 2 * np.cumsum(values[1:-1] ** 2)
+    band = 1.959963984540054 * np.sqrt(variance)
+    band[0] = 0
+
+    fig = get_figure((6.4, 4.8))
+    ax = fig.subplots()
+    ax.vlines(lags, 0, values, linewidth=0.5)
+    ax.plot(lags, values, "o", markersize=2)
+    ax.axhline(0, color="black", linewidth=0.5)
+    ax.fill_between(lags, -band, band, alpha=0.25, linewidth=0)
+    ax.set_title("Fonction d'Auto-corrélation (ACF)")
+    return fig
+
+
+def draw_spectrum(data, options):
+    periods, power, peaks = data["periods"], data["power"], data["peaks"]
+    significant_periods, significant_powers = periods[peaks], power[peaks]
+
+    fig = get_figure((12, 5))
+    ax = fig.subplots()
+    ax.plot(periods, power, label="Spectre de Fourier")
+    ax.scatter(significant_periods, significant_powers, color="red", label="Pics détectés", marker="o")
+    for period, value in zip(significant_periods, significant_powers):
+        ax.annotate(f"{period:.0f} jours", (period, value), fontsize=10, ha="right")
+    ax.set_xlim(0, options.get("max_period", 4000))
+    ax.set_xlabel("Période (jours)")
+    ax.set_ylabel("Puissance du signal")
+    ax.set_title("Analyse spectrale - Détection des cycles hydrologiques")
+    ax.legend()
+    ax.grid()
+    return fig
+
+
+def draw_level_rain(data, options):
+    fig = get_figure((12, 6))
+    ax1 = fig.subplots()
+    ax1.set_xlabel("Date")
+    ax1.set_ylabel("Niveau nappe (m)", color="blue")
+    ax1.plot(data["x"], data["level"], color="blue", label="Niveau nappe")
+    ax1.tick_params(axis="y", labelcolor="blue")
+
+    ax2 = ax1.twinx()
+    ax2.set_ylabel("Précipitation (mm)", color="red")
+    ax2.bar(data["x"], data["rain"], color="red", alpha=0.5, label="Précipitations")
+    ax2.tick_params(axis="y", labelcolor="red")
+
+    fig.tight_layout()
+    ax2.set_title(options.get("title", ""))
+    return fig
+
+
+RENDERERS = {
+    "line": draw_line,
+    "decomposition": draw_decomposition,
+    "acf": draw_acf,
+    "spectrum": draw_spectrum,
+    "level_rain": draw_level_rain,
+}
+
+
+# Empreinte des entrées d'une figure (type, options, données, code de rendu)
+def spec_digest(spec, fmt):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([spec["kind"], fmt, RENDERER_DIGEST, spec["options"]], sort_keys=True,
+                             default=str).encode("utf-8"))
+    for name in sorted(spec["data"]):
+        array = np.ascontiguousarray(spec["data"][name])
+        digest.update(f"{name}:{array.dtype.str}:{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def render(spec, fmt):
+    fig = RENDERERS[spec["kind"]](spec["data"], spec["options"])
+    output_file = f"{spec['path']}.{fmt}"
+    fig.savefig(output_file, format=fmt)
+    return output_file
+
+
+# Rendu d'un lot de figures ; l'erreur d'une figure n'interrompt pas les autres
+def render_batch(specs, fmt):
+    results = []
+    for spec in specs:
+        try:
+            results.append((spec["path"], render(spec, fmt), None))
+        except Exception:
+            results.append((spec["path"], None, traceback.format_exc()))
+    return results
+
+
+def init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# Rendu d'une liste de spécifications sur le backend Agg, réparti sur plusieurs processus
+# Les figures dont les données n'ont pas changé depuis le dernier rendu (et dont le fichier existe) sont sautées
+# Retourne les fichiers produits, le nombre de figures sautées et les erreurs par figure (trace complète)
+def render_figures(specs, fmt=FIGURE_FORMAT, max_workers=MAX_WORKERS, skip_unchanged=True):
+    manifests, todo, digests = {}, [], {}
+    for spec in specs:
+        directory, name = os.path.split(spec["path"])
+        manifest = manifests.setdefault(directory, load_manifest(directory) if skip_unchanged else {})
+        digest = spec_digest(spec, fmt)
+        if skip_unchanged and manifest.get(f"{name}.{fmt}") == digest and os.path.exists(f"{spec['path']}.{fmt}"):
+            continue
+        digests[spec["path"]] = digest
+        todo.append(spec)
+
+    if max_workers <= 1 or len(todo) <= 1:
+        outcomes = render_batch(todo, fmt)
+    else:
+        n_chunks = min(len(todo), max_workers * TASKS_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker) as executor:
+            futures = [executor.submit(render_batch, todo[i::n_chunks], fmt) for i in range(n_chunks)]
+            outcomes = [outcome for future in futures for outcome in future.result()]
+
+    rendered, errors = [], {}
+    for path, output_file, error in outcomes:
+        directory, name = os.path.split(path)
+        if error is None:
+            rendered.append(output_file)
+            manifests[directory][f"{name}.{fmt}"] = digests[path]
+        else:
+            errors[path] = error
+            manifests[directory].pop(f"{name}.{fmt}", None)
+            print(f"Erreur lors du rendu de la figure {path} :\n{error}")
+    for directory, manifest in manifests.items():
+        save_manifest(directory, manifest)
+    return rendered, len(specs) - len(todo), errors
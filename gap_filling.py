@@ -0,0 +1,199 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.interpolate import CubicSpline, PchipInterpolator
+
+from station_executor import MAX_WORKERS, attach_arrays, share_arrays
+
+# Définition des paramètres
+# Méthodes : "linear", "pchip" (monotone par morceaux), "spline" (cubique locale bornée),
+# "seasonal" (climatologie journalière de la station + interpolation linéaire de l'anomalie)
+METHODS = ("linear", "pchip", "spline", "seasonal")
+METHOD = os.environ.get("GAP_FILL_METHOD", "spline")
+MAX_GAP = int(os.environ.get("GAP_FILL_MAX_GAP", "60"))  # Trou maximal comblé (jours) ; au-delà la série reste vide
+SPLINE_CONTEXT = 8  # Mesures prises de part et d'autre d'un trou pour la spline locale
+SEASONAL_WINDOW = 15  # Lissage circulaire (jours) de la climatologie journalière
+ROWS_PER_TASK = 32  # Piézomètres traités par tâche en parallèle
+PARALLEL_MIN_CELLS = 20_000_000  # En dessous, le comblement se fait dans le processus courant
+
+
+# Trous intérieurs (encadrés par deux mesures) d'au plus max_gap jours manquants
+# Retourne les positions de début et de fin (exclue) de chaque trou à combler
+def fillable_gaps(missing, days, max_gap):
+    edges = np.diff(np.concatenate([[0], missing.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    interior = (starts > 0) & (stops < len(missing))
+    starts, stops = starts[interior], stops[interior]
+    span = days[stops] - days[starts - 1] - 1  # Jours manquants entre les deux mesures encadrantes
+    keep = span <= max_gap
+    return starts[keep], stops[keep]
+
+
+# Pentes aux nœuds des splines cubiques d'interpolation (conditions "not-a-knot", comme scipy CubicSpline)
+# de G séries de n >= 4 points, résolues ensemble ; x, y de forme (G, n)
+def not_a_knot_slopes(x, y):
+    h = np.diff(x, axis=1)
+    d = np.diff(y, axis=1) / h
+    g, n = x.shape
+    a = np.zeros((g, n, n))
+    b = np.zeros((g, n))
+    i = np.arange(1, n - 1)
+    a[:, i, i - 1] = h[:, 1:]
+    a[:, i, i] = 2 * (h[:, :-1] + h[:, 1:])
+    a[:, i, i + 1] = h[:, :-1]
+    b[:, 1:-1] = 3 * (h[:, 1:] * d[:, :-1] + h[:, :-1] * d[:, 1:])
+    span = h[:, 0] + h[:, 1]
+    a[:, 0, 0], a[:, 0, 1] = h[:, 1], span
+    b[:, 0] = ((h[:, 0] + 2 * span) * h[:, 1] * d[:, 0] + h[:, 0] ** 2 * d[:, 1]) / span
+    span = h[:, -2] + h[:, -1]
+    a[:, -1, -2], a[:, -1, -1] = span, h[:, -2]
+    b[:, -1] = (h[:, -1] ** 2 * d[:, -2] + (2 * span + h[:, -1]) * h[:, -2] * d[:, -1]) / span
+    return np.linalg.solve(a, b[..., None])[..., 0]
+
+
+# Valeurs en t des splines de points x, y (G, n) : t[v] est dans l'intervalle interval[row[v]] de la spline row[v]
+def eval_splines(x, y, interval, t, row):
+    if x.shape[1] < 4:
+        return np.array([CubicSpline(x[r], y[r])(v) for r, v in zip(row, t)])
+    slopes = not_a_knot_slopes(x, y)
+    i = interval[row]
+    x0, h = x[row, i], x[row, i + 1] - x[row, i]
+    u = (t - x0) / h
+    return ((2 * u ** 3 - 3 * u ** 2 + 1) * y[row, i] + (u ** 3 - 2 * u ** 2 + u) * h * slopes[row, i]
+            + (3 * u ** 2 - 2 * u ** 3) * y[row, i + 1] + (u ** 3 - u ** 2) * h * slopes[row, i + 1])
+
+
+# Spline cubique locale : chaque trou est comblé par la spline d'interpolation des SPLINE_CONTEXT mesures
+# de part et d'autre, bornée par leurs extrêmes (pas de dépassement ni d'oscillation dans les trous)
+# Le comblement d'un trou ne dépend que de ces mesures (cf. preprocess_data_all.station_windows)
+def bounded_spline(y, days, valid, fill, starts, stops):
+    x_valid, y_valid = days[valid], y[valid]
+    k = np.searchsorted(np.flatnonzero(valid), starts)  # Première mesure après chaque trou
+    lo = np.maximum(k - SPLINE_CONTEXT, 0)
+    sizes = np.minimum(k + SPLINE_CONTEXT, len(x_valid)) - lo
+    gap = np.repeat(np.arange(len(starts)), stops - starts)  # Trou de chaque valeur à combler
+    t = days[fill]
+    estimate = np.empty(len(t))
+
+    # Trous regroupés par nombre de mesures voisines (inférieur à 2 * SPLINE_CONTEXT près des extrémités)
+    for size in np.unique(sizes):
+        selected = np.flatnonzero(sizes == size)
+        points = lo[selected, None] + np.arange(size)
+        x, y_points = x_valid[points], y_valid[points]
+        values = np.isin(gap, selected)
+        row = np.searchsorted(selected, gap[values])
+        spline = eval_splines(x, y_points, k[selected] - 1 - lo[selected], t[values], row)
+        estimate[values] = np.clip(spline, y_points.min(axis=1)[row], y_points.max(axis=1)[row])
+    y[fill] = estimate
+
+
+# Climatologie journalière lissée (moyenne par jour de l'année sur une fenêtre circulaire)
+def climatology(y_valid, doy_valid):
+    sums = np.bincount(doy_valid, weights=y_valid, minlength=366)
+    counts = np.bincount(doy_valid, minlength=366).astype(np.float64)
+    kernel = np.ones(SEASONAL_WINDOW)
+    half = SEASONAL_WINDOW // 2
+    sums = np.convolve(np.concatenate([sums[-half:], sums, sums[:half]]), kernel, mode="valid")
+    counts = np.convolve(np.concatenate([counts[-half:], counts, counts[:half]]), kernel, mode="valid")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+# Comblement d'une série (modifiée en place) ; retourne le masque des valeurs imputées
+# days : dates en jours entiers, doy : jour de l'année (0..365)
+# method et max_gap valent par défaut METHOD et MAX_GAP, lus à l'appel
+def fill_series(y, days, doy, method=None, max_gap=None):
+    method = METHOD if method is None else method
+    max_gap = MAX_GAP if max_gap is None else max_gap
+    missing = np.isnan(y)
+    fill = np.zeros(len(y), dtype=bool)
+    if missing.all() or not missing.any():
+        return fill
+    starts, stops = fillable_gaps(missing, days, max_gap)
+    if not len(starts):
+        return fill
+
+    marks = np.zeros(len(y) + 1, dtype=np.int8)
+    marks[starts] = 1
+    marks[stops] = -1
+    fill = np.cumsum(marks[:-1]) > 0
+
+    valid = ~missing
+    x_valid, y_valid, x_fill = days[valid], y[valid], days[fill]
+    if method == "linear":
+        y[fill] = np.interp(x_fill, x_valid, y_valid)
+    elif method == "pchip":
+        y[fill] = PchipInterpolator(x_valid, y_valid)(x_fill)
+    elif method == "spline":
+        bounded_spline(y, days, valid, fill, starts, stops)
+    elif method == "seasonal":
+        clim = climatology(y_valid, doy[valid])
+        anomaly = np.interp(x_fill, x_valid, y_valid - clim[doy[valid]])
+        seasonal = clim[doy[fill]] + anomaly
+        linear = np.interp(x_fill, x_valid, y_valid)
+        y[fill] = np.where(np.isnan(seasonal), linear, seasonal)  # Jour de l'année jamais mesuré : linéaire
+    else:
+        raise ValueError(f"Méthode de comblement inconnue : {method} (attendu : {', '.join(METHODS)})")
+    return fill
+
+
+def fill_rows(values, mask, days, doy, start, stop, method, max_gap):
+    for i in range(start, stop):
+        mask[i] = fill_series(values[i], days, doy, method, max_gap)
+
+
+def fill_shared_rows(specs, start, stop, method, max_gap):
+    arrays = attach_arrays(specs)
+    fill_rows(arrays["values"], arrays["mask"], arrays["days"], arrays["doy"], start, stop, method, max_gap)
+
+
+# Comblement des trous de toutes les colonnes d'une table large (une colonne par piézomètre)
+# Les piézomètres sont répartis entre processus, la matrice étant partagée en mémoire
+# Retourne la table comblée et le masque des cellules imputées (mêmes colonnes, booléens)
+def fill_gaps(df, date_column="date_mesure", method=None, max_gap=None, max_workers=MAX_WORKERS):
+    method = METHOD if method is None else method
+    max_gap = MAX_GAP if max_gap is None else max_gap
+    if method not in METHODS:
+        raise ValueError(f"Méthode de comblement inconnue : {method} (attendu : {', '.join(METHODS)})")
+    df = df.sort_values(date_column, ignore_index=True)
+    dates = pd.DatetimeIndex(df[date_column])
+    stations = [col for col in df.columns if col != date_column]
+
+    # Une ligne par piézomètre (contiguë en mémoire)
+    arrays = {
+        "values": np.array(df[stations].to_numpy(np.float64).T, order="C"),
+        "mask": np.zeros((len(stations), len(df)), dtype=bool),
+        "days": (dates.values.astype("datetime64[D]").astype(np.int64)).astype(np.float64),
+        "doy": (dates.dayofyear.to_numpy() - 1).astype(np.int64),
+    }
+    ranges = [(start, min(start + ROWS_PER_TASK, len(stations))) for start in range(0, len(stations), ROWS_PER_TASK)]
+
+    if max_workers <= 1 or len(ranges) <= 1 or arrays["values"].size < PARALLEL_MIN_CELLS:
+        for start, stop in ranges:
+            fill_rows(arrays["values"], arrays["mask"], arrays["days"], arrays["doy"], start, stop, method, max_gap)
+        values, mask = arrays["values"], arrays["mask"]
+    else:
+        blocks, specs = share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(fill_shared_rows, specs, start, stop, method, max_gap)
+                           for start, stop in ranges]
+                for future in futures:
+                    future.result()
+            shared = {name: np.ndarray(arrays[name].shape, dtype=arrays[name].dtype, buffer=block.buf)
+                      for name, block in zip(arrays, blocks)}
+            values, mask = shared["values"].copy(), shared["mask"].copy()
+            del shared
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    df_filled = pd.DataFrame(values.T.astype(np.float32), columns=stations)
+    df_filled.insert(0, date_column, df[date_column].to_numpy())
+    df_mask = pd.DataFrame(mask.T, columns=stations)
+    df_mask.insert(0, date_column, df[date_column].to_numpy())
+    return df_filled, df_mask
@@ -1,32 +1,133 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import requests
+from hubeau import HostRateLimiter, create_session, get_with_retry
 
 # Définition du fichier d'entrée
 INPUT_FILE = "points_eau.csv"  # Nom du fichier d'entrée
-
-# Charger les données
-print("Chargement des données...")
-df = pd.read_csv(INPUT_FILE, sep=";", dtype=str)
+CACHE_FILE = "data_fixed/communes_cache.json"  # Cache persistant CODE_INSEE_COMMUNE -> département
+CACHE_TTL = 90 * 24 * 3600  # Durée de validité d'une entrée du cache (s)
+OFFLINE = os.environ.get("GEO_OFFLINE", "0") == "1"  # Mode hors-ligne : département déduit du code INSEE
+BULK_THRESHOLD = 200  # Au-delà de ce nombre de communes inconnues, on télécharge la liste complète
+MAX_WORKERS = 8  # Requêtes simultanées pour les communes inconnues
+REQUESTS_PER_SECOND = 10.0  # Débit maximal vers geo.api.gouv.fr
 
 # API pour récupérer les départements via le code INSEE de la commune
 API_URL = "https://geo.api.gouv.fr/communes/"
 
-def get_departement(code_insee):
+
+# Lecture / écriture du cache des communes
+def load_cache():
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    with open(CACHE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    tmp_file = CACHE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_file, CACHE_FILE)
+
+
+def is_fresh(entry, now):
+    return entry is not None and now - entry["fetched"] < CACHE_TTL
+
+
+# Département déduit du préfixe du code INSEE (hors-ligne)
+# Corse : 2A / 2B ; DOM : 971 à 976 (3 caractères) ; sinon les 2 premiers caractères
+def departement_from_insee(code_insee):
+    code_insee = str(code_insee).strip().upper().zfill(5)
+    if code_insee.startswith(("2A", "2B")):
+        return code_insee[:2]
+    if code_insee.startswith(("97", "98")):
+        return code_insee[:3]
+    return code_insee[:2]
+
+
+# Requête unitaire pour une commune
+def get_departement(session, limiter, code_insee):
     try:
-        response = requests.get(f"{API_URL}{code_insee}?fields=nom,codeDepartement")
-        if response.status_code == 200:
-            data = response.json()
-            return data["codeDepartement"], data["nom"]
-        else:
-            return None, None
-    except Exception as e:
+        response = get_with_retry(session, limiter, f"{API_URL}{code_insee}", {"fields": "nom,codeDepartement"})
+        data = response.json()
+        return code_insee, {"codeDepartement": data["codeDepartement"], "nom": data["nom"]}
+    except requests.exceptions.RequestException as e:
         print(f"Erreur lors de la récupération du département pour {code_insee}: {e}")
-        return None, None
+        return code_insee, None
+
+
+# Résolution des communes inconnues : liste complète en une requête si elles sont nombreuses,
+# sinon requêtes unitaires concurrentes sur une session partagée
+def resolve_communes(codes):
+    session = create_session(MAX_WORKERS)
+    limiter = HostRateLimiter(REQUESTS_PER_SECOND)
+    try:
+        if len(codes) > BULK_THRESHOLD:
+            try:
+                response = get_with_retry(session, limiter, API_URL.rstrip("/"), {"fields": "code,nom,codeDepartement"})
+            except requests.exceptions.RequestException as e:
+                print(f"Erreur lors de la récupération de la liste des communes : {e}")
+                return {}
+            wanted = set(codes)
+            return {
+                commune["code"]: {"codeDepartement": commune["codeDepartement"], "nom": commune["nom"]}
+                for commune in response.json() if commune["code"] in wanted
+            }
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = executor.map(lambda code: get_departement(session, limiter, code), codes)
+            return {code: entry for code, entry in results if entry is not None}
+    finally:
+        session.close()
+
+
+def main():
+    # Charger les données
+    print("Chargement des données...")
+    df = pd.read_csv(INPUT_FILE, sep=";", dtype=str)
+
+    # Une seule résolution par commune, quel que soit le nombre de points d'eau
+    codes_insee = df["CODE_INSEE_COMMUNE"].dropna().unique()
+    cache = load_cache()
+    now = time.time()
+
+    if OFFLINE:
+        print("Mode hors-ligne : département déduit du code INSEE")
+    else:
+        missing = [code for code in codes_insee if not is_fresh(cache.get(code), now)]
+        print(f"{len(codes_insee) - len(missing)} communes en cache, {len(missing)} à résoudre")
+        if missing:
+            for code, entry in resolve_communes(missing).items():
+                cache[code] = dict(entry, fetched=now)
+            save_cache(cache)
+
+    # Table de correspondance commune -> (code département, nom)
+    # Les communes non résolues (hors-ligne ou erreur API) retombent sur le préfixe du code INSEE
+    lookup = pd.DataFrame({"CODE_INSEE_COMMUNE": codes_insee})
+    lookup["Code Département"] = [cache[code]["codeDepartement"] if code in cache else departement_from_insee(code)
+                                  for code in codes_insee]
+    lookup["Nom Département"] = [cache[code]["nom"] if code in cache else None for code in codes_insee]
+
+    # Ajouter les colonnes Département et Nom Département directement dans le fichier d'entrée
+    # En l'absence de nom connu, on conserve celui déjà présent dans le fichier
+    previous_names = df["Nom Département"] if "Nom Département" in df.columns else None
+    df = df.drop(columns=["Code Département", "Nom Département"], errors="ignore")
+    df = df.merge(lookup, on="CODE_INSEE_COMMUNE", how="left")
+    if previous_names is not None:
+        df["Nom Département"] = df["Nom Département"].fillna(previous_names)
+
+    # Sauvegarde du fichier avec les nouvelles colonnes (écriture atomique, le fichier d'entrée n'est jamais tronqué)
+    tmp_file = INPUT_FILE + ".tmp"
+    df.to_csv(tmp_file, sep=";", index=False, encoding="utf-8")
+    os.replace(tmp_file, INPUT_FILE)
 
-# Ajouter les colonnes Département et Nom Département directement dans le fichier d'entrée
-df["Code Département"], df["Nom Département"] = zip(*df["CODE_INSEE_COMMUNE"].apply(get_departement))
+    print(f"Les colonnes 'Code Département' et 'Nom Département' ont été ajoutées au fichier {INPUT_FILE}")
 
-# Sauvegarde du fichier avec les nouvelles colonnes
-df.to_csv(INPUT_FILE, sep=";", index=False, encoding="utf-8")
 
-print(f"Les colonnes 'Code Département' et 'Nom Département' ont été ajoutées au fichier {INPUT_FILE}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
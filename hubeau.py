@@ -0,0 +1,283 @@
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Définition des paramètres
+# L'URL peut être surchargée (ex: serveur HTTP local servant des chroniques de test)
+API_URL = os.environ.get("HUBEAU_API_URL", "https://hubeau.eaufrance.fr/api/v1/niveaux_nappes/chroniques.csv")
+PAGE_SIZE = 20000  # Taille maximale d'une page acceptée par Hub'Eau
+MAX_WORKERS = 8  # Nombre de téléchargements simultanés
+REQUESTS_PER_SECOND = 5.0  # Débit maximal par hôte
+MAX_RETRIES = 5  # Nombre de tentatives par station
+BACKOFF_FACTOR = 0.5  # Attente de base (s) entre deux tentatives, doublée à chaque échec
+TIMEOUT = 60  # Timeout (s) d'une requête
+RETRY_STATUS = {429, 500, 502, 503, 504}  # Statuts HTTP pour lesquels on réessaie
+MANIFEST_FILE = "_manifest.json"  # Manifeste des téléchargements, stocké dans le dossier de sortie
+WATERMARK_FILE = "_watermarks.json"  # Dernière date_mesure récupérée par station
+KEY_COLUMNS = ["code_bss", "date_mesure"]  # Clé de dédoublonnage des mesures
+
+
+# Fonction pour nettoyer les noms de fichiers
+def sanitize_filename(filename):
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', filename)
+
+
+# Limiteur de débit (seau à jetons) partagé par tous les threads d'un même hôte
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Un limiteur par hôte, créé à la demande
+class HostRateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            limiter = self.limiters.setdefault(host, RateLimiter(self.rate))
+        limiter.wait()
+
+
+# Session HTTP unique dont le pool de connexions est dimensionné pour les workers
+def create_session(pool_size=MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Requête GET avec nouvelles tentatives et attente exponentielle
+def get_with_retry(session, limiter, url, params, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    for attempt in range(max_retries + 1):
+        limiter.wait(url)
+        try:
+            response = session.get(url, params=params, timeout=TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == max_retries:
+                raise
+            retry_after = None
+        else:
+            if response.status_code not in RETRY_STATUS or attempt == max_retries:
+                response.raise_for_status()  # Déclenche une erreur HTTP pour les statuts 4xx et 5xx
+                return response
+            retry_after = response.headers.get("Retry-After")
+
+        # Respecter Retry-After si le serveur l'indique, sinon attente exponentielle avec gigue
+        if retry_after is not None and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = backoff_factor * (2 ** attempt) * (1 + random.random())
+        time.sleep(delay)
+
+
+# Lecture / écriture atomique d'un fichier JSON du dossier de sortie
+def load_json(output_dir, file_name, default):
+    path = os.path.join(output_dir, file_name)
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(output_dir, file_name, content):
+    path = os.path.join(output_dir, file_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(content, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)  # Remplacement atomique : le fichier n'est jamais tronqué
+
+
+# Le manifeste décrit l'exécution en cours : tant qu'elle n'est pas complète, on la reprend
+def load_manifest(output_dir):
+    manifest = load_json(output_dir, MANIFEST_FILE, {})
+    if manifest.get("complete", True):
+        return {"complete": False, "stations": {}}  # Exécution précédente terminée : nouvelle exécution
+    return manifest
+
+
+def save_manifest(output_dir, manifest):
+    save_json(output_dir, MANIFEST_FILE, manifest)
+
+
+# Stations restant à traiter dans l'exécution en cours : absentes ou en échec
+def pending_stations(codes, manifest):
+    stations = manifest["stations"]
+    return [code_bss for code_bss in codes if stations.get(code_bss, {}).get("status") != "ok"]
+
+
+# En-tête du fichier local ; None si le fichier est absent ou illisible (vide, sans en-tête, sans les
+# colonnes clés), auquel cas la chronique complète est re-téléchargée et le remplace
+def local_header(output_file):
+    if not os.path.exists(output_file):
+        return None
+    try:
+        header = pd.read_csv(output_file, sep=";", nrows=0).columns
+    except (pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError):
+        return None
+    return header if set(KEY_COLUMNS).issubset(header) else None
+
+
+# Watermark d'une station : celui du store, sinon la dernière date du fichier local déjà présent
+# Sans fichier local lisible, la chronique complète est re-téléchargée
+def station_watermark(watermarks, code_bss, output_file):
+    if local_header(output_file) is None:
+        return None
+    if code_bss in watermarks:
+        return watermarks[code_bss]
+    try:
+        dates = pd.read_csv(output_file, sep=";", dtype=str, usecols=["date_mesure"])["date_mesure"].dropna()
+    except (pd.errors.ParserError, UnicodeDecodeError):
+        return None
+    return dates.max() if not dates.empty else None
+
+
+# Récupération paginée des mesures postérieures ou égales à date_debut
+# Les pages sont enchaînées sur la dernière date reçue (tri ascendant), ce qui évite
+# la limite de profondeur de pagination de l'API au-delà de PAGE_SIZE lignes
+def fetch_chronicle(session, limiter, code_bss, date_debut=None, api_url=API_URL, page_size=PAGE_SIZE):
+    pages = []
+    while True:
+        # Construire les paramètres de la requête
+        params = {
+            "size": page_size,
+            "code_bss": code_bss,
+            "sort": "asc"
+        }
+        if date_debut is not None:
+            params["date_debut_mesure"] = date_debut
+
+        response = get_with_retry(session, limiter, api_url, params)
+        if not response.text.strip():
+            break
+        page = pd.read_csv(io.StringIO(response.text), sep=";", dtype=str)
+        if page.empty:
+            break
+        pages.append(page)
+
+        last_date = page["date_mesure"].max()
+        if len(page) < page_size:
+            break  # Dernière page
+        if last_date == date_debut:
+            # Page pleine sur une seule date : la pagination par date ne peut pas avancer
+            print(f"Attention : plus de {page_size} mesures le {date_debut} pour {code_bss}, "
+                  f"les mesures au-delà de la page reçue sont ignorées")
+            break
+        date_debut = last_date  # La date de reprise est incluse : le recouvrement est dédoublonné
+
+    if not pages:
+        return None
+    df = pd.concat(pages, ignore_index=True)
+    return df.drop_duplicates(subset=KEY_COLUMNS, keep="last")
+
+
+# Téléchargement incrémental de la chronique d'une station
+# Seules les mesures plus récentes que le watermark sont demandées puis ajoutées au fichier local
+def download_station(session, limiter, code_bss, output_dir, watermark=None, api_url=API_URL):
+    file_name = f"{sanitize_filename(code_bss)}.csv"
+    output_file = os.path.join(output_dir, file_name)
+
+    df_new = fetch_chronicle(session, limiter, code_bss, date_debut=watermark, api_url=api_url)
+    header = local_header(output_file) if watermark is not None else None
+    if df_new is not None and header is not None:
+        df_new = df_new[df_new["date_mesure"] > watermark]  # Les mesures du jour du watermark sont déjà en local
+        # Mesures déjà présentes en local malgré le watermark (ajout interrompu avant sa sauvegarde)
+        local_keys = pd.read_csv(output_file, sep=";", dtype=str, usecols=KEY_COLUMNS)
+        known = pd.MultiIndex.from_frame(df_new[KEY_COLUMNS]).isin(pd.MultiIndex.from_frame(local_keys))
+        df_new = df_new[~known]
+
+    if df_new is None or df_new.empty:
+        return {"status": "ok", "file": file_name, "rows": 0, "watermark": watermark}
+
+    df_new = df_new.sort_values("date_mesure", kind="stable")
+    if header is not None:
+        # Ajout en fin de fichier en respectant l'ordre des colonnes existantes
+        df_new.reindex(columns=header).to_csv(output_file, sep=";", index=False, header=False,
+                                              mode="a", encoding="utf-8")
+    else:
+        # Écriture dans un fichier temporaire puis renommage, pour ne jamais laisser de fichier partiel
+        tmp_file = output_file + ".part"
+        df_new.to_csv(tmp_file, sep=";", index=False, encoding="utf-8")
+        os.replace(tmp_file, output_file)
+
+    return {"status": "ok", "file": file_name, "rows": len(df_new), "watermark": df_new["date_mesure"].max()}
+
+
+# Téléchargement concurrent de toutes les stations, avec reprise sur manifeste
+def download_all(codes, output_dir, api_url=API_URL, max_workers=MAX_WORKERS,
+                 requests_per_second=REQUESTS_PER_SECOND, resume=True):
+    os.makedirs(output_dir, exist_ok=True)
+
+    codes = list(dict.fromkeys(codes))  # Dédoublonner en gardant l'ordre
+    manifest = load_manifest(output_dir) if resume else {"complete": False, "stations": {}}
+    watermarks = load_json(output_dir, WATERMARK_FILE, {})
+    pending = pending_stations(codes, manifest)
+    print(f"{len(codes) - len(pending)} stations déjà à jour, {len(pending)} à traiter")
+
+    session = create_session(max_workers)
+    limiter = HostRateLimiter(requests_per_second)
+    state_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for code_bss in pending:
+            output_file = os.path.join(output_dir, f"{sanitize_filename(code_bss)}.csv")
+            watermark = station_watermark(watermarks, code_bss, output_file)
+            future = executor.submit(download_station, session, limiter, code_bss, output_dir, watermark, api_url)
+            futures[future] = code_bss
+
+        for future in as_completed(futures):
+            code_bss = futures[future]
+            try:
+                entry = future.result()
+                print(f"Données sauvegardées pour {code_bss} ({entry['rows']} nouvelles lignes)")
+            except requests.exceptions.RequestException as e:
+                entry = {"status": "failed", "error": str(e)}
+                print(f"Erreur lors de la requête pour le code_bss {code_bss}: {e}")
+            except Exception as e:
+                # Réponse illisible (CSV mal formé, colonne manquante...) : station en échec, les autres continuent
+                entry = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+                print(f"Erreur lors du traitement du code_bss {code_bss}: {e}")
+            entry["updated"] = datetime.now().isoformat(timespec="seconds")
+
+            # Manifeste et watermarks sont sauvegardés après chaque station pour permettre la reprise
+            with state_lock:
+                if entry.get("watermark"):
+                    watermarks[code_bss] = entry["watermark"]
+                    save_json(output_dir, WATERMARK_FILE, watermarks)
+                manifest["stations"][code_bss] = entry
+                save_manifest(output_dir, manifest)
+
+    session.close()
+
+    # Exécution complète : la prochaine exécution repartira des watermarks
+    manifest["complete"] = all(manifest["stations"].get(code, {}).get("status") == "ok" for code in codes)
+    save_manifest(output_dir, manifest)
+    return manifest
@@ -0,0 +1,36 @@
+import json
+import os
+
+# Mode incrémental des étapes nappes (concat_data, pivot_data, preprocess_data_all, preprocess_data_one_year,
+# merge_pluvio) : chaque étape ne traite que l'ajout depuis sa dernière exécution, repérée par sa marque de
+# progression ; INCREMENTAL=0 force la reconstruction complète (et réécrit les marques)
+INCREMENTAL = os.environ.get("INCREMENTAL", "1") == "1"
+MARKS_DIR = "data_all/high_water_marks"  # Une marque JSON par étape
+
+
+def marks_path(stage):
+    return os.path.join(MARKS_DIR, f"{stage}.json")
+
+
+# Marque de la dernière exécution d'une étape (None : reconstruction complète)
+def load_marks(stage):
+    path = marks_path(stage)
+    if not INCREMENTAL or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Écrite en dernier par l'étape, une fois ses sorties à jour
+def save_marks(stage, marks):
+    os.makedirs(MARKS_DIR, exist_ok=True)
+    path = marks_path(stage)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(marks, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+# Marque supprimée avant une reconstruction : une reconstruction interrompue repart de zéro
+def clear_marks(stage):
+    if os.path.exists(marks_path(stage)):
+        os.remove(marks_path(stage))
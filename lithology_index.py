@@ -0,0 +1,185 @@
+import json
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+from shapely import STRtree
+
+# Définition des paramètres
+INDEX_SUFFIX = ".lithology_index"  # Index enregistré à côté du GeoPackage : <gpkg sans extension>.lithology_index/
+INDEX_VERSION = 1
+SORT_GRID = 64  # Grille (cellules par côté) du tri spatial des polygones dans l'index
+QUERY_GRID = 20  # Grille des emprises de lecture : seuls les polygones touchant une cellule contenant un point sont lus
+ROW_GROUP_SIZE = 1000  # Polygones par groupe de lignes Parquet (unité de lecture sélective)
+
+POLYGONS_FILE = "polygones.parquet"
+LITHOLOGY_FILE = "lithologies.parquet"
+RESOLVED_FILE = "points_resolus.parquet"  # Types de sol des points déjà résolus (avec leurs coordonnées)
+META_FILE = "meta.json"  # Écrit en dernier : un index sans meta.json est incomplet
+
+
+def index_dir(gpkg_file):
+    return os.path.splitext(gpkg_file)[0] + INDEX_SUFFIX
+
+
+# Signature du GeoPackage source : l'index est reconstruit si le fichier ou les couches utilisées changent
+def source_signature(gpkg_file, layers):
+    stat = os.stat(gpkg_file)
+    return {"version": INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "layers": layers}
+
+
+def load_meta(directory):
+    path = os.path.join(directory, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Construction de l'index (seule lecture complète du GeoPackage) :
+# - polygones (code, géométrie, emprise) triés par cellule d'une grille, en groupes de lignes Parquet dont les
+#   statistiques d'emprise permettent de ne lire que les polygones proches des points
+# - table des lithologies (code de l'entité, libellé)
+def build_index(gpkg_file, polygon_layer, litho_layer, polygon_code="codeeh", litho_code="CodeEH",
+                litho_label="LbLitho"):
+    directory = index_dir(gpkg_file)
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, META_FILE)
+    for name in (META_FILE, RESOLVED_FILE):  # Index invalidé pendant la construction, résolutions à refaire
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+
+    polygons = gpd.read_file(gpkg_file, layer=polygon_layer, columns=[polygon_code])[[polygon_code, "geometry"]]
+    polygons = polygons.rename(columns={polygon_code: "code"})
+    bounds = polygons.geometry.bounds
+    polygons["minx"], polygons["miny"] = bounds["minx"].to_numpy(), bounds["miny"].to_numpy()
+    polygons["maxx"], polygons["maxy"] = bounds["maxx"].to_numpy(), bounds["maxy"].to_numpy()
+    polygons["rang"] = np.arange(len(polygons))  # Ordre d'origine (ordre des lithologies d'un point)
+
+    total = polygons.total_bounds
+    width = max(total[2] - total[0], 1e-9) / SORT_GRID
+    height = max(total[3] - total[1], 1e-9) / SORT_GRID
+    centers_x = (polygons["minx"] + polygons["maxx"]) / 2
+    centers_y = (polygons["miny"] + polygons["maxy"]) / 2
+    cell = (np.minimum(((centers_y - total[1]) // height).astype(int), SORT_GRID - 1) * SORT_GRID
+            + np.minimum(((centers_x - total[0]) // width).astype(int), SORT_GRID - 1))
+    polygons = polygons.iloc[np.argsort(cell.to_numpy(), kind="stable")]
+    polygons.to_parquet(os.path.join(directory, POLYGONS_FILE), index=False, row_group_size=ROW_GROUP_SIZE)
+
+    litho = gpd.read_file(gpkg_file, layer=litho_layer, columns=[litho_code, litho_label], ignore_geometry=True)
+    litho = pd.DataFrame({"code": litho[litho_code].to_numpy(), "lithologie": litho[litho_label].to_numpy(),
+                          "position": np.arange(len(litho))})
+    litho.to_parquet(os.path.join(directory, LITHOLOGY_FILE), index=False)
+
+    meta = source_signature(gpkg_file, [polygon_layer, litho_layer])
+    meta.update({"crs": polygons.crs.to_wkt() if polygons.crs is not None else None,
+                 "bounds": [float(v) for v in total]})
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_path + ".tmp", meta_path)
+    print(f"Index des lithologies construit dans {directory} ({len(polygons)} polygones)")
+    return meta
+
+
+# Index à jour (reconstruit si absent, incomplet ou si le GeoPackage a changé)
+def ensure_index(gpkg_file, polygon_layer, litho_layer, **columns):
+    meta = load_meta(index_dir(gpkg_file))
+    expected = source_signature(gpkg_file, [polygon_layer, litho_layer])
+    if meta is None or any(meta.get(key) != value for key, value in expected.items()):
+        meta = build_index(gpkg_file, polygon_layer, litho_layer, **columns)
+    return meta
+
+
+# Lecture des seuls polygones dont l'emprise touche une cellule (grille QUERY_GRID) contenant au moins un point
+def read_candidates(directory, meta, x, y):
+    minx, miny, maxx, maxy = meta["bounds"]
+    width = max(maxx - minx, 1e-9) / QUERY_GRID
+    height = max(maxy - miny, 1e-9) / QUERY_GRID
+    cells = np.unique(np.stack([np.floor((x - minx) / width), np.floor((y - miny) / height)], axis=1), axis=0)
+
+    condition = None
+    for cx, cy in cells:
+        x0, y0 = minx + cx * width, miny + cy * height
+        touches = ((pc.field("minx") <= x0 + width) & (pc.field("maxx") >= x0)
+                   & (pc.field("miny") <= y0 + height) & (pc.field("maxy") >= y0))
+        condition = touches if condition is None else condition | touches
+    return gpd.read_parquet(os.path.join(directory, POLYGONS_FILE), filters=condition)
+
+
+# Types de sol d'une liste de points (CODE_BSS, LATITUDE, LONGITUDE en WGS84), par requête sur l'index :
+# type principal = lithologie la plus fréquente parmi les polygones intersectés (à égalité, la première
+# rencontrée), liste = lithologies distinctes dans l'ordre de rencontre
+def query_soil_types(directory, meta, df_points):
+    empty = pd.DataFrame({"CODE_BSS": pd.Series(dtype=str), "main_soil_type": pd.Series(dtype=str),
+                          "all_soil_types": pd.Series(dtype=str)})
+    located = df_points.dropna(subset=["LATITUDE", "LONGITUDE"]).reset_index(drop=True)
+    if located.empty:
+        return empty
+    points = gpd.GeoSeries(gpd.points_from_xy(located["LONGITUDE"], located["LATITUDE"]), crs="EPSG:4326")
+    points = points.to_crs(meta["crs"])
+
+    polygons = read_candidates(directory, meta, points.x.to_numpy(), points.y.to_numpy())
+    point_index, polygon_index = STRtree(polygons.geometry.values).query(points.values, predicate="intersects")
+    if not len(point_index):
+        return empty
+
+    litho = pd.read_parquet(os.path.join(directory, LITHOLOGY_FILE))
+    matches = pd.DataFrame({"CODE_BSS": located["CODE_BSS"].to_numpy()[point_index],
+                            "point": point_index,
+                            "rang": polygons["rang"].to_numpy()[polygon_index],
+                            "code": polygons["code"].to_numpy()[polygon_index]})
+    matches = matches.merge(litho, on="code", how="inner").dropna(subset=["lithologie"])
+    matches = matches.sort_values(["point", "rang", "position"], ignore_index=True)
+    if matches.empty:
+        return empty
+
+    # Comptage par (station, lithologie) avec la position de première rencontre, puis lithologie la plus
+    # fréquente de chaque station et liste des lithologies distinctes
+    matches["ordre"] = np.arange(len(matches))
+    counts = matches.groupby(["CODE_BSS", "lithologie"], sort=False).agg(n=("ordre", "size"), premier=("ordre", "min"))
+    counts = counts.reset_index().sort_values(["CODE_BSS", "premier"])
+    main = counts.sort_values(["CODE_BSS", "n", "premier"], ascending=[True, False, True])
+    main = main.drop_duplicates("CODE_BSS").set_index("CODE_BSS")["lithologie"]
+    all_types = counts.groupby("CODE_BSS", sort=True)["lithologie"].agg(", ".join)
+    return pd.DataFrame({"CODE_BSS": all_types.index, "main_soil_type": main.reindex(all_types.index).to_numpy(),
+                         "all_soil_types": all_types.to_numpy()})
+
+
+# Types de sol de tous les points : seuls les points nouveaux (ou déplacés) sont recherchés dans l'index,
+# les autres sont repris des résolutions précédentes. Retourne une ligne par CODE_BSS, triée par code
+def resolve_soil_types(gpkg_file, polygon_layer, litho_layer, df_points, **columns):
+    meta = ensure_index(gpkg_file, polygon_layer, litho_layer, **columns)
+    directory = index_dir(gpkg_file)
+    resolved_path = os.path.join(directory, RESOLVED_FILE)
+
+    points = df_points[["CODE_BSS", "LATITUDE", "LONGITUDE"]].dropna(subset=["CODE_BSS"]).copy()
+    points["CODE_BSS"] = points["CODE_BSS"].astype(str)
+    points["LATITUDE"] = pd.to_numeric(points["LATITUDE"], errors="coerce")
+    points["LONGITUDE"] = pd.to_numeric(points["LONGITUDE"], errors="coerce")
+    points = points.drop_duplicates()
+
+    if os.path.exists(resolved_path):
+        resolved = pd.read_parquet(resolved_path)
+    else:
+        resolved = pd.DataFrame({"CODE_BSS": pd.Series(dtype=str), "LATITUDE": pd.Series(dtype=np.float64),
+                                 "LONGITUDE": pd.Series(dtype=np.float64), "main_soil_type": pd.Series(dtype=str),
+                                 "all_soil_types": pd.Series(dtype=str)})
+
+    # Une station est à (re)résoudre si l'un de ses points n'a pas encore été résolu à ces coordonnées
+    known = points.merge(resolved[["CODE_BSS", "LATITUDE", "LONGITUDE"]], how="left", indicator=True)
+    todo_codes = known.loc[known["_merge"] == "left_only", "CODE_BSS"].unique()
+    if len(todo_codes):
+        todo = points[points["CODE_BSS"].isin(todo_codes)]
+        found = query_soil_types(directory, meta, todo)
+        new_rows = todo.merge(found, on="CODE_BSS", how="left")
+        resolved = pd.concat([resolved[~resolved["CODE_BSS"].isin(todo_codes)], new_rows], ignore_index=True)
+        resolved.to_parquet(resolved_path + ".tmp", index=False)
+        os.replace(resolved_path + ".tmp", resolved_path)
+        n_cached = points["CODE_BSS"].nunique() - len(todo_codes)
+        print(f"{len(todo_codes)} station(s) résolue(s) dans l'index, {n_cached} reprise(s) du cache")
+
+    result = resolved[resolved["CODE_BSS"].isin(points["CODE_BSS"])].drop_duplicates("CODE_BSS")
+    result = result.dropna(subset=["main_soil_type"])
+    return result[["CODE_BSS", "main_soil_type", "all_soil_types"]].sort_values("CODE_BSS", ignore_index=True)
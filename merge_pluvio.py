@@ -1,60 +1,210 @@
+import hashlib
 import pandas as pd
+import numpy as np
 import os
+import shutil
+from incremental import clear_marks, load_marks, save_marks
+from pivot_engine import day_ordinals
+from pluvio_cube import CUBE_DIR, DEPARTMENT_DIR, load_meta, read_measures, station_series
+from rain_gauges import OUTPUT_TABLE as INPUT_GAUGES, load_points, resolve_gauges
+from storage import TableWriter, list_partitions, load_table, partition_files, partition_path, read_segments, \
+    replace_partitioned, save_table, table_exists, table_version
 
 # Définition des fichiers d'entrée et de sortie
-INPUT_NAPPES = "data_all/nappes_concatenees.csv"
+INPUT_NAPPES = "data_all/nappes_concatenees"
 INPUT_STATIONS = "points_eau.csv"
-INPUT_PLUVIO = "data_pluvio/precipitation_filtered.csv"
-OUTPUT_FILE = "data_pluvio/merged_data.csv"
-
-# Charger les nappes et les stations en mémoire
-df_nappes = pd.read_csv(INPUT_NAPPES, sep=";", dtype=str)
-df_nappes["date_mesure"] = pd.to_datetime(df_nappes["date_mesure"], errors='coerce').dt.strftime('%Y-%m-%d')
-df_nappes["niveau_nappe_eau"] = pd.to_numeric(df_nappes["niveau_nappe_eau"], errors='coerce')
-
-df_stations = pd.read_csv(INPUT_STATIONS, sep=";", dtype=str)
-
-# Fusionner les nappes avec les stations
-df_merged = df_nappes.merge(df_stations, left_on="code_bss", right_on="CODE_BSS", how="left")
-
-# Garder uniquement les colonnes nécessaires avant fusion
-df_merged = df_merged[["code_bss", "date_mesure", "niveau_nappe_eau", "Code Département"]]
-
-# Assurer que Code Département est en str
-df_merged["Code Département"] = df_merged["Code Département"].astype(str)
-
-# Charger tous les chunks dans une liste
-chunk_size = 500000  # Taille du chunk (ajuster si nécessaire)
-chunks = pd.read_csv(INPUT_PLUVIO, sep=";", dtype=str, chunksize=chunk_size)
-precip_data = []
-
-for chunk in chunks:
-    chunk["Date"] = pd.to_datetime(chunk["AAAAMMJJ"], format="%Y%m%d", errors='coerce').dt.strftime('%Y-%m-%d')
-    chunk["RR"] = pd.to_numeric(chunk["RR"], errors='coerce')  # Ne pas remplacer NaN par 0 pour filtrer plus tard
-    chunk = chunk[["Date", "RR", "Code Département"]]  # Garder uniquement les colonnes utiles
-    chunk["Code Département"] = chunk["Code Département"].astype(str)
-    precip_data.append(chunk)
-
-# Concaténer tous les chunks en un seul DataFrame
-df_precip = pd.concat(precip_data, ignore_index=True)
-
-# Prendre la valeur maximale de RR par Date et Département
-df_precip = df_precip.groupby(["Date", "Code Département"], as_index=False).agg({"RR": "max"})
-
-# Vérification avant fusion
-print("Taille de df_merged:", df_merged.shape)
-print("Taille de df_precip après regroupement:", df_precip.shape)
-
-# Fusionner l'ensemble des précipitations avec les nappes
-df_final = df_merged.merge(df_precip, left_on=["date_mesure", "Code Département"], right_on=["Date", "Code Département"], how="left")
-
-# Garder uniquement les colonnes finales
-df_final = df_final[["date_mesure", "RR", "code_bss", "niveau_nappe_eau"]]
-
-# Supprimer les lignes où RR est NaN
-df_final = df_final.dropna(subset=["RR"])
-
-# Sauvegarde du fichier final
-df_final.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
-
-print(f"Fusion terminée et enregistrée dans {OUTPUT_FILE}")
+INPUT_CUBE = CUBE_DIR  # Agrégats journaliers des précipitations (cf. pluvio_cube.py)
+OUTPUT_TABLE = "data_pluvio/merged_data"  # Table partitionnée par département
+# Mesures postérieures au dernier jour du cube, reprises à chaque exécution incrémentale jusqu'à ce que
+# la pluie de leur jour soit connue
+PENDING_TABLE = "data_pluvio/merged_data_pending"
+# Pluie rattachée à chaque piézomètre : "departement" (maximum journalier du département) ou "stations"
+# (moyenne pondérée des pluviomètres les plus proches, cf. rain_gauges.py)
+MERGE_MODE = os.environ.get("MERGE_PLUVIO_MODE", "departement")
+STAGE = "merge_pluvio"  # Nom de la marque de progression (cf. incremental.py)
+COLUMNS = ["code_bss", "date_mesure", "niveau_nappe_eau"]
+
+
+# Empreinte des n premiers jours de matrices jours x ... (pluie déjà fusionnée : toute révision impose
+# une reconstruction complète)
+def history_digest(arrays, n_days, *extra):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array[:n_days]).tobytes())
+    for value in extra:
+        digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
+
+# Pluie du département de chaque mesure : maximum journalier lu dans le cube (matrices jours x départements)
+# Retourne une fonction (indice du département, stations, jours) -> pluie (NaN si aucune mesure ce jour-là)
+# et l'empreinte des n premiers jours de la pluie utilisée
+def department_rainfall():
+    meta = load_meta(INPUT_CUBE)
+    daily = read_measures(os.path.join(INPUT_CUBE, DEPARTMENT_DIR), meta, 0, meta["n_days"], names=("count", "max"))
+    print("Taille de df_precip après regroupement:", (int(np.count_nonzero(daily["count"])), 3))
+
+    def rainfall(department, stations, days):
+        position = days - meta["first_day"]
+        rr = np.full(len(days), np.nan, dtype=np.float32)
+        inside = np.flatnonzero((position >= 0) & (position < meta["n_days"]))
+        observed = daily["count"][position[inside], department] > 0
+        rr[inside[observed]] = daily["max"][position[inside[observed]], department]
+        return rr
+    return rainfall, lambda n_days: history_digest([daily["count"], daily["max"]], n_days)
+
+
+# Pluie des pluviomètres rattachés à chaque piézomètre (table de jointure de rain_gauges.py, mise à jour
+# de manière incrémentale) : moyenne pondérée par l'inverse de la distance des pluviomètres ayant mesuré ce jour-là,
+# seules les séries de ces pluviomètres sont lues dans le cube
+def gauge_rainfall(station_codes):
+    joined = resolve_gauges(load_points(INPUT_STATIONS), cube_dir=INPUT_CUBE, output_table=INPUT_GAUGES)
+    gauges = np.unique(joined["NUM_POSTE"].astype(str).to_numpy())
+    first_day, series = station_series(gauges, INPUT_CUBE)
+    print("Taille de df_precip après regroupement:", (int(np.count_nonzero(~np.isnan(series))), 3))
+
+    # Pluviomètres (colonnes de series, -1 si aucun) et poids de chaque station, alignés sur ses codes catégoriels
+    station = pd.Index(station_codes).get_indexer(joined["CODE_BSS"].astype(str))
+    rank = joined["rang"].to_numpy(np.int64) - 1
+    known = station >= 0
+    columns = np.full((len(station_codes), int(rank.max()) + 1 if len(rank) else 1), -1, dtype=np.int64)
+    weights = np.zeros(columns.shape)
+    columns[station[known], rank[known]] = np.searchsorted(gauges, joined["NUM_POSTE"].astype(str).to_numpy()[known])
+    weights[station[known], rank[known]] = joined["poids"].to_numpy(np.float64)[known]
+
+    def rainfall(department, stations, days):
+        inside = (days >= first_day) & (days < first_day + len(series))
+        position = np.where(inside, days - first_day, 0)
+        values = series[position[:, None], np.maximum(columns[stations], 0)]
+        w = np.where(inside[:, None] & (columns[stations] >= 0) & ~np.isnan(values), weights[stations], 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return ((w * np.nan_to_num(values)).sum(axis=1) / w.sum(axis=1)).astype(np.float32)
+    join = (joined["CODE_BSS"].astype(str).to_numpy().astype("U"),
+            joined["NUM_POSTE"].astype(str).to_numpy().astype("U"), joined["poids"].to_numpy(np.float64))
+    return rainfall, lambda n_days: history_digest([series], n_days, *join)
+
+
+# Département de chaque piézomètre d'après points_eau.csv, et partitions de sortie : départements du cube
+# (mode departement) ou de points_eau.csv (mode stations)
+def load_departments():
+    df_stations = pd.read_csv(INPUT_STATIONS, sep=";", dtype=str, usecols=["CODE_BSS", "Code Département"])
+    station_department = df_stations.drop_duplicates("CODE_BSS").set_index("CODE_BSS")["Code Département"]
+    if MERGE_MODE == "departement":
+        departments = load_meta(INPUT_CUBE)["departements"]
+    elif MERGE_MODE == "stations":
+        departments = sorted(station_department.dropna().unique())
+    else:
+        raise ValueError(f"Mode de fusion inconnu : {MERGE_MODE} (departement ou stations)")
+    return station_department, departments
+
+
+# Marques comparées avant toute lecture : table des nappes, mode, axe des jours et départements du cube,
+# rattachement des piézomètres aux départements
+def current_marks(station_department, departments):
+    meta = load_meta(INPUT_CUBE)
+    mapping = hashlib.blake2b(station_department.sort_index().to_json().encode("utf-8"), digest_size=16)
+    return {"nappes": table_version(INPUT_NAPPES), "mode": MERGE_MODE, "first_day": meta["first_day"],
+            "n_days": meta["n_days"], "departements": list(departments), "stations": mapping.hexdigest()}
+
+
+def count_parts():
+    if not os.path.isdir(OUTPUT_TABLE):
+        return 0
+    return sum(len(partition_files(OUTPUT_TABLE, value)) for value in list_partitions(OUTPUT_TABLE))
+
+
+# Mode incrémental : mesures en attente et segments de la table des nappes ajoutés depuis la dernière
+# exécution, ou None si la table fusionnée doit être reconstruite
+def read_delta(marks, current):
+    if marks is None or not table_exists(PENDING_TABLE) or count_parts() != marks["parts"]:
+        return None
+    if any(marks[key] != current[key] for key in ("mode", "first_day", "departements", "stations")):
+        return None
+    if current["nappes"] is None or current["nappes"][0] != marks["nappes"][0] or current["n_days"] < marks["n_days"]:
+        return None
+    if current["nappes"][1] < marks["nappes"][1]:
+        return None
+    delta = read_segments(INPUT_NAPPES, start=marks["nappes"][1], columns=COLUMNS)
+    pending = load_table(PENDING_TABLE)
+    return pd.concat([pending, delta], ignore_index=True) if len(delta.columns) else pending
+
+
+# Fusion de mesures avec la pluie ; retourne None (rien n'est écrit) si la pluie des jours déjà fusionnés
+# a changé depuis la dernière exécution (marks)
+def merge(df_nappes, station_department, departments, current, marks=None):
+    codes = df_nappes["code_bss"].astype("category")
+    station_codes = codes.cat.categories.astype(str)
+    station_department = station_department.reindex(station_codes)
+    rainfall, digest = department_rainfall() if MERGE_MODE == "departement" else gauge_rainfall(station_codes)
+    if marks is not None and digest(marks["n_days"]) != marks["history"]:
+        return None
+
+    # Département de chaque mesure en code catégoriel (indice dans departments, -1 si absent) :
+    # résolu une fois par station, puis propagé aux lignes par les codes de la catégorie code_bss
+    station_department = pd.Index(departments).get_indexer(station_department)
+    station_index = codes.cat.codes.to_numpy()
+    row_department = np.where(station_index >= 0, station_department[station_index], -1)
+    order = np.argsort(row_department, kind="stable")
+    order = order[np.count_nonzero(row_department < 0):]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(row_department[row_department >= 0],
+                                                        minlength=len(departments)))])
+    nappe_days = day_ordinals(df_nappes["date_mesure"].to_numpy())
+    end_day = current["first_day"] + current["n_days"]
+    print("Taille de df_merged:", df_nappes.shape)
+
+    # Fusion département par département sur les clés entières (jour) ; une partition de sortie par département
+    # (reconstruction : dans un dossier temporaire ; ajout : nouveau fichier part-NNNNN de chaque partition)
+    if marks is None:
+        output_dir, part = OUTPUT_TABLE + ".tmp", 0
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+    else:
+        output_dir, part = OUTPUT_TABLE, marks["next_part"]
+    n_rows, pending = 0, []
+    for i, department in enumerate(departments):
+        rows = order[bounds[i]:bounds[i + 1]]
+
+        # Mesures sans pluie ce jour-là écartées, mesures postérieures au cube mises en attente
+        rr = rainfall(i, station_index[rows], nappe_days[rows])
+        pending.append(rows[nappe_days[rows] >= end_day])
+        rows, rr = rows[~np.isnan(rr)], rr[~np.isnan(rr)]
+        if not len(rows):
+            continue
+        df_department = pd.DataFrame({
+            "date_mesure": df_nappes["date_mesure"].to_numpy()[rows],
+            "RR": rr,
+            "code_bss": df_nappes["code_bss"].to_numpy()[rows],
+            "niveau_nappe_eau": df_nappes["niveau_nappe_eau"].to_numpy()[rows],
+        })
+        with TableWriter(os.path.join(partition_path(output_dir, department), f"part-{part:05d}")) as writer:
+            writer.write(df_department)
+        n_rows += len(df_department)
+
+    pending = np.sort(np.concatenate(pending)) if pending else np.zeros(0, dtype=np.int64)
+    save_table(df_nappes[COLUMNS].iloc[pending].reset_index(drop=True), PENDING_TABLE)
+    if marks is None:
+        output_dir = replace_partitioned(output_dir, OUTPUT_TABLE)
+    save_marks(STAGE, dict(current, history=digest(current["n_days"]), parts=count_parts(), next_part=part + 1))
+    return output_dir, n_rows, len(pending)
+
+
+def main():
+    # Charger les stations et leur département, puis l'ajout depuis la dernière exécution ou toutes les nappes
+    station_department, departments = load_departments()
+    current = current_marks(station_department, departments)
+    marks = load_marks(STAGE)
+    delta = read_delta(marks, current)
+    result = None if delta is None else merge(delta, station_department, departments, current, marks)
+    added = " ajoutées" if result is not None else ""
+    if result is None:
+        clear_marks(STAGE)
+        df_nappes = load_table(INPUT_NAPPES, columns=COLUMNS)
+        result = merge(df_nappes, station_department, departments, current)
+
+    output_dir, n_rows, n_pending = result
+    print(f"Fusion terminée et enregistrée dans {output_dir} ({n_rows} lignes{added}, "
+          f"{n_pending} en attente de pluie)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import warnings
+
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+# Définition des paramètres
+FIGSIZE = (25, 8)
+DPI = 150  # Résolution des PNG (les couches denses sont rastérisées)
+MAX_LINES = 150  # Au-delà de ce nombre de séries, une carte de densité remplace les courbes
+MAX_LEGEND = 40  # Légende par piézomètre seulement pour peu de séries
+HEATMAP_BINS = 200  # Nombre de classes de niveau de la carte de densité
+
+
+# Décimation min/max par pixel : chaque tranche de points correspondant à un pixel horizontal est
+# réduite à son minimum et son maximum (dans l'ordre chronologique), ce qui conserve l'enveloppe visible
+# de la courbe. values : matrice (points x séries) sur un axe x commun ; retourne (x, values) décimés
+def decimate(x, values, n_pixels):
+    n, m = values.shape
+    size = int(np.ceil(n / n_pixels))
+    if size <= 2:
+        return np.broadcast_to(x[:, None], values.shape), values
+    n_buckets = int(np.ceil(n / size))
+    pad = n_buckets * size - n
+    full_x = np.concatenate([x, np.full(pad, x[-1])])
+    full_values = np.concatenate([values, np.full((pad, m), np.nan)])
+    buckets = full_values.reshape(n_buckets, size, m)
+
+    missing = np.isnan(buckets)
+    i_min = np.argmin(np.where(missing, np.inf, buckets), axis=1)
+    i_max = np.argmax(np.where(missing, -np.inf, buckets), axis=1)
+    order = np.stack([np.minimum(i_min, i_max), np.maximum(i_min, i_max)], axis=1)  # (tranches, 2, séries)
+    positions = (order + (np.arange(n_buckets) * size)[:, None, None]).reshape(2 * n_buckets, m)
+
+    dec_x = full_x[positions]
+    dec_values = np.take_along_axis(full_values, positions, axis=0)
+    empty = np.repeat(missing.all(axis=1), 2, axis=0)  # Tranche sans mesure : la courbe est interrompue
+    dec_values[empty] = np.nan
+    return dec_x, dec_values
+
+
+# Carte de densité : nombre de séries passant par chaque (pixel horizontal, classe de niveau)
+def density(x, values, n_pixels, n_bins=HEATMAP_BINS):
+    finite = values[np.isfinite(values)]
+    low, high = (finite.min(), finite.max()) if finite.size else (0.0, 1.0)
+    if high <= low:
+        high = low + 1.0
+    columns = np.minimum(((x - x[0]) / max(x[-1] - x[0], 1e-12) * n_pixels).astype(np.int64), n_pixels - 1)
+    rows = np.floor((values - low) / (high - low) * n_bins)
+    valid = np.isfinite(rows)
+    rows = np.clip(rows[valid], 0, n_bins - 1).astype(np.int64)
+    cells = np.broadcast_to(columns[:, None], values.shape)[valid] * n_bins + rows
+    counts = np.bincount(cells, minlength=n_pixels * n_bins).reshape(n_pixels, n_bins)
+    return counts, (x[0], x[-1], low, high)
+
+
+# Figure d'ensemble de toutes les séries d'une table large (une colonne par piézomètre)
+# x : axe commun (dates ou nombres), values : matrice (points x séries), labels : nom de chaque série
+# Courbes décimées en LineCollection rastérisée, ou carte de densité au-delà de max_lines séries
+def plot_overview(x, values, labels, output_file, title, xlabel, ylabel, max_lines=MAX_LINES, dpi=DPI):
+    x = np.asarray(x)
+    is_date = np.issubdtype(x.dtype, np.datetime64)
+    x = mdates.date2num(x) if is_date else x.astype(np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n_pixels = int(FIGSIZE[0] * dpi)
+
+    fig, ax = plt.subplots(figsize=FIGSIZE)
+    if values.shape[1] > max_lines:
+        counts, (x0, x1, low, high) = density(x, values, n_pixels)
+        image = ax.imshow(np.log1p(counts.T), origin="lower", aspect="auto", extent=(x0, x1, low, high),
+                          cmap="viridis", interpolation="nearest", rasterized=True)
+        fig.colorbar(image, ax=ax, label="Nombre de piézomètres (log)")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Dates sans aucune mesure : médiane NaN
+            median = np.nanmedian(values, axis=1)
+        ax.plot(x, median, color="white", linewidth=1, label="Médiane")
+        ax.legend(loc="upper left")
+    elif values.shape[1]:
+        dec_x, dec_values = decimate(x, values, n_pixels)
+        colors = matplotlib.colormaps["tab20"](np.arange(values.shape[1]) % 20)
+        segments = np.stack([dec_x, dec_values], axis=-1).transpose(1, 0, 2)  # (séries, points, 2)
+        ax.add_collection(LineCollection(segments, colors=colors, alpha=0.7, rasterized=True))
+        ax.autoscale()
+        if values.shape[1] <= MAX_LEGEND:
+            handles = [Line2D([], [], color=color, label=label) for color, label in zip(colors, labels)]
+            ax.legend(handles=handles, loc="upper left", bbox_to_anchor=(1.05, 1), fontsize="small",
+                      frameon=True, ncol=3)
+
+    if is_date:
+        ax.xaxis_date()
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.grid()
+    fig.savefig(output_file, dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
@@ -0,0 +1,374 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from storage import SEGMENTS_FILE, existing_table_path, keep_tables_in_memory, release_table
+
+# Définition des paramètres
+STATE_FILE = ".pipeline_state.json"  # Empreintes des entrées de chaque étape lors de sa dernière exécution
+MAX_PARALLEL = max(2, min(4, os.cpu_count() or 1))  # Nombre d'étapes exécutées simultanément
+HASH_BLOCK = 1 << 20  # Taille des blocs lus pour le calcul des empreintes
+BASEMAP_INPUTS = ["data_fixed/france_outline.csv"]  # Fond de carte de repli des cartes (cf. tile_cache.py)
+BASEMAP_TILES = ["tiles"]  # Magasin local de tuiles, facultatif
+
+# Étapes du pipeline : script, entrées et sorties déclarées
+# Les tables de storage sont déclarées sans extension (Parquet ou CSV selon STORAGE_FORMAT)
+# Les dépendances entre étapes sont déduites des sorties des unes et des entrées des autres
+# network : étape qui interroge une source externe (API) ; exécutée seulement si ses sorties sont absentes ou vides,
+# avec --force ou avec --fetch, jamais pour un simple changement d'entrée
+# optional_inputs : entrées prises en compte dans l'empreinte si elles existent, sans être requises
+# default False : étape absente de la séquence historique de run_all, exécutée seulement si elle est demandée
+# (--only) ou si une étape par défaut dépend de ses sorties
+STAGES = [
+    {"name": "geo_description", "script": "geo_description.py",  # description géo des données
+     "inputs": ["points_eau.csv"], "outputs": ["points_eau.csv"]},
+    {"name": "fetch_data", "script": "fetch_data.py",  # Récupération des données via API (incrémentale)
+     "inputs": ["points_eau.csv"], "outputs": ["data"], "network": True},
+    {"name": "concat_data", "script": "concat_data.py",  # Fusion des fichiers CSV
+     "inputs": ["data"], "outputs": ["data_all/nappes_concatenees"]},
+    {"name": "describe_missing_data", "script": "describe_missing_data.py",  # Analyse des valeurs manquantes
+     "inputs": ["data_all/nappes_concatenees"], "outputs": ["data_all/missing_data_analysis.csv"]},
+    {"name": "pivot_data", "script": "pivot_data.py",  # Transformation des données (mise en ligne par timestamp)
+     "inputs": ["data_all/nappes_concatenees"], "outputs": ["data_all/nappes_transforme.pivot"]},
+    {"name": "describe_missing_data_after_pivot", "script": "describe_missing_data_after_pivot.py",
+     "inputs": ["data_all/nappes_transforme.pivot"], "outputs": []},
+    {"name": "preprocess_data_all", "script": "preprocess_data_all.py",  # traitement des données
+     "inputs": ["data_all/nappes_transforme.pivot"],
+     "outputs": ["data_all/nappes_preprocessed", "data_all/nappes_imputed_mask", "graphs/level_over_time.png",
+                 "graphs/level_over_time_no_missing.png"]},
+    {"name": "preprocess_data_one_year", "script": "preprocess_data_one_year.py",  # traitement des données
+     "inputs": ["data_all/nappes_transforme.pivot"],
+     "outputs": ["data_all/nappes_preprocessed_agg", "data_all/nappes_preprocessed_agg_smoothed",
+                 "graphs/average_level_over_one_year_normalized.png",
+                 "graphs/average_level_over_one_year_normalized_smoothed.png"]},
+    {"name": "correlation_matrix", "script": "correlation matrix.py",  # correlations entre chaque piézomètre
+     "inputs": ["data_all/nappes_preprocessed_agg_smoothed"],
+     "outputs": ["graphs/correlation_matrix.png", "data_all/correlation_neighbors", "data_all/correlation_graph"]},
+    {"name": "process_pluvio_data", "script": "process_pluvio_data.py",  # Fichiers Météo-France
+     "default": False,
+     "inputs": ["data_meteo"], "outputs": ["data_pluvio/precipitation"]},
+    {"name": "pluvio_cube", "script": "pluvio_cube.py",  # Agrégats journaliers par département et par station
+     "default": False,
+     "inputs": ["data_pluvio/precipitation"], "outputs": ["data_pluvio/pluvio_cube"]},
+    {"name": "rain_gauges", "script": "rain_gauges.py",  # Pluviomètres les plus proches de chaque piézomètre
+     "default": False,
+     "inputs": ["points_eau.csv", "data_pluvio/pluvio_cube"], "outputs": ["data_pluvio/nearest_gauges"]},
+    {"name": "merge_pluvio", "script": "merge_pluvio.py",
+     "inputs": ["data_all/nappes_concatenees", "points_eau.csv", "data_pluvio/pluvio_cube",
+                "data_pluvio/nearest_gauges"],
+     "outputs": ["data_pluvio/merged_data"]},
+    {"name": "analyse_pluvio", "script": "analyse_pluvio.py",
+     "inputs": ["data_pluvio/merged_data", "points_eau.csv", "data_pluvio/pluvio_cube"],
+     "outputs": ["data_pluvio/cross_correlation_results.csv", "data_pluvio/best_cross_correlation.csv",
+                 "data_pluvio/antecedent_rainfall_correlation.csv"]},
+    {"name": "analyse_pluvio_clustering_kmeans", "script": "analyse_pluvio_clustering_kmeans.py",
+     "inputs": ["data_pluvio/best_cross_correlation.csv", "points_eau.csv"] + BASEMAP_INPUTS,
+     "optional_inputs": BASEMAP_TILES,
+     "outputs": ["data_pluvio/clustering_kmeans_results.csv", "maps/map_kmeans_pluvio.png"]},
+    {"name": "analyse_pluvio_clustering_dbscan", "script": "analyse_pluvio_clustering_dbscan.py",
+     "inputs": ["data_pluvio/best_cross_correlation.csv"], "outputs": ["data_pluvio/clustering_dbscan_results.csv"]},
+    {"name": "read_geopackage", "script": "read_geopackage.py",  # Lithologie des points d'eau
+     "default": False,
+     "inputs": ["data_geo/BDLISA_V3_METRO.gpkg", "points_eau.csv"], "outputs": ["data_fixed/sol_principal_per_bss.csv"]},
+    {"name": "analyse_geo", "script": "analyse_geo.py",
+     "inputs": ["data_fixed/sol_principal_per_bss.csv", "points_eau.csv", "data_all/nappes_concatenees"],
+     "outputs": ["graphs/niveau_nappe_par_sol.png"]},
+    {"name": "analyse_pluvio_clustering_and_soil", "script": "analyse_pluvio_clustering_and_soil.py",
+     "inputs": ["data_pluvio/clustering_kmeans_results.csv", "data_fixed/sol_principal_per_bss.csv"],
+     "outputs": ["graphs/soil_cluster_most_frequent.png"]},
+    {"name": "analyse_saiso", "script": "analyse_saiso.py",
+     "default": False,
+     "inputs": ["data_all/nappes_concatenees"], "outputs": ["data_saiso/pics_binary_vector.csv"]},
+    {"name": "analyse_saiso_clustering_kmeans", "script": "analyse_saiso_clustering_kmeans.py",
+     "default": False,
+     "inputs": ["data_saiso/pics_binary_vector.csv", "points_eau.csv"] + BASEMAP_INPUTS,
+     "optional_inputs": BASEMAP_TILES,
+     "outputs": ["data_saiso/clustering_kmeans_results.csv", "maps/map_kmeans_saiso.png"]},
+    {"name": "map_data", "script": "map_data.py",
+     "default": False,
+     "inputs": ["points_eau.csv"] + BASEMAP_INPUTS, "optional_inputs": BASEMAP_TILES,
+     "outputs": ["maps/map_raw.png"]},
+]
+
+
+# Chemin concret d'une entrée/sortie déclarée (les tables storage sont résolues selon le format présent)
+def resolve(path):
+    if os.path.exists(path):
+        return path
+    return existing_table_path(path)
+
+
+# Fichier de suivi d'un dossier (préfixe "_", ex: manifeste de hubeau.py) ou fichier en cours d'écriture :
+# exclu des empreintes (l'index d'une table segmentée fait en revanche partie de son contenu)
+def is_bookkeeping(name):
+    return name.endswith((".tmp", ".part")) or (name.startswith("_") and name != SEGMENTS_FILE)
+
+
+# Fichiers d'une entrée : le fichier lui-même ou le contenu d'un dossier (récursivement, trié)
+def list_files(path):
+    path = resolve(path)
+    if path is None:
+        return []
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if not is_bookkeeping(name))
+    return files
+
+
+# Modules locaux importés par un script (récursivement) : leur code fait partie des entrées de l'étape
+def local_modules(script, seen=None):
+    seen = set() if seen is None else seen
+    with open(script, "r", encoding="utf-8") as f:
+        source = f.read()
+    for module in re.findall(r"^\s*(?:from|import)\s+([A-Za-z_]\w*)", source, flags=re.MULTILINE):
+        path = f"{module}.py"
+        if os.path.exists(path) and path not in seen:
+            seen.add(path)
+            local_modules(path, seen)
+    return seen
+
+
+# Empreinte d'un fichier, mise en cache tant que sa taille et sa date de modification sont inchangées
+def file_digest(path, cache, lock):
+    stat = os.stat(path)
+    with lock:
+        cached = cache.get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    with lock:
+        cache[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+# Empreinte globale d'une étape : code du script (et de ses modules locaux) + contenu de ses entrées
+def stage_digest(stage, cache, lock):
+    digest = hashlib.blake2b(digest_size=16)
+    code = [stage["script"]] + sorted(local_modules(stage["script"]))
+    entries = stage["inputs"] + stage.get("optional_inputs", [])
+    for path in code + [f for entry in entries for f in list_files(entry)]:
+        digest.update(path.encode("utf-8"))
+        digest.update(file_digest(path, cache, lock).encode("ascii"))
+    return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {"stages": {}, "files": {}}
+    with open(STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, STATE_FILE)
+
+
+# Dépendances : une étape dépend des étapes (précédentes dans la liste) qui produisent l'une de ses entrées
+def build_dependencies(stages):
+    dependencies = {}
+    for i, stage in enumerate(stages):
+        dependencies[stage["name"]] = {
+            other["name"] for other in stages[:i]
+            if set(other["outputs"]) & set(stage["inputs"])
+        }
+    return dependencies
+
+
+# Étapes cibles et, récursivement, celles qui produisent leurs entrées
+def with_dependencies(names, dependencies):
+    selected = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return selected
+
+
+# Entrées absentes au moment de lancer l'étape (ses dépendances sont alors terminées)
+def missing_inputs(stage):
+    return [entry for entry in stage["inputs"] if resolve(entry) is None]
+
+
+def run_script(stage):
+    start = time.time()
+    process = subprocess.run([sys.executable, stage["script"]], capture_output=True, text=True)
+    return process.returncode, (process.stdout + process.stderr).strip(), time.time() - start
+
+
+# Exécution d'une étape dans le processus courant : le module du script n'est importé qu'à ce moment
+# (ses dépendances lourdes aussi), puis sa fonction main() est appelée
+def run_module(stage):
+    start = time.time()
+    name = os.path.splitext(stage["script"])[0]
+    try:
+        module = sys.modules.get(name)
+        if module is None:
+            spec = importlib.util.spec_from_file_location(name, stage["script"])
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module  # Nom importable : les fonctions envoyées aux processus workers restent picklables
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[name]
+                raise
+        if hasattr(module, "main"):
+            module.main()
+        returncode = 0
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        if "matplotlib.pyplot" in sys.modules:
+            sys.modules["matplotlib.pyplot"].close("all")
+    return returncode, None, time.time() - start
+
+
+# Exécution du DAG : les étapes prêtes (dépendances terminées) sont lancées en parallèle,
+# une étape dont les entrées n'ont pas changé depuis sa dernière exécution réussie est sautée
+# in_process : les étapes s'exécutent l'une après l'autre dans ce processus et se passent leurs tables
+# en mémoire (cf. storage.keep_tables_in_memory), les fichiers restant les points de reprise
+# fetch : exécuter aussi les étapes network dont les sorties existent déjà
+def run_pipeline(stages=STAGES, force=False, only=None, max_parallel=MAX_PARALLEL, dry_run=False, in_process=False,
+                 fetch=False):
+    state = load_state()
+    lock = threading.Lock()
+    dependencies = build_dependencies(stages)
+    # Par défaut : la séquence historique de run_all et les étapes dont elle a besoin ; --only : les étapes nommées
+    if only is None:
+        only = with_dependencies([stage["name"] for stage in stages if stage.get("default", True)], dependencies)
+    selected = [stage for stage in stages if stage["name"] in only]
+    status = {}  # name -> "done", "skipped", "failed", "blocked"
+
+    # Étapes lectrices de chaque entrée : une table n'est gardée en mémoire que tant qu'il en reste à exécuter
+    readers = {}
+    for stage in selected:
+        for entry in stage["inputs"]:
+            readers.setdefault(entry, set()).add(stage["name"])
+    if in_process:
+        keep_tables_in_memory()
+
+    def prepare(stage):
+        # Retourne (à exécuter ?, empreinte des entrées, motif)
+        missing = missing_inputs(stage)
+        if missing:
+            return False, None, f"entrées absentes : {', '.join(missing)}"
+        digest = stage_digest(stage, state["files"], lock)
+        if stage.get("network"):
+            outputs_ok = all(list_files(output) for output in stage["outputs"])
+            if force or fetch or not outputs_ok:
+                return True, digest, None
+            return False, digest, "données déjà téléchargées, --fetch pour les mettre à jour"
+        previous = state["stages"].get(stage["name"])
+        outputs_ok = all(resolve(output) is not None for output in stage["outputs"])
+        if force or previous != digest or not outputs_ok:
+            return True, digest, None
+        return False, digest, "entrées inchangées"
+
+    def execute(stage):
+        run, digest, reason = prepare(stage)
+        if not run or dry_run:
+            return stage, ("skipped" if not run else "done"), reason, None
+        returncode, output, duration = (run_module if in_process else run_script)(stage)
+        if returncode != 0:
+            return stage, "failed", f"code de sortie {returncode}", output
+        # Empreinte recalculée après exécution : une étape qui modifie son entrée en place est stable
+        digest = stage_digest(stage, state["files"], lock)
+        with lock:
+            state["stages"][stage["name"]] = digest
+        return stage, "done", f"{duration:.1f} s", output
+
+    def finish(stage, result, reason, output):
+        status[stage["name"]] = result
+        if output:
+            print(output)
+        if result == "done" and dry_run:
+            print(f"▶ {stage['script']} à exécuter.\n")
+        elif result == "done":
+            print(f"✔ {stage['script']} exécuté avec succès ({reason}).\n")
+        elif result == "skipped":
+            print(f"⏭ {stage['script']} sauté ({reason}).\n")
+        else:
+            print(f"❌ Erreur lors de l'exécution de {stage['script']} : {reason}\n")
+        for entry in stage["inputs"] + stage["outputs"]:
+            if all(name in status for name in readers.get(entry, ())):
+                release_table(entry)
+        if not dry_run:
+            with lock:
+                save_state(state)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            running = {}
+            remaining = list(selected)
+            while remaining or running:
+                for stage in list(remaining):
+                    deps = dependencies[stage["name"]] & {s["name"] for s in selected}
+                    if any(status.get(dep) in ("failed", "blocked") for dep in deps):
+                        status[stage["name"]] = "blocked"
+                        remaining.remove(stage)
+                        print(f"⏭ {stage['script']} non exécuté (dépendance en échec)")
+                    elif all(dep in status for dep in deps):
+                        remaining.remove(stage)
+                        print(f"Exécution du script : {stage['script']}")
+                        if in_process:
+                            finish(*execute(stage))
+                        else:
+                            running[executor.submit(execute, stage)] = stage
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    finish(*future.result())
+    finally:
+        if in_process:
+            keep_tables_in_memory(False)
+
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exécution du pipeline avec saut des étapes à jour")
+    parser.add_argument("--force", action="store_true", help="Réexécuter toutes les étapes")
+    parser.add_argument("--fetch", action="store_true",
+                        help="Mettre à jour les données téléchargées (sinon seulement si elles sont absentes)")
+    parser.add_argument("--only", nargs="+", help="Étapes à exécuter (noms), y compris celles hors séquence par défaut")
+    parser.add_argument("--jobs", type=int, default=MAX_PARALLEL, help="Nombre d'étapes en parallèle")
+    parser.add_argument("--dry-run", action="store_true", help="Afficher les étapes à exécuter sans les lancer")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Exécuter les étapes dans un seul processus, tables passées en mémoire")
+    args = parser.parse_args()
+
+    status = run_pipeline(force=args.force, only=args.only, max_parallel=args.jobs, dry_run=args.dry_run,
+                          in_process=args.in_process, fetch=args.fetch)
+    failed = [name for name, result in status.items() if result in ("failed", "blocked")]
+    if failed:
+        print(f"❌ Étapes en échec ou bloquées : {', '.join(failed)}")
+        sys.exit(1)
+    print("✅ Tous les scripts ont été exécutés.")
+
+
+if __name__ == "__main__":
+    main()
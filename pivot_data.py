@@ -1,35 +1,55 @@
 import os
-import pandas as pd
+from incremental import clear_marks, load_marks, save_marks
+from pivot_engine import PIVOT_FORMAT, append_pivot, build_pivot, load_pivot, pivot_exists, pivot_version
+from storage import CSV_EXPORT, load_table, read_segments, save_table, table_version
 
 # Définition des paramètres
-INPUT_FILE = "data_all/nappes_concatenees.csv"  # Fichier d'entrée
-OUTPUT_FILE = "data_all/nappes_transforme.csv"  # Fichier de sortie directement dans data_all
-
-# Charger les données
-df = pd.read_csv(INPUT_FILE, sep=";", dtype=str)
-
-# Convertir la colonne timestamp_mesure en datetime
-if "date_mesure" in df.columns:
-    df["date_mesure"] = pd.to_datetime(df["date_mesure"], format="%Y-%m-%d", errors="coerce")
-else:
-    raise ValueError("La colonne 'date_mesure' est absente du fichier CSV.")
-
-# Convertir les colonnes numériques
-df["niveau_nappe_eau"] = pd.to_numeric(df["niveau_nappe_eau"], errors='coerce')
-
-print(df)
-
-# Regrouper les données par jour et prendre la moyenne des valeurs si plusieurs par jour
-df["date_mesure"] = df["date_mesure"].dt.date  # Extraire uniquement la date
-df_daily = df.groupby(["date_mesure", "code_bss"]).mean().reset_index() #agreg sur moyenne des niveaux
-
-# Pivot des données pour avoir une colonne par piézomètre
-df_pivot = df_daily.pivot(index="date_mesure", columns="code_bss", values="niveau_nappe_eau")
-
-# Réinitialiser l'index
-df_pivot.reset_index(inplace=True)
-
-# Sauvegarde des données transformées
-df_pivot.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
-
-print(f"Données transformées enregistrées dans {OUTPUT_FILE}")
\ No newline at end of file
+INPUT_TABLE = "data_all/nappes_concatenees"  # Table d'entrée
+OUTPUT_TABLE = "data_all/nappes_transforme"  # Pivot de sortie (dossier data_all/nappes_transforme.pivot)
+STAGE = "pivot_data"  # Nom de la marque de progression (cf. incremental.py)
+COLUMNS = ["code_bss", "date_mesure", "niveau_nappe_eau"]
+
+
+# Mode incrémental : segments de la table d'entrée ajoutés depuis la dernière exécution (même génération),
+# None si le pivot doit être reconstruit
+def read_delta(marks):
+    version = table_version(INPUT_TABLE)
+    if marks is None or not pivot_exists(OUTPUT_TABLE) or marks["pivot"] != pivot_version(OUTPUT_TABLE):
+        return None
+    if version is None or version[0] != marks["input"][0] or version[1] < marks["input"][1]:
+        return None
+    return read_segments(INPUT_TABLE, start=marks["input"][1], columns=COLUMNS)
+
+
+def main():
+    marks = load_marks(STAGE)
+    delta = read_delta(marks)
+    if delta is not None and (delta.empty or append_pivot(delta, OUTPUT_TABLE)):
+        if CSV_EXPORT and not delta.empty:
+            save_table(load_pivot(OUTPUT_TABLE), OUTPUT_TABLE, fmt="csv")
+        save_marks(STAGE, {"input": table_version(INPUT_TABLE), "pivot": pivot_version(OUTPUT_TABLE)})
+        print(f"{len(delta)} mesure(s) ajoutée(s) au pivot {OUTPUT_TABLE}.pivot")
+        return
+    if delta is not None:
+        print("Mesures ajoutées antérieures aux jours déjà pivotés : reconstruction complète du pivot")
+
+    # Charger les données (déjà typées : date_mesure en datetime64, niveau en float32)
+    clear_marks(STAGE)
+    df = load_table(INPUT_TABLE, columns=COLUMNS)
+
+    if "date_mesure" not in df.columns:
+        raise ValueError("La colonne 'date_mesure' est absente de la table d'entrée.")
+
+    print(df)
+
+    # Regrouper les données par jour (moyenne des valeurs si plusieurs par jour) et pivoter
+    # pour avoir une colonne par piézomètre ; matrice dense float32 ou format long selon la densité
+    fmt, n_days, n_stations, n_values = build_pivot(df, OUTPUT_TABLE, fmt=PIVOT_FORMAT, csv_export=CSV_EXPORT)
+    save_marks(STAGE, {"input": table_version(INPUT_TABLE), "pivot": pivot_version(OUTPUT_TABLE)})
+
+    print(f"Pivot {n_days} jours x {n_stations} piézomètres ({n_values} valeurs, format {fmt})")
+    print(f"Données transformées enregistrées dans {OUTPUT_TABLE}.pivot")
+
+
+if __name__ == "__main__":
+    main()
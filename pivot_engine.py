@@ -0,0 +1,290 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+from storage import load_table, save_table, table_exists
+
+# Format de sortie du pivot : "dense" (matrice float32 jours x stations), "long" (triplets jour/station/valeur)
+# ou "auto" (choix selon la densité de la matrice)
+PIVOT_FORMAT = os.environ.get("PIVOT_FORMAT", "auto")
+DENSITY_THRESHOLD = 0.25  # En dessous de cette proportion de cellules renseignées, le format long est retenu
+CHUNK_COLUMNS = 256  # Nombre de stations écrites à la fois dans la matrice dense
+META_FILE = "meta.json"
+SEGMENT_DIR = "segments"  # Ajouts incrémentaux (cf. append_pivot), un sous-dossier au format long par ajout
+MAX_SEGMENTS = 64  # Au-delà, le pivot est réécrit d'un bloc
+NO_DAY = np.iinfo(np.int32).min  # Dernier jour d'une station sans mesure
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+# Dates -> ordinaux journaliers entiers (jours depuis 1970-01-01)
+def day_ordinals(dates):
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def ordinals_to_dates(days):
+    return pd.DatetimeIndex(EPOCH + np.asarray(days).astype("timedelta64[D]"), name="date_mesure")
+
+
+# Moyenne journalière par (jour, station) calculée sur des entiers, sans objets date Python
+# Retourne les jours présents, les codes stations et les triplets (ligne, colonne, valeur) triés par station
+def aggregate_daily(df):
+    codes = df["code_bss"].astype("category")
+    station_codes = np.asarray(codes.cat.categories, dtype=str)
+    stations = codes.cat.codes.to_numpy(np.int64)
+    days = day_ordinals(df["date_mesure"].to_numpy())
+    values = df["niveau_nappe_eau"].to_numpy(np.float64)
+
+    valid = (stations >= 0) & ~np.isnat(df["date_mesure"].to_numpy())
+    stations, days, values = stations[valid], days[valid], values[valid]
+
+    # Clé unique (station, jour) : le tri place les triplets station par station
+    day_min = days.min() if len(days) else 0
+    span = days.max() - day_min + 1 if len(days) else 1
+    unique_keys, inverse = np.unique(stations * span + (days - day_min), return_inverse=True)
+    finite = ~np.isnan(values)
+    sums = np.bincount(inverse, weights=np.where(finite, values, 0.0), minlength=len(unique_keys))
+    counts = np.bincount(inverse, weights=finite, minlength=len(unique_keys))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (sums / counts).astype(np.float32)  # Jour sans valeur numérique -> NaN, comme groupby().mean()
+    cell_stations = unique_keys // span
+    cell_days = unique_keys % span + day_min
+
+    # Seuls les jours présents dans les données deviennent des lignes (comme le pivot pandas)
+    unique_days = np.unique(cell_days)
+    rows = np.searchsorted(unique_days, cell_days)
+    return unique_days, station_codes, rows, cell_stations, means
+
+
+def choose_format(n_cells, n_days, n_stations, fmt=PIVOT_FORMAT):
+    if fmt != "auto":
+        return fmt
+    density = n_cells / max(n_days * n_stations, 1)
+    return "dense" if density >= DENSITY_THRESHOLD else "long"
+
+
+# Dernier jour renseigné de chaque station (triplets triés par station)
+def last_days(days, n_stations, rows, cols):
+    last = np.searchsorted(cols, np.arange(n_stations), side="right") - 1
+    found = (last >= 0) & (cols[np.maximum(last, 0)] == np.arange(n_stations))
+    return np.where(found, days[rows[np.maximum(last, 0)]], NO_DAY).astype(np.int32)
+
+
+def save_array(path, array):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+# Écriture du pivot dans un dossier : days.npy, codes.npy et
+#  - format dense : values.npy, matrice float32 en ordre colonne (Fortran) écrite par blocs de stations,
+#    chaque station est contiguë et la matrice peut être ouverte en memory-map
+#  - format long : rows.npy, cols.npy, values.npy (triplets de la matrice creuse)
+# stations.npy et last_days.npy : toutes les stations du pivot (ajouts compris) et leur dernier jour renseigné
+def write_pivot(path, days, station_codes, rows, cols, values, fmt=PIVOT_FORMAT):
+    fmt = choose_format(len(values), len(days), len(station_codes), fmt)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, "days.npy"), days.astype(np.int32))
+    np.save(os.path.join(tmp_path, "codes.npy"), station_codes)
+    np.save(os.path.join(tmp_path, "stations.npy"), station_codes)
+    np.save(os.path.join(tmp_path, "last_days.npy"), last_days(days, len(station_codes), rows, cols))
+
+    if fmt == "dense":
+        matrix = np.lib.format.open_memmap(os.path.join(tmp_path, "values.npy"), mode="w+", dtype=np.float32,
+                                           shape=(len(days), len(station_codes)), fortran_order=True)
+        # Les triplets sont triés par station : chaque bloc de colonnes est une tranche contiguë
+        bounds = np.searchsorted(cols, np.arange(0, len(station_codes) + CHUNK_COLUMNS, CHUNK_COLUMNS))
+        for i, start in enumerate(range(0, len(station_codes), CHUNK_COLUMNS)):
+            stop = min(start + CHUNK_COLUMNS, len(station_codes))
+            block = np.full((len(days), stop - start), np.nan, dtype=np.float32)
+            sl = slice(bounds[i], bounds[i + 1])
+            block[rows[sl], cols[sl] - start] = values[sl]
+            matrix[:, start:stop] = block
+        matrix.flush()
+        del matrix
+    else:
+        np.save(os.path.join(tmp_path, "rows.npy"), rows.astype(np.int32))
+        np.save(os.path.join(tmp_path, "cols.npy"), cols.astype(np.int32))
+        np.save(os.path.join(tmp_path, "values.npy"), values.astype(np.float32))
+
+    with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+        json.dump({"format": fmt, "n_days": len(days), "n_stations": len(station_codes),
+                   "n_values": int(len(values)), "generation": uuid.uuid4().hex, "segments": [],
+                   "next_segment": 0}, f)
+
+    # Remplacement du pivot précédent en fin d'écriture uniquement
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return fmt
+
+
+def pivot_path(name):
+    return f"{name}.pivot"
+
+
+def pivot_exists(name):
+    return os.path.exists(os.path.join(pivot_path(name), META_FILE))
+
+
+def load_meta(name):
+    with open(os.path.join(pivot_path(name), META_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_meta(name, meta):
+    path = os.path.join(pivot_path(name), META_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+# Version du pivot pour les marques de progression des étapes suivantes : [génération, nombre d'ajouts]
+def pivot_version(name):
+    if not pivot_exists(name):
+        return None
+    meta = load_meta(name)
+    return [meta["generation"], len(meta["segments"])] if "generation" in meta else None
+
+
+# Triplets (jours, codes stations, valeurs) des ajouts à partir du start-ième, une cellule par (station, jour)
+def segment_cells(name, start=0):
+    parts = []
+    for segment in load_meta(name).get("segments", [])[start:]:
+        directory = os.path.join(pivot_path(name), SEGMENT_DIR, segment)
+        rows, cols = np.load(os.path.join(directory, "rows.npy")), np.load(os.path.join(directory, "cols.npy"))
+        parts.append((np.load(os.path.join(directory, "days.npy"))[rows].astype(np.int64),
+                      np.load(os.path.join(directory, "codes.npy"))[cols],
+                      np.load(os.path.join(directory, "values.npy"))))
+    if not parts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=str), np.zeros(0, dtype=np.float32)
+    return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+
+# Ajout incrémental de mesures (table longue) : les moyennes journalières sont écrites dans un nouveau
+# sous-dossier segments/NNNNN au format long, sans réécrire la matrice existante
+# Retourne False (pivot inchangé, à reconstruire) si une cellule (station, jour) ajoutée n'est pas postérieure
+# au dernier jour déjà renseigné de sa station : sa moyenne journalière ne peut pas être complétée
+def append_pivot(df, name):
+    days, station_codes, rows, cols, values = aggregate_daily(df)
+    if not len(values):
+        return True
+    path = pivot_path(name)
+    meta = load_meta(name)
+    stations = np.load(os.path.join(path, "stations.npy"))
+    last = np.load(os.path.join(path, "last_days.npy"))
+    position = np.minimum(np.searchsorted(stations, station_codes), max(len(stations) - 1, 0))
+    known = (stations[position] == station_codes) if len(stations) else np.zeros(len(station_codes), dtype=bool)
+    new_last = last_days(days, len(station_codes), rows, cols)
+    first = np.full(len(station_codes), np.iinfo(np.int32).max, dtype=np.int64)
+    np.minimum.at(first, cols, days[rows])
+    if (first[known] <= last[position[known]]).any():
+        return False
+
+    segment = f"{meta['next_segment']:05d}"
+    directory = os.path.join(path, SEGMENT_DIR, segment)
+    shutil.rmtree(directory + ".tmp", ignore_errors=True)
+    os.makedirs(directory + ".tmp")
+    np.save(os.path.join(directory + ".tmp", "days.npy"), days.astype(np.int32))
+    np.save(os.path.join(directory + ".tmp", "codes.npy"), station_codes)
+    np.save(os.path.join(directory + ".tmp", "rows.npy"), rows.astype(np.int32))
+    np.save(os.path.join(directory + ".tmp", "cols.npy"), cols.astype(np.int32))
+    np.save(os.path.join(directory + ".tmp", "values.npy"), values.astype(np.float32))
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(directory + ".tmp", directory)
+
+    all_stations = np.union1d(stations, station_codes)
+    all_last = np.full(len(all_stations), NO_DAY, dtype=np.int32)
+    all_last[np.searchsorted(all_stations, stations)] = last
+    all_last[np.searchsorted(all_stations, station_codes)] = np.maximum(
+        all_last[np.searchsorted(all_stations, station_codes)], new_last)
+    save_array(os.path.join(path, "stations.npy"), all_stations)
+    save_array(os.path.join(path, "last_days.npy"), all_last)
+    meta["segments"].append(segment)
+    meta["next_segment"] += 1
+    meta["n_values"] += int(len(values))
+    save_meta(name, meta)
+
+    if len(meta["segments"]) > MAX_SEGMENTS:
+        compact_pivot(name)
+    return True
+
+
+# Réécriture d'un bloc d'un pivot et de ses ajouts (nouvelle génération)
+def compact_pivot(name, fmt=PIVOT_FORMAT):
+    dates, station_codes, matrix = open_pivot(name)
+    cols, rows = np.nonzero(~np.isnan(np.asarray(matrix).T))
+    write_pivot(pivot_path(name), day_ordinals(dates.values), station_codes, rows, cols, matrix[rows, cols], fmt)
+
+
+# Ouverture du pivot : dates, codes stations et matrice jours x stations
+# La matrice dense est ouverte en memory-map (lecture seule par défaut), le format long est densifié ;
+# les ajouts éventuels (segments) sont fusionnés dans une matrice en mémoire
+# columns : codes des seules stations à lire
+def open_pivot(name, mmap_mode="r", columns=None):
+    path = pivot_path(name)
+    meta = load_meta(name)
+    days = np.load(os.path.join(path, "days.npy")).astype(np.int64)
+    station_codes = np.load(os.path.join(path, "codes.npy"))
+    selected = None
+    if columns is not None:
+        selected = np.flatnonzero(np.isin(station_codes, np.asarray(columns, dtype=str)))
+        station_codes = station_codes[selected]
+
+    if meta["format"] == "dense":
+        matrix = np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode)
+        if selected is not None:
+            matrix = matrix[:, selected]
+    else:
+        rows, cols = np.load(os.path.join(path, "rows.npy")), np.load(os.path.join(path, "cols.npy"))
+        values = np.load(os.path.join(path, "values.npy"))
+        if selected is not None:
+            keep = np.isin(cols, selected)
+            rows, cols, values = rows[keep], np.searchsorted(selected, cols[keep]), values[keep]
+        matrix = np.full((len(days), len(station_codes)), np.nan, dtype=np.float32)
+        matrix[rows, cols] = values
+
+    if meta.get("segments"):
+        cell_days, cell_codes, cell_values = segment_cells(name)
+        if columns is not None:
+            keep = np.isin(cell_codes, np.asarray(columns, dtype=str))
+            cell_days, cell_codes, cell_values = cell_days[keep], cell_codes[keep], cell_values[keep]
+        all_days, all_codes = np.union1d(days, cell_days), np.union1d(station_codes, cell_codes)
+        merged = np.full((len(all_days), len(all_codes)), np.nan, dtype=np.float32)
+        merged[np.ix_(np.searchsorted(all_days, days), np.searchsorted(all_codes, station_codes))] = matrix
+        merged[np.searchsorted(all_days, cell_days), np.searchsorted(all_codes, cell_codes)] = cell_values
+        days, station_codes, matrix = all_days, all_codes, merged
+    return ordinals_to_dates(days), station_codes, matrix
+
+
+# Chargement du pivot sous forme de DataFrame large (date_mesure + une colonne float32 par piézomètre)
+# Compatible avec les anciennes tables nappes_transforme écrites par storage.save_table
+def load_pivot(name, columns=None):
+    if not pivot_exists(name):
+        if table_exists(name):
+            return load_table(name)
+        raise FileNotFoundError(f"Le pivot {name} est introuvable.")
+
+    dates, station_codes, matrix = open_pivot(name)
+    if columns is not None:
+        index = {code: i for i, code in enumerate(station_codes)}
+        selected = [index[code] for code in columns if code in index]
+        station_codes, matrix = station_codes[selected], matrix[:, selected]
+    df = pd.DataFrame(np.asarray(matrix, dtype=np.float32), columns=list(station_codes))
+    df.insert(0, "date_mesure", dates)
+    return df
+
+
+# Pivot complet : table longue des mesures -> pivot journalier persisté
+def build_pivot(df, name, fmt=PIVOT_FORMAT, csv_export=False):
+    days, station_codes, rows, cols, values = aggregate_daily(df)
+    fmt = write_pivot(pivot_path(name), days, station_codes, rows, cols, values, fmt)
+
+    # Export optionnel de la table large (lisible), au format de storage
+    if csv_export:
+        save_table(load_pivot(name), name, fmt="csv")
+    return fmt, len(days), len(station_codes), len(values)
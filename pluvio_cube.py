@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pivot_engine import day_ordinals, ordinals_to_dates
+from storage import iter_file_chunks, list_partitions, partition_files, partition_path, replace_partitioned
+
+# Définition des paramètres
+INPUT_PLUVIO = "data_pluvio/precipitation"  # Table partitionnée par département (cf. process_pluvio_data.py)
+CUBE_DIR = "data_pluvio/pluvio_cube"
+CHUNK_ROWS = 500000  # Lignes de précipitations lues à la fois
+WINDOWS = (7, 30, 90)  # Cumuls de pluie antécédente par défaut (jours)
+META_FILE = "meta.json"
+DEPARTMENT_DIR = "departements"
+STATION_DIR = "stations"
+MEASURES = ("count", "sum", "max", "sumsq")  # Agrégats journaliers stockés
+
+# Cube d'agrégation des précipitations, dans un dossier :
+#  - meta.json : premier jour (ordinal), nombre de jours, départements
+#  - departements/ : matrices jours x départements (count, sum, max, sumsq), axe des jours commun
+#  - stations/departement=<code>/ : matrices jours x stations du département, codes et coordonnées des stations,
+#    premier jour et nombre de jours propres à la partition (meta.json)
+# Matrices .npy ouvertes en memory-map : une plage de dates est une tranche de lignes
+
+
+# Agrégats (count, sum, max, sumsq) par clé entière, en un tri : clés triées et agrégats alignés
+def reduce_keys(keys, count, total, peak, squares):
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    if not len(keys):
+        return unique_keys, count, total, peak, squares
+    return (unique_keys, np.add.reduceat(count[order], starts), np.add.reduceat(total[order], starts),
+            np.maximum.reduceat(peak[order], starts), np.add.reduceat(squares[order], starts))
+
+
+# Agrégats journaliers par station d'un département, en flux : chaque morceau est réduit à ses agrégats
+# partiels par (station, jour), combinés au fur et à mesure
+# Retourne les stations (codes, latitude, longitude dans l'ordre d'apparition) et les agrégats par clé
+# (indice de station << 32) | jour
+def aggregate_department(department, input_dir=INPUT_PLUVIO, chunk_rows=CHUNK_ROWS):
+    stations, lat, lon = pd.Index([], dtype=object), np.empty(0), np.empty(0)
+    aggregates = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0), np.empty(0, dtype=np.float32),
+                  np.empty(0))
+    for file in partition_files(input_dir, department):
+        for chunk in iter_file_chunks(file, columns=["NUM_POSTE", "LAT", "LON", "Date", "RR"], chunk_rows=chunk_rows):
+            dates = chunk["Date"].to_numpy()
+            rr = chunk["RR"].to_numpy(np.float32)
+            chunk = chunk[~np.isnat(dates) & ~np.isnan(rr)]
+            if chunk.empty:
+                continue
+            codes = chunk["NUM_POSTE"].astype(str).to_numpy()
+
+            # Nouvelles stations ajoutées à la suite des précédentes, avec leurs premières coordonnées
+            new_codes, first = np.unique(codes, return_index=True)
+            new = ~pd.Index(new_codes).isin(stations)
+            stations = stations.append(pd.Index(new_codes[new], dtype=object))
+            lat = np.concatenate([lat, chunk["LAT"].to_numpy(np.float64)[first[new]]])
+            lon = np.concatenate([lon, chunk["LON"].to_numpy(np.float64)[first[new]]])
+
+            keys = (stations.get_indexer(codes).astype(np.int64) << 32) | day_ordinals(chunk["Date"].to_numpy())
+            values = chunk["RR"].to_numpy(np.float32)
+            partial = reduce_keys(keys, np.ones(len(keys), dtype=np.int32), values.astype(np.float64), values,
+                                  values.astype(np.float64) ** 2)
+            aggregates = reduce_keys(*(np.concatenate([a, b]) for a, b in zip(aggregates, partial)))
+    return np.asarray(stations, dtype=str), lat, lon, aggregates
+
+
+# Matrices jours x colonnes des agrégats (count 0, sum 0, max NaN, sumsq 0 pour les cellules vides)
+def dense_measures(rows, cols, n_rows, n_cols, count, total, peak, squares):
+    measures = {
+        "count": np.zeros((n_rows, n_cols), dtype=np.int32),
+        "sum": np.zeros((n_rows, n_cols), dtype=np.float64),
+        "max": np.full((n_rows, n_cols), np.nan, dtype=np.float32),
+        "sumsq": np.zeros((n_rows, n_cols), dtype=np.float64),
+    }
+    for name, values in zip(MEASURES, (count, total, peak, squares)):
+        measures[name][rows, cols] = values
+    return measures
+
+
+def save_measures(directory, measures, meta):
+    os.makedirs(directory, exist_ok=True)
+    for name, values in measures.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+    with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+# Construction du cube à partir de la table des précipitations, un département à la fois (mémoire bornée
+# par la taille d'un département) ; le cube précédent n'est remplacé qu'une fois le nouveau complet
+def build_cube(input_dir=INPUT_PLUVIO, cube_dir=CUBE_DIR, chunk_rows=CHUNK_ROWS):
+    tmp_dir = cube_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    departments, daily = [], []
+    for department in list_partitions(input_dir):
+        codes, lat, lon, (keys, count, total, peak, squares) = aggregate_department(department, input_dir, chunk_rows)
+        if not len(keys):
+            continue
+        # Stations triées par code, jours de la partition à partir du premier jour observé
+        order = np.argsort(codes)
+        columns = np.empty(len(codes), dtype=np.int64)
+        columns[order] = np.arange(len(codes))
+        days = keys & 0xFFFFFFFF
+        first_day, n_days = int(days.min()), int(days.max() - days.min() + 1)
+        measures = dense_measures(days - first_day, columns[keys >> 32], n_days, len(codes),
+                                  count, total, peak, squares)
+        directory = partition_path(os.path.join(tmp_dir, STATION_DIR), department)
+        save_measures(directory, measures, {"first_day": first_day, "n_days": n_days, "n_stations": len(codes)})
+        np.save(os.path.join(directory, "codes.npy"), codes[order])
+        np.save(os.path.join(directory, "coords.npy"), np.stack([lat[order], lon[order]], axis=1))
+
+        # Agrégats du département : somme des agrégats des stations, jour par jour
+        with np.errstate(all="ignore"):
+            peaks = np.fmax.reduce(measures["max"], axis=1)
+        daily.append((first_day, measures["count"].sum(axis=1), measures["sum"].sum(axis=1), peaks,
+                      measures["sumsq"].sum(axis=1)))
+        departments.append(department)
+        print(f"Département {department} : {len(codes)} stations, {n_days} jours")
+
+    # Axe des jours commun à tous les départements
+    first_day = min((start for start, *_ in daily), default=0)
+    n_days = max((start + len(values) for start, values, *_ in daily), default=0) - first_day
+    rows = np.concatenate([np.arange(len(values)) + start - first_day for start, values, *_ in daily]) \
+        if daily else np.empty(0, dtype=np.int64)
+    cols = np.concatenate([np.full(len(values), i) for i, (_, values, *_) in enumerate(daily)]) \
+        if daily else np.empty(0, dtype=np.int64)
+    aggregates = [np.concatenate([d[j] for d in daily]) if daily else np.empty(0) for j in range(1, 5)]
+    filled = aggregates[0] > 0
+    measures = dense_measures(rows[filled], cols[filled], n_days, len(departments),
+                              *(values[filled] for values in aggregates))
+    meta = {"first_day": first_day, "n_days": n_days, "departements": departments}
+    save_measures(os.path.join(tmp_dir, DEPARTMENT_DIR), measures, meta)
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    replace_partitioned(tmp_dir, cube_dir)
+    return meta
+
+
+def load_meta(directory):
+    with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def cube_exists(cube_dir=CUBE_DIR):
+    return os.path.exists(os.path.join(cube_dir, META_FILE))
+
+
+# Lignes [start, stop) d'une plage de dates (incluses, None = sans borne) sur un axe de jours
+def day_range(first_day, n_days, start=None, end=None):
+    start = 0 if start is None else int(day_ordinals([pd.Timestamp(start)])[0]) - first_day
+    stop = n_days if end is None else int(day_ordinals([pd.Timestamp(end)])[0]) - first_day + 1
+    return min(max(start, 0), n_days), min(max(stop, 0), n_days)
+
+
+# Agrégats d'un niveau du cube : dossier, colonnes (départements ou stations) et premier jour
+def level_directories(level, cube_dir, departments=None):
+    meta = load_meta(cube_dir)
+    if level == "departement":
+        directory = os.path.join(cube_dir, DEPARTMENT_DIR)
+        return [(directory, np.asarray(meta["departements"], dtype=str), meta, None)]
+    if level != "station":
+        raise ValueError(f"Niveau de cube inconnu : {level} (departement ou station)")
+    selected = meta["departements"] if departments is None else [d for d in meta["departements"] if d in departments]
+    levels = []
+    for department in selected:
+        directory = partition_path(os.path.join(cube_dir, STATION_DIR), department)
+        levels.append((directory, np.load(os.path.join(directory, "codes.npy")), load_meta(directory), department))
+    return levels
+
+
+# Lecture d'une plage de dates : tranche de lignes des matrices en memory-map, colonnes éventuellement filtrées
+def read_measures(directory, meta, start, stop, columns=None, names=MEASURES):
+    measures = {}
+    for name in names:
+        values = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")[start:stop]
+        measures[name] = np.asarray(values if columns is None else values[:, columns])
+    return measures
+
+
+# Pluie journalière (moyenne des mesures du jour) de quelques stations sur l'axe des jours commun du cube :
+# matrice jours x stations (float32, NaN si pas de mesure), seules les colonnes demandées sont lues
+# Retourne le premier jour (ordinal) et la matrice ; une station absente du cube reste entièrement à NaN
+def station_series(stations, cube_dir=CUBE_DIR):
+    meta = load_meta(cube_dir)
+    stations = np.asarray(stations, dtype=str)
+    values = np.full((meta["n_days"], len(stations)), np.nan, dtype=np.float32)
+    for directory, codes, partition, _ in level_directories("station", cube_dir):
+        target = pd.Index(codes).get_indexer(stations)
+        wanted = np.flatnonzero(target >= 0)
+        if not len(wanted):
+            continue
+        measures = read_measures(directory, partition, 0, partition["n_days"], target[wanted], names=("count", "sum"))
+        offset = partition["first_day"] - meta["first_day"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            daily = np.where(measures["count"] > 0, measures["sum"] / measures["count"], np.nan)
+        values[offset:offset + partition["n_days"], wanted] = daily
+    return meta["first_day"], values
+
+
+# Agrégats journaliers sur une plage de dates, en table longue (seules les cellules observées) :
+# Date, clé (Code Département ou NUM_POSTE), count, sum, max, sumsq, moyenne et écart-type
+# level : "departement" ou "station" ; departments / stations : filtres facultatifs
+def query(start=None, end=None, level="departement", departments=None, stations=None, cube_dir=CUBE_DIR):
+    key = "Code Département" if level == "departement" else "NUM_POSTE"
+    frames = []
+    for directory, codes, meta, department in level_directories(level, cube_dir, departments):
+        columns = np.arange(len(codes))
+        wanted = departments if level == "departement" else stations
+        if wanted is not None:
+            columns = columns[np.isin(codes, list(wanted))]
+        row_start, row_stop = day_range(meta["first_day"], meta["n_days"], start, end)
+        measures = read_measures(directory, meta, row_start, row_stop, columns)
+        rows, cols = np.nonzero(measures["count"])
+        frame = pd.DataFrame({"Date": ordinals_to_dates(rows + meta["first_day"] + row_start).to_numpy(),
+                              key: codes[columns][cols]})
+        for name in MEASURES:
+            frame[name] = measures[name][rows, cols]
+        if department is not None:
+            frame["Code Département"] = department
+        frames.append(frame)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Date", key, *MEASURES])
+    df["mean"] = df["sum"] / df["count"]
+    with np.errstate(invalid="ignore"):
+        df["std"] = np.sqrt(np.maximum(df["sumsq"] / df["count"] - df["mean"] ** 2, 0))
+    return df
+
+
+# Cumul glissant sur les window dernières lignes (ligne courante comprise), par différence de sommes cumulées
+def rolling_sum(values, window):
+    cumulative = np.concatenate([np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)])
+    return cumulative[window:] - cumulative[:-window]
+
+
+# Pluie antécédente : cumul sur N jours (fenêtre se terminant le jour même) de la pluie journalière
+# (moyenne des stations pour un département), pour chaque fenêtre de windows, sur une plage de dates
+# Les jours sans mesure comptent pour 0 ; cumul NaN si aucune mesure dans la fenêtre
+# Retourne une table longue : Date, clé, cumul_<N>j pour chaque fenêtre
+def antecedent_rainfall(windows=WINDOWS, start=None, end=None, level="departement", departments=None,
+                        stations=None, cube_dir=CUBE_DIR):
+    key = "Code Département" if level == "departement" else "NUM_POSTE"
+    longest = max(windows)
+    frames = []
+    for directory, codes, meta, department in level_directories(level, cube_dir, departments):
+        columns = np.arange(len(codes))
+        wanted = departments if level == "departement" else stations
+        if wanted is not None:
+            columns = columns[np.isin(codes, list(wanted))]
+        row_start, row_stop = day_range(meta["first_day"], meta["n_days"], start, end)
+        if row_stop <= row_start or not len(columns):
+            continue
+        # Lecture à partir de longest - 1 jours avant le début de la plage (manquants en tête : zéros)
+        read_start = max(row_start - longest + 1, 0)
+        measures = read_measures(directory, meta, read_start, row_stop, columns, names=("count", "sum"))
+        pad = longest - 1 - (row_start - read_start)
+        count = np.concatenate([np.zeros((pad, len(columns))), measures["count"]])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            daily = np.where(count > 0, np.concatenate([np.zeros((pad, len(columns))), measures["sum"]]) / count, 0)
+
+        frame = pd.DataFrame({
+            "Date": np.repeat(ordinals_to_dates(np.arange(row_start, row_stop) + meta["first_day"]).to_numpy(),
+                              len(columns)),
+            key: np.tile(codes[columns], row_stop - row_start),
+        })
+        for window in windows:
+            offset = longest - window
+            totals = rolling_sum(daily[offset:], window)
+            observed = rolling_sum((count[offset:] > 0).astype(np.float64), window)
+            frame[f"cumul_{window}j"] = np.where(observed > 0, totals, np.nan).ravel()
+        if department is not None:
+            frame["Code Département"] = department
+        frames.append(frame)
+    columns = ["Date", key] + [f"cumul_{window}j" for window in windows]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def main():
+    meta = build_cube()
+    print(f"Cube des précipitations enregistré dans {CUBE_DIR} ({len(meta['departements'])} départements, "
+          f"{meta['n_days']} jours)")
+
+
+if __name__ == "__main__":
+    main()
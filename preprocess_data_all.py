@@ -3,81 +3,198 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from gap_filling import MAX_GAP, METHOD, SPLINE_CONTEXT, fill_gaps
+from incremental import clear_marks, load_marks, save_marks
+from overview_plots import plot_overview
+from pivot_engine import day_ordinals, load_pivot, open_pivot, ordinals_to_dates, pivot_version, segment_cells
+from storage import read_segments, read_table, replace_segments_from, save_table, table_version
 
 # Définition des paramètres
-INPUT_FILE = "data_all/nappes_transforme.csv"  # Fichier d'entrée
-OUTPUT_FILE = "data_all/nappes_preprocessed.csv"  # Fichier de sortie après traitement
+INPUT_TABLE = "data_all/nappes_transforme"  # Pivot d'entrée (cf. pivot_engine.py)
+OUTPUT_TABLE = "data_all/nappes_preprocessed"  # Table de sortie après traitement
+OUTPUT_MASK = "data_all/nappes_imputed_mask"  # Masque des valeurs imputées (True = valeur comblée)
 OUTPUT_GRAPH = "graphs/level_over_time.png"
 OUTPUT_GRAPH_NO_MISSING = "graphs/level_over_time_no_missing.png"
-
-# Charger les données
-df = pd.read_csv(INPUT_FILE, sep=";", dtype=str)
-
-# Convertir la colonne timestamp_mesure en datetime
-if "date_mesure" in df.columns:
-    df["date_mesure"] = pd.to_datetime(df["date_mesure"], errors="coerce")
-else:
-    raise ValueError("La colonne 'date_mesure' est absente du fichier CSV.")
-
-# Convertir les colonnes numériques
-for col in df.columns:
-    if col != "date_mesure":
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-
-# Compter les valeurs manquantes avant interpolation
-missing_counts_before = df.isna().sum()
-
-# Visualisation des tendances pour tous les piézomètres avant traitement des données manquantes
-plt.figure(figsize=(25, 8))  # Augmentation de la taille du graphique
-colors = plt.cm.get_cmap("tab20", len(df.columns[1:]))
-
-for i, col in enumerate(df.columns[1:]):  # Ignorer date_mesure
-    plt.plot(df["date_mesure"], df[col], linestyle="-", alpha=0.7, label=col, color=colors(i % 20))
-
-plt.xlabel("Date")
-plt.ylabel("Niveau nappe")
-plt.title("Évolution du niveau de la nappe pour tous les piézomètres avant traitement des données manquantes")
-plt.legend(loc="upper left", bbox_to_anchor=(1.05, 1), fontsize="small", frameon=True, ncol=3)
-plt.grid()
-plt.savefig(OUTPUT_GRAPH, dpi=300, bbox_inches='tight')
-# plt.show()
-
-# Gestion des valeurs manquantes (Interpolation temporelle)
-df.set_index("date_mesure", inplace=True)
-df = df.interpolate(method="spline", order=3)
-
-# Compter les valeurs interpolées après le traitement
-missing_counts_after = df.isna().sum()
-interpolated_counts = missing_counts_before - missing_counts_after
-
-# Affichage du nombre de valeurs interpolées par colonne
-print("Nombre de valeurs interpolées par colonne :")
-print(interpolated_counts)
-
-# Ajout de variables temporelles
-df["mois"] = df.index.month
-df["année"] = df.index.year
-df["jour_annee"] = df.index.dayofyear
-
-# Réinitialiser l'index
-df.reset_index(inplace=True)
-
-# Sauvegarde des données prétraitées
-df.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
-
-print(f"Données prétraitées enregistrées dans {OUTPUT_FILE}")
-
-# Visualisation des tendances pour tous les piézomètres après traitement des données manquantes
-plt.figure(figsize=(25, 8))
-colors = plt.cm.get_cmap("tab20", len(df.columns[1:]))
-
-for i, col in enumerate(df.columns[1:]):
-    plt.plot(df["date_mesure"], df[col], linestyle="-", alpha=0.7, label=col, color=colors(i % 20))
-
-plt.xlabel("Date")
-plt.ylabel("Niveau nappe")
-plt.title("Évolution du niveau de la nappe pour tous les piézomètres après traitement des données manquantes")
-plt.legend(loc="upper left", bbox_to_anchor=(1.05, 1), fontsize="small", frameon=True, ncol=3)
-plt.grid()
-plt.savefig(OUTPUT_GRAPH_NO_MISSING, dpi=300, bbox_inches='tight')
-# plt.show()
+STAGE = "preprocess_data_all"  # Nom de la marque de progression (cf. incremental.py)
+CONTEXT = 2 * SPLINE_CONTEXT  # Mesures antérieures relues par station pour recalculer le comblement d'un ajout
+# Dernières mesures avant un ajout dont le trou suivant peut être comblé autrement une fois l'ajout connu
+# (pchip : pente au dernier nœud ; spline : fenêtre de SPLINE_CONTEXT mesures de part et d'autre du trou)
+TRAILING = {"linear": 1, "pchip": 2, "spline": SPLINE_CONTEXT}
+# Méthodes dont le comblement dépend de toute la série (climatologie) : tout l'historique de la station est
+# recomblé et la réécriture part du premier jour dont la valeur comblée a changé
+GLOBAL_METHODS = ("seasonal",)
+SETTINGS = ("method", "max_gap", "output", "mask")  # Marques dont tout changement impose une reconstruction
+
+
+def add_time_columns(df):
+    dates = pd.DatetimeIndex(df["date_mesure"])
+    df["mois"] = dates.month
+    df["année"] = dates.year
+    df["jour_annee"] = dates.dayofyear
+    return df
+
+
+def current_marks():
+    return {"pivot": pivot_version(INPUT_TABLE), "method": METHOD, "max_gap": MAX_GAP,
+            "output": table_version(OUTPUT_TABLE), "mask": table_version(OUTPUT_MASK)}
+
+
+def plot_levels(df_before, df_after, stations):
+    # Visualisation des tendances pour tous les piézomètres avant et après traitement des données manquantes
+    # (courbes décimées, ou carte de densité s'il y a trop de piézomètres, cf. overview_plots.py)
+    os.makedirs(os.path.dirname(OUTPUT_GRAPH), exist_ok=True)
+    plot_overview(df_before["date_mesure"].to_numpy(), df_before[stations].to_numpy(), stations, OUTPUT_GRAPH,
+                  "Évolution du niveau de la nappe pour tous les piézomètres avant traitement des données manquantes",
+                  "Date", "Niveau nappe")
+    plot_overview(df_after["date_mesure"].to_numpy(), df_after[stations].to_numpy(), stations,
+                  OUTPUT_GRAPH_NO_MISSING,
+                  "Évolution du niveau de la nappe pour tous les piézomètres après traitement des données manquantes",
+                  "Date", "Niveau nappe")
+
+
+# Premier jour à réécrire et premier jour à relire pour chaque station ayant reçu des mesures (premier jour
+# ajouté first) : la réécriture part du trou qui suit la TRAILING-ième dernière mesure antérieure (en linéaire,
+# le trou qui précède l'ajout n'est à combler que s'il fait au plus MAX_GAP jours), et le comblement est
+# recalculé sur les CONTEXT dernières mesures (tout l'historique pour GLOBAL_METHODS)
+def station_windows(days, matrix, first):
+    write, window = first.copy(), first.copy()
+    for j in range(matrix.shape[1]):
+        valid_days = days[~np.isnan(matrix[:, j]) & (days < first[j])]
+        if not len(valid_days):
+            continue
+        if METHOD in TRAILING and (METHOD != "linear" or first[j] - valid_days[-1] - 1 <= MAX_GAP):
+            write[j] = valid_days[-min(TRAILING[METHOD], len(valid_days))] + 1
+        window[j] = valid_days[0] if METHOD in GLOBAL_METHODS else valid_days[-min(CONTEXT, len(valid_days))]
+    return write, window
+
+
+# Mode incrémental : seules les stations du pivot ayant reçu des mesures depuis la dernière exécution sont
+# recomblées, sur une fenêtre autour de l'ajout ; la fin des tables de sortie est réécrite à partir du premier
+# jour modifié. Retourne le nombre de stations mises à jour, ou None si une reconstruction complète s'impose
+def update_tail(marks):
+    current = current_marks()
+    if marks is None or current["pivot"] is None or any(marks[key] != current[key] for key in SETTINGS):
+        return None
+    if current["pivot"][0] != marks["pivot"][0] or current["pivot"][1] < marks["pivot"][1]:
+        return None
+    cell_days, cell_codes, _ = segment_cells(INPUT_TABLE, marks["pivot"][1])
+    if not len(cell_days):
+        return 0
+
+    first_new = pd.Series(cell_days).groupby(cell_codes).min()
+    dates, codes, matrix = open_pivot(INPUT_TABLE, columns=first_new.index)
+    days, matrix = day_ordinals(dates.values), np.asarray(matrix)
+    write, window = station_windows(days, matrix, first_new.reindex(codes).to_numpy(np.int64))
+    read_start = window.min() if METHOD in GLOBAL_METHODS else write.min()
+
+    # Fin actuelle des sorties ; un jour ajouté au milieu des jours existants décalerait toutes les stations
+    empty = pd.DataFrame({"date_mesure": pd.DatetimeIndex([])})
+    old_tail = read_segments(OUTPUT_TABLE, since=ordinals_to_dates([read_start])[0])
+    old_tail = old_tail.drop(columns=["mois", "année", "jour_annee"]) if len(old_tail.columns) else empty
+    old_mask = read_segments(OUTPUT_MASK, since=ordinals_to_dates([read_start])[0])
+    old_mask = old_mask if len(old_mask.columns) else empty
+    old_days = day_ordinals(old_tail["date_mesure"].to_numpy())
+    inserted = np.setdiff1d(days[days >= read_start], old_days)
+    if len(old_days) and len(inserted) and inserted[0] < old_days.max():
+        return None
+
+    # Comblement des stations concernées sur leur fenêtre (jours de la fin des sorties compris)
+    rows = days >= window.min()
+    window_days = np.union1d(days[rows], old_days)
+    df_window = pd.DataFrame(np.full((len(window_days), len(codes)), np.nan, dtype=np.float32), columns=list(codes))
+    df_window.iloc[np.searchsorted(window_days, days[rows]), :] = matrix[rows]
+    df_window.insert(0, "date_mesure", ordinals_to_dates(window_days))
+    df_filled, df_filled_mask = fill_gaps(df_window, method=METHOD)
+
+    # Méthodes globales : la réécriture remonte au premier jour dont la valeur ou le masque a changé
+    if METHOD in GLOBAL_METHODS and len(old_days):
+        position = np.searchsorted(window_days, old_days)
+        for j, code in enumerate(codes):
+            if code not in old_tail.columns:
+                continue
+            new_values = df_filled[code].to_numpy()[position]
+            old_values = old_tail[code].to_numpy(np.float32)
+            same = (new_values == old_values) | (np.isnan(new_values) & np.isnan(old_values))
+            same &= df_filled_mask[code].to_numpy()[position] == old_mask[code].to_numpy(bool)
+            changed = old_days[~same & (old_days >= window[j])]
+            if len(changed):
+                write[j] = min(write[j], changed[0])
+
+    write_start = ordinals_to_dates([write.min()])[0]
+    keep = old_days >= write.min()
+    old_tail, old_mask = old_tail[keep], old_mask[keep]
+    tail_days = np.union1d(old_days[keep], days[days >= write.min()])
+
+    # Fin des sorties : anciennes valeurs, remplacées pour chaque station à partir de son premier jour à réécrire
+    tail_dates = ordinals_to_dates(tail_days)
+    tail = old_tail.set_index("date_mesure").reindex(tail_dates)
+    tail_mask = old_mask.set_index("date_mesure").reindex(tail_dates).astype(object).fillna(False).astype(bool)
+    position = np.searchsorted(window_days, tail_days)
+    for j, code in enumerate(codes):
+        rewrite = tail_days >= write[j]
+        if code not in tail.columns:
+            tail[code] = np.float32(np.nan)
+            tail_mask[code] = False
+        tail.loc[rewrite, code] = df_filled[code].to_numpy()[position[rewrite]]
+        tail_mask.loc[rewrite, code] = df_filled_mask[code].to_numpy()[position[rewrite]]
+    tail = add_time_columns(tail.astype(np.float32).reset_index())
+    tail_mask = tail_mask.reset_index()
+
+    replace_segments_from(tail_mask, OUTPUT_MASK, write_start, "date_mesure")
+    replace_segments_from(tail, OUTPUT_TABLE, write_start, "date_mesure")
+    print(f"Nombre de valeurs interpolées par colonne depuis le {write_start.date()} :")
+    print(tail_mask[list(codes)].sum())
+    return len(codes)
+
+
+def graphs_exist():
+    return all(os.path.exists(path) for path in (OUTPUT_GRAPH, OUTPUT_GRAPH_NO_MISSING))
+
+
+# La marque n'est écrite qu'une fois les figures produites : une exécution interrompue pendant le tracé
+# est reprise par la suivante
+def main():
+    updated = update_tail(load_marks(STAGE))
+    if updated is not None:
+        print(f"{updated} piézomètre(s) mis à jour dans {OUTPUT_TABLE}")
+        if updated or not graphs_exist():
+            df = read_table(OUTPUT_TABLE)
+            stations = [col for col in df.columns if col not in ("date_mesure", "mois", "année", "jour_annee")]
+            plot_levels(load_pivot(INPUT_TABLE), df, stations)
+        save_marks(STAGE, current_marks())
+        return
+
+    # Charger les données (déjà typées : date_mesure en datetime64, piézomètres en float32)
+    clear_marks(STAGE)
+    df = load_pivot(INPUT_TABLE)
+
+    if "date_mesure" not in df.columns:
+        raise ValueError("La colonne 'date_mesure' est absente de la table d'entrée.")
+    stations = [col for col in df.columns if col != "date_mesure"]
+    df_before = df
+
+    # Gestion des valeurs manquantes (comblement des trous, cf. gap_filling.py)
+    # Seuls les trous intérieurs d'au plus MAX_GAP jours sont comblés, sans extrapolation aux extrémités
+    df, df_mask = fill_gaps(df, method=METHOD)
+    save_table(df_mask, OUTPUT_MASK)
+
+    # Compter les valeurs interpolées
+    interpolated_counts = df_mask.drop(columns="date_mesure").sum()
+
+    # Affichage du nombre de valeurs interpolées par colonne
+    print("Nombre de valeurs interpolées par colonne :")
+    print(interpolated_counts)
+
+    # Ajout de variables temporelles
+    df = add_time_columns(df)
+
+    # Sauvegarde des données prétraitées
+    output_file = save_table(df, OUTPUT_TABLE)
+
+    print(f"Données prétraitées enregistrées dans {output_file}")
+    plot_levels(df_before, df, stations)
+    save_marks(STAGE, current_marks())
+
+
+if __name__ == "__main__":
+    main()
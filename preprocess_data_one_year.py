@@ -3,85 +3,74 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from climatology import annual_means, from_matrix, load_state, normalize, save_state, smooth, update
+from incremental import clear_marks, load_marks, save_marks
+from overview_plots import plot_overview
+from pivot_engine import day_ordinals, open_pivot, pivot_version, segment_cells
+from storage import save_table
 
 # Définition des paramètres
-INPUT_FILE = "data_all/nappes_transforme.csv"  # Fichier d'entrée
-OUTPUT_FILE = "data_all/nappes_preprocessed_agg.csv"
-OUTPUT_FILE_SMOOTHED = "data_all/nappes_preprocessed_agg_smoothed.csv"
+INPUT_TABLE = "data_all/nappes_transforme"  # Pivot d'entrée (cf. pivot_engine.py)
+OUTPUT_TABLE = "data_all/nappes_preprocessed_agg"
+OUTPUT_TABLE_SMOOTHED = "data_all/nappes_preprocessed_agg_smoothed"
 OUTPUT_GRAPH = "graphs/average_level_over_one_year_normalized.png"
 OUTPUT_GRAPH_SMOOTHED = "graphs/average_level_over_one_year_normalized_smoothed.png"
+STATS_DIR = "data_all/nappes_doy_stats"  # Climatologie par (jour de l'année, piézomètre), cf. climatology.py
+STAGE = "preprocess_data_one_year"  # Nom de la marque de progression (cf. incremental.py)
 
-# Charger les données
-df = pd.read_csv(INPUT_FILE, sep=";", dtype=str)
 
-# Convertir la colonne timestamp_mesure en datetime
-if "date_mesure" in df.columns:
-    df["date_mesure"] = pd.to_datetime(df["date_mesure"], errors="coerce")
-else:
-    raise ValueError("La colonne 'date_mesure' est absente du fichier CSV.")
+# Mode incrémental : les cellules ajoutées au pivot depuis la dernière exécution sont cumulées dans la
+# climatologie enregistrée ; None si elle est à recalculer sur tout le pivot
+def update_state(marks):
+    version = pivot_version(INPUT_TABLE)
+    state = load_state(STATS_DIR) if marks is not None else None
+    if state is None or version is None or state["generation"] != marks["stats"]:
+        return None
+    if version[0] != marks["pivot"][0] or version[1] < marks["pivot"][1]:
+        return None
+    days, codes, values = segment_cells(INPUT_TABLE, marks["pivot"][1])
+    print(f"{len(values)} mesure(s) ajoutée(s) aux moyennes par jour de l'année")
+    return update(state, days, codes, values)
 
-# Convertir les colonnes numériques
-for col in df.columns:
-    if col != "date_mesure":
-        df[col] = pd.to_numeric(df[col], errors='coerce')
 
-# Extraire le jour de l'année
-df["jour_annee"] = df["date_mesure"].dt.dayofyear
+def main():
+    state = update_state(load_marks(STAGE))
+    if state is None:
+        clear_marks(STAGE)
+        dates, codes, matrix = open_pivot(INPUT_TABLE)
+        state = from_matrix(day_ordinals(dates.values), codes, matrix)
+    generation = save_state(state, STATS_DIR)
+    save_marks(STAGE, {"pivot": pivot_version(INPUT_TABLE), "stats": generation})
 
-# Calculer la moyenne par jour de l'année et par piézomètre
-df_annual = df.groupby(["jour_annee"]).mean()
+    # Moyenne par jour de l'année et par piézomètre, normalisée (jours de l'année présents dans le pivot)
+    doys, means = annual_means(state)
+    stations = list(state["codes"])
+    df_annual = pd.DataFrame(normalize(means), columns=stations)
+    df_annual.insert(0, "jour_annee", doys)
 
-# normalisation des données 
-df_annual = (df_annual.iloc[:, 1:] - df_annual.iloc[:, 1:].mean()) / df_annual.iloc[:, 1:].std()
+    # Sauvegarde des données prétraitées
+    output_file = save_table(df_annual, OUTPUT_TABLE)
 
-# Réinitialiser l'index
-df_annual.reset_index(inplace=True)
+    print(f"Données moyennées sur un an enregistrées dans {output_file}")
 
-# Sauvegarde des données prétraitées
-df_annual.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
+    # Visualisation des tendances moyennes annuelles (cf. overview_plots.py)
+    plot_overview(df_annual["jour_annee"].to_numpy(), df_annual[stations].to_numpy(), stations, OUTPUT_GRAPH,
+                  "Évolution moyenne du niveau de la nappe sur une année pour chaque piézomètre",
+                  "Jour de l'année", "Niveau nappe (m)")
 
-print(f"Données moyennées sur un an enregistrées dans {OUTPUT_FILE}")
 
-# Visualisation des tendances moyennes annuelles
-plt.figure(figsize=(25, 8))
-colors = plt.cm.get_cmap("tab20", len(df.columns[1:]))
+    # lissage des données avec une moyenne glissante de SMOOTHING_WINDOW jours, circulaire sur l'année
+    df_smooth = pd.DataFrame(smooth(df_annual[stations].to_numpy()), columns=stations)
+    df_smooth.insert(0, "jour_annee", doys)
 
-for i, col in enumerate(df.columns[1:]):
-    if col != "jour_annee":  # Ignorer la colonne du jour de l'année
-        plt.plot(df_annual["jour_annee"], df_annual[col], linestyle="-", alpha=0.7, label=col, color=colors(i % 20))
+    # Sauvegarde des données prétraitées
+    save_table(df_smooth, OUTPUT_TABLE_SMOOTHED)
 
-plt.xlabel("Jour de l'année")
-plt.ylabel("Niveau nappe (m)")
-plt.title("Évolution moyenne du niveau de la nappe sur une année pour chaque piézomètre")
-plt.legend(loc="upper left", bbox_to_anchor=(1.05, 1), fontsize="small", frameon=True, ncol=3)
-plt.grid()
-plt.savefig(OUTPUT_GRAPH, dpi=300, bbox_inches='tight')
-# plt.show()
+    # Visualisation des tendances moyennes annuelles
+    plot_overview(df_smooth["jour_annee"].to_numpy(), df_smooth[stations].to_numpy(), stations, OUTPUT_GRAPH_SMOOTHED,
+                  "Évolution moyenne lissée du niveau de la nappe sur une année pour chaque piézomètre",
+                  "Jour de l'année", "Niveau nappe (m)")
 
 
-# lissage des données avec une moyenne glissante 
-df_smooth = df_annual.copy()
-window_size = 14  # Fenêtre de lissage 
-
-for col in df_annual.columns[1:]:  # Exclure "jour_annee"
-    df_smooth[col] = df_annual[col].rolling(window=window_size, center=True).mean()
-
-# Sauvegarde des données prétraitées
-df_smooth.to_csv(OUTPUT_FILE_SMOOTHED, sep=";", index=False, encoding="utf-8")
-
-# Visualisation des tendances moyennes annuelles
-plt.figure(figsize=(25, 8))
-colors = plt.cm.get_cmap("tab20", len(df.columns[1:]))
-
-for i, col in enumerate(df.columns[1:]):
-    if col != "jour_annee":  # Ignorer la colonne du jour de l'année
-        plt.plot(df_smooth["jour_annee"], df_smooth[col], linestyle="-", alpha=0.7, label=col, color=colors(i % 20))
-
-plt.xlabel("Jour de l'année")
-plt.ylabel("Niveau nappe (m)")
-plt.title("Évolution moyenne lissée du niveau de la nappe sur une année pour chaque piézomètre")
-plt.legend(loc="upper left", bbox_to_anchor=(1.05, 1), fontsize="small", frameon=True, ncol=3)
-plt.grid()
-plt.savefig(OUTPUT_GRAPH_SMOOTHED, dpi=300, bbox_inches='tight')
-# plt.show()
-
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,84 @@
-import pandas as pd
 import os
 import glob
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from storage import TableWriter, partition_path, replace_partitioned
 
 # Définition des fichiers et dossiers
-INPUT_FOLDER = "data_meteo"  # Dossier contenant les fichiers CSV
-OUTPUT_FILE = "data_pluvio/precipitation_filtered.csv"  # Fichier de sortie
+INPUT_FOLDER = "data_meteo"  # Dossier contenant les fichiers CSV Météo-France (éventuellement compressés en .gz)
+OUTPUT_DIR = "data_pluvio/precipitation"  # Table partitionnée par département (cf. storage.py)
+COLUMNS = ["NUM_POSTE", "LAT", "LON", "AAAAMMJJ", "RR"]  # Seules colonnes lues
+DTYPES = {"NUM_POSTE": str, "LAT": np.float64, "LON": np.float64, "AAAAMMJJ": np.int64, "RR": np.float32}
+MIN_DATE = 20010101  # Filtre appliqué sur l'entier AAAAMMJJ, avant toute conversion en date
+CHUNK_ROWS = 500000  # Lignes lues à la fois dans un fichier
+MAX_WORKERS = os.cpu_count() or 1  # Fichiers traités en parallèle
+
 
-# Récupérer tous les fichiers CSV dans le dossier
-csv_files = glob.glob(os.path.join(INPUT_FOLDER, "*.csv"))
+# Numéro du département d'après le nom du fichier (Q_76_...), "Unknown" sinon
+def department_of(filename):
+    return filename[2:4] if filename.startswith("Q_") and filename[2:4].isdigit() else "Unknown"
 
-dataframes = []
 
-for file in csv_files:
-    # Extraire le numéro du département si disponible, sinon mettre "Unknown"
+# Dates AAAAMMJJ entières -> datetime64, par arithmétique sur les entiers (dates invalides -> NaT)
+def dates_from_int(values):
+    values = np.asarray(values, dtype=np.int64)
+    years, months, days = values // 10000, values // 100 % 100, values % 100
+    month_start = (years - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (months - 1)
+    dates = month_start.astype("datetime64[D]") + (days - 1)
+    valid = (months >= 1) & (months <= 12) & (days >= 1) & (dates.astype("datetime64[M]") == month_start)
+    return np.where(valid, dates, np.datetime64("NaT")).astype("datetime64[ns]")
+
+
+# Traitement d'un fichier dans un processus worker : lecture par morceaux (gzip géré directement),
+# filtre sur l'entier AAAAMMJJ puis conversion des seules dates retenues, écriture dans la partition
+# du département ; retourne le département et le nombre de lignes retenues
+def process_file(file, output_dir):
     filename = os.path.basename(file)
-    department_number = filename[2:4] if filename.startswith("Q_") and filename[2:4].isdigit() else "Unknown"
-    
-    # Charger le fichier CSV en gardant uniquement les colonnes nécessaires
-    df = pd.read_csv(file, sep=";", dtype=str, usecols=["AAAAMMJJ", "RR"])
-    
-    # Convertir AAAAMMJJ en format datetime
-    df["Date"] = pd.to_datetime(df["AAAAMMJJ"], format="%Y%m%d", errors='coerce')
-    
-    # Ajouter la colonne du département
-    df["Code Département"] = department_number
-    
-    # Filtrer les dates après 2000
-    df = df[df["Date"] >= "2001-01-01"]
-    
-    # Ajouter au DataFrame final
-    dataframes.append(df)
-
-# Concaténer tous les fichiers en un seul DataFrame
-df_final = pd.concat(dataframes, ignore_index=True)
-
-# Sauvegarde du fichier final
-df_final.to_csv(OUTPUT_FILE, sep=";", index=False, encoding="utf-8")
-
-print(f"Données filtrées enregistrées dans {OUTPUT_FILE}")
\ No newline at end of file
+    department = department_of(filename)
+    part_name = os.path.join(partition_path(output_dir, department), filename.split(".")[0])
+
+    with TableWriter(part_name) as writer:
+        for chunk in pd.read_csv(file, sep=";", usecols=COLUMNS, dtype=DTYPES, chunksize=CHUNK_ROWS):
+            chunk = chunk[chunk["AAAAMMJJ"].to_numpy() >= MIN_DATE]
+            if chunk.empty:
+                continue
+            writer.write(pd.DataFrame({
+                "NUM_POSTE": chunk["NUM_POSTE"].to_numpy(),
+                "LAT": chunk["LAT"].to_numpy(),
+                "LON": chunk["LON"].to_numpy(),
+                "Date": dates_from_int(chunk["AAAAMMJJ"].to_numpy()),
+                "RR": chunk["RR"].to_numpy(),
+                "Code Département": department,
+            }))
+    return department, writer.rows
+
+
+def main():
+    # Récupérer tous les fichiers CSV (compressés ou non) dans le dossier
+    csv_files = sorted(glob.glob(os.path.join(INPUT_FOLDER, "*.csv")) +
+                       glob.glob(os.path.join(INPUT_FOLDER, "*.csv.gz")))
+    if not csv_files:
+        print(f"Aucun fichier CSV trouvé dans {INPUT_FOLDER}")
+        return
+
+    # Les fichiers sont répartis entre processus, chacun écrit sa propre partie de partition ;
+    # la table précédente n'est remplacée qu'une fois tous les fichiers traités
+    tmp_dir = OUTPUT_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [(file, executor.submit(process_file, file, tmp_dir)) for file in csv_files]
+        for file, future in futures:
+            department, rows = future.result()
+            n_rows += rows
+            print(f"Fichier traité : {file} (département {department}, {rows} lignes)")
+
+    replace_partitioned(tmp_dir, OUTPUT_DIR)
+    print(f"Données filtrées enregistrées dans {OUTPUT_DIR} ({n_rows} lignes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from pluvio_cube import CUBE_DIR, STATION_DIR, load_meta
+from storage import load_table, optimize_dtypes, partition_path, save_table, table_exists
+
+# Définition des paramètres
+INPUT_STATIONS = "points_eau.csv"
+INPUT_CUBE = CUBE_DIR  # Stations Météo-France et leurs coordonnées (cf. pluvio_cube.py)
+OUTPUT_TABLE = "data_pluvio/nearest_gauges"  # Table de jointure piézomètre -> pluviomètres pondérés
+META_FILE = OUTPUT_TABLE + ".json"  # Paramètres et signature des pluviomètres ayant servi à la jointure
+N_GAUGES = 3  # Nombre de pluviomètres retenus par piézomètre
+MAX_DISTANCE_KM = 50.0  # Pluviomètres plus éloignés ignorés
+IDW_POWER = 2  # Poids en 1 / distance^IDW_POWER
+MIN_DISTANCE_KM = 0.01  # Distance plancher (pluviomètre sur le piézomètre)
+EARTH_RADIUS_KM = 6371.0
+
+
+# Coordonnées cartésiennes sur la sphère unité (ECEF) : la distance euclidienne (corde) croît avec la distance
+# sur la sphère, le KD-tree trouve donc les vrais plus proches voisins, sans déformation due à la longitude
+def unit_vectors(lat, lon):
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(km / (2 * EARTH_RADIUS_KM))
+
+
+# Pluviomètres du cube : codes et coordonnées (stations sans coordonnées écartées)
+def load_gauges(cube_dir=INPUT_CUBE):
+    frames = []
+    for department in load_meta(cube_dir)["departements"]:
+        directory = partition_path(os.path.join(cube_dir, STATION_DIR), department)
+        coords = np.load(os.path.join(directory, "coords.npy"))
+        frames.append(pd.DataFrame({"NUM_POSTE": np.load(os.path.join(directory, "codes.npy")),
+                                    "LAT": coords[:, 0], "LON": coords[:, 1]}))
+    gauges = pd.concat(frames, ignore_index=True) if frames else \
+        pd.DataFrame(columns=["NUM_POSTE", "LAT", "LON"])
+    return gauges.dropna(subset=["LAT", "LON"]).drop_duplicates("NUM_POSTE").reset_index(drop=True)
+
+
+# Signature de la jointure : pluviomètres (codes, coordonnées) et paramètres ; toute modification impose
+# de recalculer tous les piézomètres
+def join_signature(gauges):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(gauges["NUM_POSTE"].to_numpy(dtype=str).astype("U").tobytes())
+    digest.update(gauges[["LAT", "LON"]].to_numpy(np.float64).tobytes())
+    return {"gauges": digest.hexdigest(), "n_gauges": N_GAUGES, "max_distance_km": MAX_DISTANCE_KM,
+            "idw_power": IDW_POWER}
+
+
+# k plus proches pluviomètres de chaque point (à moins de MAX_DISTANCE_KM) et poids en inverse de la distance,
+# normalisés par point ; table longue CODE_BSS, rang, NUM_POSTE, distance_km, poids
+# Un point sans pluviomètre à moins de MAX_DISTANCE_KM n'a aucune ligne
+def nearest_gauges(df_points, gauges):
+    columns = ["CODE_BSS", "rang", "NUM_POSTE", "distance_km", "poids"]
+    k = min(N_GAUGES, len(gauges))
+    if not k or df_points.empty:
+        return pd.DataFrame(columns=columns)
+    tree = cKDTree(unit_vectors(gauges["LAT"], gauges["LON"]))
+    chords, indices = tree.query(unit_vectors(df_points["LATITUDE"], df_points["LONGITUDE"]),
+                                 k=np.arange(1, k + 1), distance_upper_bound=km_to_chord(MAX_DISTANCE_KM))
+    found = np.isfinite(chords)
+    distances = np.maximum(chord_to_km(np.where(found, chords, 0)), MIN_DISTANCE_KM)
+    weights = np.where(found, distances ** -IDW_POWER, 0)
+    with np.errstate(invalid="ignore"):
+        weights = weights / weights.sum(axis=1, keepdims=True)
+
+    point, rank = np.nonzero(found)
+    gauge = indices[point, rank]
+    return pd.DataFrame({
+        "CODE_BSS": df_points["CODE_BSS"].to_numpy()[point],
+        "rang": rank + 1,
+        "NUM_POSTE": gauges["NUM_POSTE"].to_numpy()[gauge],
+        "distance_km": distances[point, rank],
+        "poids": weights[point, rank],
+    }, columns=columns)
+
+
+# Points de points_eau.csv avec des coordonnées valides
+def load_points(path=INPUT_STATIONS):
+    points = pd.read_csv(path, sep=";", dtype=str, usecols=["CODE_BSS", "LATITUDE", "LONGITUDE"])
+    points = points.dropna(subset=["CODE_BSS"]).drop_duplicates("CODE_BSS")
+    points["LATITUDE"] = pd.to_numeric(points["LATITUDE"], errors="coerce")
+    points["LONGITUDE"] = pd.to_numeric(points["LONGITUDE"], errors="coerce")
+    return points.dropna(subset=["LATITUDE", "LONGITUDE"]).reset_index(drop=True)
+
+
+# Jointure de tous les points, calculée de manière incrémentale : seuls les piézomètres nouveaux ou déplacés
+# sont recherchés dans l'arbre, tant que les pluviomètres et les paramètres sont inchangés
+# Retourne la table de jointure (avec les coordonnées des piézomètres), triée par CODE_BSS puis rang
+def resolve_gauges(df_points, cube_dir=INPUT_CUBE, output_table=OUTPUT_TABLE, meta_file=META_FILE):
+    gauges = load_gauges(cube_dir)
+    signature = join_signature(gauges)
+    previous = None
+    if table_exists(output_table) and os.path.exists(meta_file):
+        with open(meta_file, "r", encoding="utf-8") as f:
+            if json.load(f) == signature:
+                previous = load_table(output_table)
+                previous["CODE_BSS"] = previous["CODE_BSS"].astype(str)
+
+    points = df_points[["CODE_BSS", "LATITUDE", "LONGITUDE"]]
+    if previous is not None:
+        # Coordonnées comparées au format stocké (float32)
+        known = previous.drop_duplicates("CODE_BSS")[["CODE_BSS", "LATITUDE", "LONGITUDE"]]
+        current = points.assign(LATITUDE=points["LATITUDE"].astype(np.float32),
+                                LONGITUDE=points["LONGITUDE"].astype(np.float32))
+        unchanged = current.merge(known, how="left", indicator=True)["_merge"].to_numpy() == "both"
+        kept = previous[previous["CODE_BSS"].isin(points["CODE_BSS"].to_numpy()[unchanged])]
+        todo = points[~unchanged]
+    else:
+        kept, todo = None, points
+
+    joined = nearest_gauges(todo, gauges).merge(todo, on="CODE_BSS", how="left")
+    if previous is not None and joined.empty and kept["CODE_BSS"].nunique() == previous["CODE_BSS"].nunique():
+        return previous  # Aucun rattachement nouveau ni piézomètre retiré : table inchangée
+    # Typée comme la table enregistrée : poids identiques que le rattachement soit repris ou recalculé
+    result = joined if kept is None else pd.concat([kept, joined], ignore_index=True)
+    result = optimize_dtypes(result).sort_values(["CODE_BSS", "rang"], ignore_index=True)
+    save_table(result, output_table)
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(signature, f)
+    print(f"{todo['CODE_BSS'].nunique()} piézomètre(s) recherché(s), {joined['CODE_BSS'].nunique()} rattaché(s) "
+          f"à des pluviomètres, {0 if kept is None else kept['CODE_BSS'].nunique()} repris de la jointure précédente")
+    return result
+
+
+def main():
+    joined = resolve_gauges(load_points())
+    print(f"Jointure enregistrée dans {OUTPUT_TABLE} ({joined['CODE_BSS'].nunique()} piézomètres, "
+          f"{len(joined)} lignes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,17 @@
-import subprocess
 import os
-
-download_data = False
-
-if not os.path.exists("graphs"):
-    os.makedirs("graphs")
-
-if not os.path.exists("data"):
-    download_data = True
-    os.makedirs("data")
-
-if not os.path.exists("data_all"):
-    os.makedirs("data_all")
-
-# Liste des scripts à exécuter dans l'ordre
-scripts = [
-    "geo_description.py", #description géo des données
-    "fetch_data.py",  # Récupération des données via API
-    "concat_data.py",  # Fusion des fichiers CSV
-    "describe_missing_data.py",  # Analyse des valeurs manquantes
-    "pivot_data.py",  # Transformation des données (mise en ligne par timestamp)
-    "describe_missing_data_after_pivot.py",  # Analyse des valeurs manquantes
-    "preprocess_data_all.py", #traitement des données
-    "preprocess_data_one_year.py", #traitement des données
-    "correlation matrix.py", # correlations entre chaque pizometre sur une années
-    "merge_pluvio.py"
-    "analyse_pluvio.py",
-    "analyse_pluvio_clustering_kmeans.py",
-    "analyse_pluvio_clustering_dbscan.py",
-    "analyse_geo.py",
-    "analyse_pluvio_clustering_and_soil.py"
-]
-
-for script in scripts:
-    print(f"Exécution du script : {script}")
-
-    if(script == "fetch_data.py" and not download_data):
-        continue
-
-    try:
-        subprocess.run(["python", script], check=True)
-        print(f"✔ {script} exécuté avec succès.\n")
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Erreur lors de l'exécution de {script} : {e}\n")
-        break
-
-print("✅ Tous les scripts ont été exécutés (sauf en cas d'erreur).")
+from pipeline import main
+
+# Dossiers de travail du pipeline
+for directory in ["graphs", "data", "data_all", "data_pluvio", "data_saiso", "maps"]:
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+# Les étapes, leurs entrées/sorties et leur ordre sont décrits dans pipeline.py (STAGES) :
+# les étapes indépendantes s'exécutent en parallèle et celles dont les entrées n'ont pas changé sont sautées
+# Par défaut, la séquence historique (et les étapes qui produisent ses entrées) ; les autres étapes
+# (analyse_saiso, analyse_saiso_clustering_kmeans, map_data) s'exécutent avec --only
+# Les données de l'API ne sont téléchargées que si data/ est vide, sauf avec --fetch (mise à jour incrémentale)
+# Options : --force (tout réexécuter), --fetch, --only <étapes>, --jobs <n>, --dry-run,
+# --in-process (un seul interpréteur, tables passées en mémoire entre les étapes)
+if __name__ == "__main__":
+    main()
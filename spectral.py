@@ -0,0 +1,140 @@
+import warnings
+
+import numpy as np
+from scipy.fft import irfft, next_fast_len, rfft, rfftfreq
+from scipy.signal import find_peaks
+
+from gap_filling import fill_series
+from pivot_engine import aggregate_daily, ordinals_to_dates
+
+# Définition des paramètres
+PERIOD = 365  # Période de la décomposition saisonnière (jours)
+MAX_LAG = 1000  # Décalage maximal de l'ACF (jours)
+BATCH_SIZE = 256  # Stations traitées à la fois (borne la mémoire des FFT et des décompositions)
+
+
+# Grille journalière commune : une ligne par station, une colonne par jour entre la première et
+# la dernière mesure toutes stations confondues (moyenne journalière, NaN les jours sans mesure)
+# Retourne les codes stations, les dates de la grille et la matrice (stations x jours) en float32
+def daily_grid(df):
+    unique_days, station_codes, rows, cols, means = aggregate_daily(df)
+    if not len(unique_days):
+        return station_codes, ordinals_to_dates([]), np.empty((len(station_codes), 0), dtype=np.float32)
+    first_day = unique_days[0]
+    n_days = int(unique_days[-1] - first_day + 1)
+    grid = np.full((len(station_codes), n_days), np.nan, dtype=np.float32)
+    grid[cols, unique_days[rows] - first_day] = means
+    return station_codes, ordinals_to_dates(np.arange(first_day, first_day + n_days)), grid
+
+
+# Séries ramenées à leur propre période de mesure (alignées à gauche), trous intérieurs interpolés
+# linéairement : chaque station devient une série journalière régulière, comme attendu par les FFT
+# Retourne la matrice (stations x longueur max, NaN après la fin de chaque série), les débuts et les longueurs
+def regularize(grid):
+    valid = ~np.isnan(grid)
+    has_data = valid.any(axis=1)
+    starts = np.where(has_data, np.argmax(valid, axis=1), 0)
+    stops = np.where(has_data, grid.shape[1] - np.argmax(valid[:, ::-1], axis=1), 0)
+    lengths = stops - starts
+
+    aligned = np.full((grid.shape[0], lengths.max() if len(lengths) else 0), np.nan)
+    days = np.arange(aligned.shape[1], dtype=np.float64)
+    for i in np.flatnonzero(has_data):
+        series = aligned[i, :lengths[i]]
+        series[:] = grid[i, starts[i]:stops[i]]
+        fill_series(series, days[:lengths[i]], None, method="linear", max_gap=np.inf)
+    return aligned, starts, lengths
+
+
+# Périodogrammes (échelle "spectrum", fenêtre rectangulaire, moyenne retirée, comme scipy.signal.periodogram)
+# calculés par lots de séries de même longueur, en une FFT par lot
+# Retourne pour chaque série (fréquences, puissance), None si la série est trop courte
+def periodograms(aligned, lengths):
+    results = [None] * len(lengths)
+    for n in np.unique(lengths[lengths > 1]):
+        index = np.flatnonzero(lengths == n)
+        batch = aligned[index, :n]
+        batch = batch - batch.mean(axis=1, keepdims=True)
+        power = np.abs(rfft(batch, axis=1)) ** 2 / float(n) ** 2
+        if n % 2:
+            power[:, 1:] *= 2
+        else:
+            power[:, 1:-1] *= 2
+        frequencies = rfftfreq(int(n))
+        for j, i in enumerate(index):
+            results[i] = (frequencies, power[j])
+    return results
+
+
+# Pics significatifs du spectre (au-dessus de la moyenne + 2 écarts-types) et périodes associées (jours)
+def spectrum_peaks(frequencies, power):
+    with np.errstate(divide="ignore"):
+        periods = np.where(frequencies == 0, np.nan, 1 / np.where(frequencies == 0, 1, frequencies))
+    peaks, _ = find_peaks(power, height=np.mean(power) + 2 * np.std(power))
+    return periods, peaks
+
+
+# Fonction d'autocorrélation de toutes les séries d'un coup par FFT (même définition que statsmodels.acf)
+# Retourne une matrice (stations x max_lag + 1), NaN au-delà de la longueur de chaque série
+def acf(aligned, lengths, max_lag=MAX_LAG):
+    valid = ~np.isnan(aligned)
+    with np.errstate(invalid="ignore"):
+        means = np.nansum(aligned, axis=1) / np.maximum(lengths, 1)
+    centered = np.where(valid, aligned - means[:, None], 0.0)
+    nfft = next_fast_len(2 * aligned.shape[1] - 1)
+    spectrum = rfft(centered, nfft, axis=1)
+    autocov = irfft(spectrum * np.conj(spectrum), nfft, axis=1)[:, :max_lag + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = autocov / autocov[:, :1]
+    result[np.arange(max_lag + 1)[None, :] >= lengths[:, None]] = np.nan
+    return result
+
+
+# Moyennes mobiles centrées de toutes les séries (filtre de seasonal_decompose : 2 x period si period est pair)
+# par sommes cumulées ; NaN si la fenêtre déborde de la série
+def moving_average(aligned, period=PERIOD):
+    n_rows, width = aligned.shape
+    filled = np.nan_to_num(aligned)
+    sums = np.zeros((n_rows, width + 1))
+    np.cumsum(filled, axis=1, out=sums[:, 1:])
+    counts = np.zeros((n_rows, width + 1))
+    np.cumsum(~np.isnan(aligned), axis=1, out=counts[:, 1:])
+
+    half = period // 2
+    trend = np.full(aligned.shape, np.nan)
+    t = np.arange(half, width - half)
+    if not len(t):
+        return trend
+    if period % 2:
+        window = sums[:, t + half + 1] - sums[:, t - half]
+        complete = counts[:, t + half + 1] - counts[:, t - half] == period
+    else:
+        window = sums[:, t + half] - sums[:, t - half + 1] + 0.5 * (filled[:, t - half] + filled[:, t + half])
+        complete = counts[:, t + half + 1] - counts[:, t - half] == period + 1
+    trend[:, t] = np.where(complete, window / period, np.nan)
+    return trend
+
+
+# Décomposition additive de toutes les séries (tendance, saisonnalité, résidu), comme seasonal_decompose :
+# tendance par moyenne mobile centrée, saisonnalité par moyenne de la série sans tendance à chaque phase
+def decompose(aligned, lengths, period=PERIOD):
+    trend = moving_average(aligned, period)
+    detrended = aligned - trend
+
+    n_rows, width = aligned.shape
+    n_cycles = -(-width // period)
+    padded = np.full((n_rows, n_cycles * period), np.nan)
+    padded[:, :width] = detrended
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # Phase sans aucune valeur : NaN
+        averages = np.nanmean(padded.reshape(n_rows, n_cycles, period), axis=1)
+        averages -= np.nanmean(averages, axis=1, keepdims=True)
+    seasonal = np.tile(averages, n_cycles)[:, :width]
+    seasonal[np.arange(width)[None, :] >= lengths[:, None]] = np.nan
+    return trend, seasonal, aligned - trend - seasonal
+
+
+# Découpage des stations en lots de BATCH_SIZE
+def batches(n_stations, batch_size=BATCH_SIZE):
+    for start in range(0, n_stations, batch_size):
+        yield np.arange(start, min(start + batch_size, n_stations))
@@ -0,0 +1,106 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+MAX_WORKERS = os.cpu_count() or 1  # Nombre de processus par défaut
+TASKS_PER_WORKER = 4  # Découpage des stations en lots, pour équilibrer la charge entre processus
+
+# Blocs de mémoire partagée ouverts par un processus worker, réutilisés d'un lot à l'autre
+_attached_blocks = {}
+
+
+# Partition unique du DataFrame par station (un seul groupby au lieu d'un masque par station)
+# Retourne les stations dans l'ordre de première apparition, la permutation qui regroupe les lignes
+# de chaque station et les bornes de chaque station dans cette permutation
+def partition_stations(df, key="code_bss"):
+    codes, station_ids = pd.factorize(df[key], sort=False)
+    order = np.argsort(codes, kind="stable")
+    order = order[np.count_nonzero(codes < 0):]  # Lignes sans station (codes -1, placés en tête)
+    counts = np.bincount(codes[codes >= 0], minlength=len(station_ids))
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    return np.asarray(station_ids), order, bounds
+
+
+# Parcours séquentiel des sous-DataFrames de chaque station, produits une seule fois
+def iter_stations(df, key="code_bss"):
+    station_ids, order, bounds = partition_stations(df, key)
+    df_sorted = df.iloc[order]
+    for i, station_id in enumerate(station_ids):
+        yield station_id, df_sorted.iloc[bounds[i]:bounds[i + 1]]
+
+
+# Copie des colonnes numériques en mémoire partagée : les workers les lisent sans copie ni sérialisation
+def share_arrays(arrays):
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        if block_name not in _attached_blocks:
+            _attached_blocks[block_name] = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached_blocks[block_name].buf)
+    return arrays
+
+
+# Exécution d'un lot de stations ; l'erreur d'une station n'interrompt pas les autres
+def run_tasks(func, arrays, tasks, args):
+    results = []
+    for station_id, start, stop in tasks:
+        station_arrays = {name: array[start:stop] for name, array in arrays.items()}
+        try:
+            results.append((station_id, func(station_id, station_arrays, *args), None))
+        except Exception:
+            results.append((station_id, None, traceback.format_exc()))
+    return results
+
+
+def run_shared_tasks(func, specs, tasks, args):
+    return run_tasks(func, attach_arrays(specs), tasks, args)
+
+
+# Application de func(station_id, arrays, *args) à chaque station, réparti sur plusieurs processus
+# arrays contient les tranches numpy (vues) des colonnes demandées pour la station
+# Retourne les résultats dans l'ordre des stations et les erreurs par station (trace complète)
+def run_per_station(func, df, columns, key="code_bss", args=(), max_workers=MAX_WORKERS, initializer=None):
+    station_ids, order, bounds = partition_stations(df, key)
+    arrays = {col: df[col].to_numpy()[order] for col in columns}
+    tasks = [(station_id, bounds[i], bounds[i + 1]) for i, station_id in enumerate(station_ids)]
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        if initializer is not None:
+            initializer()
+        outcomes = run_tasks(func, arrays, tasks, args)
+    else:
+        n_chunks = min(len(tasks), max_workers * TASKS_PER_WORKER)
+        chunks = [tasks[i::n_chunks] for i in range(n_chunks)]
+        blocks, specs = share_arrays(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+                futures = [executor.submit(run_shared_tasks, func, specs, chunk, args) for chunk in chunks]
+                by_station = {station_id: outcome for future in futures
+                              for station_id, *outcome in future.result()}
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+        outcomes = [(station_id, *by_station[station_id]) for station_id in station_ids]
+
+    results, errors = {}, {}
+    for station_id, result, error in outcomes:
+        if error is None:
+            results[station_id] = result
+        else:
+            errors[station_id] = error
+            print(f"Erreur lors du traitement de la station {station_id} :\n{error}")
+    return results, errors
@@ -0,0 +1,440 @@
+import importlib.util
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Format de stockage des tables intermédiaires : "parquet" (typé, compressé) ou "csv"
+# Sans pyarrow installé, on retombe sur le CSV
+STORAGE_FORMAT = os.environ.get("STORAGE_FORMAT", "parquet")
+CSV_EXPORT = os.environ.get("STORAGE_CSV_EXPORT", "0") == "1"  # Exporter aussi une copie CSV de chaque table
+PARQUET_COMPRESSION = "zstd"
+PARTITION_KEY = "departement"  # Clé des tables partitionnées : un dossier <table>/departement=<code>/ par valeur
+CHUNK_ROWS = 500000  # Lignes par morceau lors de la lecture en flux d'un fichier de table
+SEGMENTS_FILE = "_segments.json"  # Index d'une table segmentée (cf. append_segment)
+MAX_SEGMENTS = 64  # Au-delà, une table segmentée est recompactée en un seul fichier
+
+# Schéma des colonnes connues du pipeline
+DATE_COLUMNS = {"date_mesure", "Date"}
+CATEGORY_COLUMNS = {"code_bss", "Code Département", "NUM_POSTE"}
+FLOAT_COLUMNS = {"niveau_nappe_eau", "RR", "LATITUDE", "LONGITUDE", "x", "y", "correlation", "distance_km", "poids"}
+INT_COLUMNS = {"mois", "année", "jour_annee", "rang", "n_communs"}
+STATION_COLUMN = re.compile(r"\d{5}[A-Z]\d{4}/.+|BSS\d{3}[A-Z]{4}")  # Colonne piézomètre (code BSS) d'une table pivotée
+
+# Tables conservées en mémoire entre les étapes quand le pipeline tourne dans un seul processus
+# (cf. pipeline.py) ; None = pas de cache, chaque étape relit ses tables sur disque
+_memory_tables = None
+
+
+def parquet_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def storage_format(fmt=None):
+    fmt = fmt or STORAGE_FORMAT
+    if fmt == "parquet" and not parquet_available():
+        return "csv"
+    return fmt
+
+
+# Chemin d'une table ("data_all/nappes_concatenees") dans un format donné
+def table_path(name, fmt=None):
+    return f"{name}.{storage_format(fmt)}"
+
+
+# Fichier existant d'une table : Parquet en priorité, sinon CSV
+def existing_table_path(name):
+    for fmt in ("parquet", "csv"):
+        path = f"{name}.{fmt}"
+        if os.path.exists(path) and (fmt == "csv" or parquet_available()):
+            return path
+    return None
+
+
+def table_exists(name):
+    return existing_table_path(name) is not None or is_partitioned(name) or is_segmented(name)
+
+
+def keep_tables_in_memory(enabled=True):
+    global _memory_tables
+    _memory_tables = {} if enabled else None
+
+
+def release_table(name):
+    if _memory_tables is not None:
+        _memory_tables.pop(name, None)
+
+
+# Typage des colonnes : dates en datetime64, codes en catégories (encodage dictionnaire),
+# niveaux et colonnes piézomètres (tables pivotées) en float32
+# Les colonnes converties sont remplacées sur une copie superficielle : le DataFrame de l'appelant est inchangé
+def optimize_dtypes(df):
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            if not pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = pd.to_datetime(df[col], errors="coerce")
+        elif col in CATEGORY_COLUMNS:
+            df[col] = df[col].astype("category")
+        elif col in INT_COLUMNS:
+            df[col] = pd.to_numeric(df[col], errors="coerce", downcast="integer")
+        elif col in FLOAT_COLUMNS or pd.api.types.is_float_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(np.float32)
+        elif STATION_COLUMN.fullmatch(str(col)) and pd.api.types.is_string_dtype(df[col]):
+            # Colonne piézomètre relue en chaînes (CSV) : niveaux en float32 si toutes les valeurs sont numériques
+            # (un masque booléen reste tel quel) ; les autres colonnes inconnues ne sont pas converties
+            # (un code numérique garde ses zéros de tête)
+            try:
+                df[col] = pd.to_numeric(df[col]).astype(np.float32)
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+# Sauvegarde d'une table dans le format de stockage (et éventuellement en CSV)
+def save_table(df, name, fmt=None, csv_export=CSV_EXPORT):
+    fmt = storage_format(fmt)
+    directory = os.path.dirname(name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    path = table_path(name, fmt)
+    # Fichier temporaire propre à chaque écrivain : deux étapes peuvent enregistrer la même table simultanément
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if fmt == "parquet":
+        optimize_dtypes(df).to_parquet(tmp_path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(tmp_path, sep=";", index=False, encoding="utf-8")
+    os.replace(tmp_path, path)
+    remove_table_directory(name)
+
+    # L'ancienne version dans l'autre format ne doit pas masquer la nouvelle
+    other_path = f"{name}.{'csv' if fmt == 'parquet' else 'parquet'}"
+    if fmt == "parquet" and csv_export:
+        df.to_csv(other_path, sep=";", index=False, encoding="utf-8")
+    elif os.path.exists(other_path):
+        os.remove(other_path)
+
+    # Le fichier reste le point de reprise ; les étapes suivantes du même processus lisent la copie en mémoire
+    if _memory_tables is not None:
+        _memory_tables[name] = optimize_dtypes(df.copy())
+    return path
+
+
+# Chargement d'une table typée, quel que soit son format sur disque
+# Une copie est servie depuis la mémoire si la table y est conservée (les étapes peuvent la modifier)
+def load_table(name, columns=None):
+    if _memory_tables is not None and name in _memory_tables:
+        df = _memory_tables[name]
+        return (df if columns is None else df[columns]).copy()
+    df = read_table(name, columns)
+    if _memory_tables is not None and columns is None:
+        _memory_tables[name] = df
+        return df.copy()
+    return df
+
+
+def read_table(name, columns=None):
+    path = existing_table_path(name)
+    if path is None and is_segmented(name):
+        return read_segments(name, columns=columns)
+    if path is None and is_partitioned(name):
+        parts = [read_file(file, columns) for value in list_partitions(name) for file in partition_files(name, value)]
+        return optimize_dtypes(pd.concat(parts, ignore_index=True)) if parts else pd.DataFrame(columns=columns)
+    if path is None:
+        raise FileNotFoundError(f"La table {name} est introuvable (ni .parquet ni .csv).")
+    return read_file(path, columns)
+
+
+# Lecture typée d'un fichier de table (Parquet ou CSV)
+def read_file(path, columns=None):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        # Les colonnes de codes sont relues directement en catégories (encodage dictionnaire)
+        schema_names = pq.read_schema(path).names
+        dictionary_columns = [col for col in CATEGORY_COLUMNS if col in schema_names]
+        table = pq.read_table(path, columns=columns, read_dictionary=dictionary_columns)
+        return table.to_pandas()
+    df = pd.read_csv(path, sep=";", dtype=str, usecols=columns)
+    return optimize_dtypes(df)
+
+
+# Écriture d'une table par morceaux successifs, sans jamais la matérialiser en mémoire
+# Le schéma est fixé par le premier morceau ; la table n'apparaît qu'à la fermeture (écriture atomique)
+class TableWriter:
+    def __init__(self, name, fmt=None):
+        self.name = name
+        self.fmt = storage_format(fmt)
+        self.path = table_path(name, self.fmt)
+        self.tmp_path = self.path + ".tmp"
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+        directory = os.path.dirname(name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, df):
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            df = optimize_dtypes(df)
+            # Les catégories sont écrites en chaînes (valeurs manquantes conservées) : Parquet les encode
+            # en dictionnaire par row group
+            for col in df.columns:
+                if isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = df[col].astype("string")
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=PARQUET_COMPRESSION)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.tmp_path, sep=";", index=False, encoding="utf-8",
+                      mode="a" if self.rows else "w", header=not self.rows)
+            self.writer = True
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is None:
+            return None
+        if self.fmt == "parquet":
+            self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        release_table(self.name)
+        remove_table_directory(self.name)
+
+        # L'ancienne version dans l'autre format ne doit pas masquer la nouvelle
+        other_path = f"{self.name}.{'csv' if self.fmt == 'parquet' else 'parquet'}"
+        if os.path.exists(other_path):
+            os.remove(other_path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.writer is not None:
+            if self.fmt == "parquet":
+                self.writer.close()
+            os.remove(self.tmp_path)
+
+
+# Tables partitionnées : un dossier par valeur de la clé (<table>/departement=<code>/), chacun contenant un ou
+# plusieurs fichiers au format de stockage ; une partition se lit (et s'écrit) indépendamment des autres
+def partition_path(name, value, key=PARTITION_KEY):
+    return os.path.join(name, f"{key}={value}")
+
+
+def is_partitioned(name, key=PARTITION_KEY):
+    return os.path.isdir(name) and any(entry.startswith(f"{key}=") for entry in os.listdir(name))
+
+
+# Valeurs des partitions présentes, triées
+def list_partitions(name, key=PARTITION_KEY):
+    if not os.path.isdir(name):
+        return []
+    prefix = f"{key}="
+    return sorted(entry[len(prefix):] for entry in os.listdir(name)
+                  if entry.startswith(prefix) and os.path.isdir(os.path.join(name, entry)))
+
+
+# Fichiers d'une partition, triés (les fichiers temporaires sont ignorés)
+def partition_files(name, value, key=PARTITION_KEY):
+    directory = partition_path(name, value, key)
+    return [os.path.join(directory, entry) for entry in sorted(os.listdir(directory))
+            if entry.endswith((".parquet", ".csv"))]
+
+
+# Lecture en flux d'un fichier de table, par morceaux typés d'au plus chunk_rows lignes
+def iter_file_chunks(path, columns=None, chunk_rows=CHUNK_ROWS):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, sep=";", dtype=str, usecols=columns, chunksize=chunk_rows):
+            yield optimize_dtypes(chunk)
+
+
+# Mise en place d'une table partitionnée écrite dans un dossier temporaire : l'ancienne version (partitionnée
+# ou en un seul fichier) n'est remplacée qu'une fois la nouvelle complète
+def replace_partitioned(tmp_dir, name):
+    release_table(name)
+    old_dir = f"{name}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(name):
+        os.replace(name, old_dir)
+    os.replace(tmp_dir, name)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    for fmt in ("parquet", "csv"):
+        if os.path.exists(f"{name}.{fmt}"):
+            os.remove(f"{name}.{fmt}")
+    return name
+
+
+# Version précédente d'une table écrite d'un bloc, stockée sous forme de dossier (partitionnée ou segmentée)
+def remove_table_directory(name):
+    if is_segmented(name) or is_partitioned(name):
+        shutil.rmtree(name)
+
+
+# Tables segmentées : dossier <table>/ de fichiers successifs (segment-00000.parquet, ...) décrits par
+# _segments.json (génération, fichier, nombre de lignes et bornes de la colonne de dates de chaque segment)
+# Une mise à jour incrémentale ajoute un segment, ou remplace les lignes à partir d'une date, sans réécrire
+# le reste de la table ; la génération change quand des lignes déjà écrites sont modifiées
+def load_segments(name):
+    path = os.path.join(name, SEGMENTS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_segments(name, index):
+    path = os.path.join(name, SEGMENTS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def is_segmented(name):
+    return os.path.exists(os.path.join(name, SEGMENTS_FILE))
+
+
+# Version d'une table pour les marques de progression des lecteurs incrémentaux : [génération, nombre de segments]
+# Une table en un seul fichier est un segment unique, de génération dérivée de sa taille et de sa date
+def table_version(name):
+    index = load_segments(name)
+    if index is not None:
+        return [index["generation"], len(index["segments"])]
+    path = existing_table_path(name)
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [f"{stat.st_size}-{stat.st_mtime_ns}", 1]
+
+
+def write_file(df, path, fmt):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if fmt == "parquet":
+        optimize_dtypes(df).to_parquet(tmp_path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(tmp_path, sep=";", index=False, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def segment_entry(df, file, column):
+    values = df[column].dropna() if column is not None and column in df.columns else pd.Series(dtype=object)
+    return {"file": file, "rows": len(df), "min": None if values.empty else str(values.min()),
+            "max": None if values.empty else str(values.max())}
+
+
+# Index d'une table à compléter : une table en un seul fichier devient le premier segment, avec la même version
+# (ses lecteurs incrémentaux n'ont alors que les segments ajoutés à lire)
+def open_segments(name, column):
+    index = load_segments(name)
+    if index is not None:
+        return index
+    path = existing_table_path(name)
+    os.makedirs(name, exist_ok=True)
+    if path is None:
+        return {"generation": uuid.uuid4().hex, "column": column, "segments": [], "next": 0}
+    generation = table_version(name)[0]
+    file = f"segment-00000.{path.rsplit('.', 1)[1]}"
+    entry = segment_entry(read_file(path, [column] if column else None), file, column)
+    os.replace(path, os.path.join(name, file))
+    return {"generation": generation, "column": column, "segments": [entry], "next": 1}
+
+
+def write_segment(df, name, index, fmt):
+    file = f"segment-{index['next']:05d}.{storage_format(fmt)}"
+    write_file(df, os.path.join(name, file), storage_format(fmt))
+    index["segments"].append(segment_entry(df, file, index["column"]))
+    index["next"] += 1
+
+
+# Ajout de lignes en fin de table (nouveau segment) ; au-delà de MAX_SEGMENTS segments, la table est recompactée
+# en un seul fichier (nouvelle version : les lecteurs incrémentaux repartent de zéro)
+# column : colonne de dates dont les bornes sont notées par segment (cf. replace_segments_from)
+def append_segment(df, name, column=None, fmt=None):
+    index = open_segments(name, column)
+    write_segment(df, name, index, fmt)
+    save_segments(name, index)
+    release_table(name)
+    if len(index["segments"]) > MAX_SEGMENTS:
+        save_table(read_segments(name), name, fmt=fmt)
+    return table_version(name)
+
+
+# Remplacement des lignes dont la date (colonne de l'index) est >= value par df : segments entièrement postérieurs
+# supprimés, segment à cheval tronqué, puis df ajouté en un segment ; la génération change
+def replace_segments_from(df, name, value, column, fmt=None):
+    index = open_segments(name, column)
+    value = pd.Timestamp(value)
+    kept, removed = [], []
+    for entry in index["segments"]:
+        if entry["min"] is not None and pd.Timestamp(entry["min"]) >= value:
+            removed.append(entry)
+        elif entry["max"] is not None and pd.Timestamp(entry["max"]) >= value:
+            path = os.path.join(name, entry["file"])
+            part = read_file(path)
+            part = part[part[column] < value]
+            write_file(part, path, path.rsplit(".", 1)[1])
+            kept.append(segment_entry(part, entry["file"], column))
+        else:
+            kept.append(entry)
+    index.update(generation=uuid.uuid4().hex, segments=kept)
+    if not df.empty:
+        write_segment(df, name, index, fmt)
+    save_segments(name, index)
+    for entry in removed:
+        os.remove(os.path.join(name, entry["file"]))
+    release_table(name)
+    if len(index["segments"]) > MAX_SEGMENTS:
+        save_table(read_segments(name), name, fmt=fmt)
+    return table_version(name)
+
+
+# Concaténation de morceaux d'une même table ; une colonne booléenne absente des premiers morceaux (nouvelle
+# colonne d'une table large) est complétée par False
+def concat_frames(frames, columns=None):
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    for col in df.columns:
+        if df[col].dtype == object and any(col in f.columns and f[col].dtype == bool for f in frames):
+            df[col] = df[col].fillna(False).astype(bool)
+    return optimize_dtypes(df)
+
+
+# Lignes des segments à partir du start-ième (ajouts postérieurs à une marque de progression),
+# éventuellement limitées aux dates >= since
+def read_segments(name, start=0, columns=None, since=None):
+    index = load_segments(name)
+    if index is None:
+        df = read_table(name, columns) if start == 0 else pd.DataFrame(columns=columns)
+        return df if since is None or df.empty else df[df[index_column(df)] >= pd.Timestamp(since)]
+    frames = []
+    for entry in index["segments"][start:]:
+        if since is not None and entry["max"] is not None and pd.Timestamp(entry["max"]) < pd.Timestamp(since):
+            continue
+        part = read_file(os.path.join(name, entry["file"]), columns)
+        if since is not None:
+            part = part[part[index["column"]] >= pd.Timestamp(since)]
+        frames.append(part)
+    return concat_frames(frames, columns)
+
+
+def index_column(df):
+    return next(col for col in df.columns if col in DATE_COLUMNS)
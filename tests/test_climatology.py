@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import climatology
+from pivot_engine import day_ordinals
+
+# Les statistiques par (jour de l'année, station) cumulées par lots (fusion de Chan) doivent être celles
+# d'un calcul en une passe sur toutes les mesures
+
+
+def matrix(n_stations=4, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2018-11-01", "2021-03-31", freq="D")
+    values = 10 + np.sin(np.arange(len(dates)) / 58)[:, None] + rng.standard_normal((len(dates), n_stations))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    return day_ordinals(dates.values), np.array([f"S{j}" for j in range(n_stations)]), values
+
+
+def reference(days, codes, values):
+    df = pd.DataFrame(values, columns=codes)
+    df["doy"] = climatology.day_of_year(days)
+    long = df.melt(id_vars="doy", var_name="code", value_name="value").dropna()
+    return long.groupby(["doy", "code"])["value"].agg(["count", "mean", "var"])
+
+
+def assert_state_matches(state, expected):
+    doy, code = expected.index.get_level_values(0), expected.index.get_level_values(1)
+    columns = np.searchsorted(state["codes"], code)
+    np.testing.assert_array_equal(state["count"][doy, columns], expected["count"])
+    np.testing.assert_allclose(state["mean"][doy, columns], expected["mean"], rtol=1e-12)
+    several = expected["count"].to_numpy() > 1
+    variance = state["m2"][doy, columns] / np.maximum(expected["count"].to_numpy() - 1, 1)
+    np.testing.assert_allclose(variance[several], expected["var"].to_numpy()[several], rtol=1e-9)
+    assert state["count"].sum() == expected["count"].sum()
+
+
+def test_from_matrix_matches_pandas():
+    days, codes, values = matrix()
+
+    state = climatology.from_matrix(days, codes, values)
+
+    assert_state_matches(state, reference(days, codes, values))
+    assert state["present"].all()
+
+
+@pytest.mark.parametrize("batches", [2, 7])
+def test_batched_updates_match_a_single_pass(batches):
+    days, codes, values = matrix()
+    one_pass = climatology.from_matrix(days, codes, values)
+
+    # Premier lot sans la dernière station, qui n'apparaît qu'ensuite
+    bounds = np.linspace(0, len(days), batches + 1).astype(int)
+    state = climatology.from_matrix(days[:bounds[1]], codes[:-1], values[:bounds[1], :-1])
+    tail = values.copy()
+    tail[:bounds[1], :-1] = np.nan
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        rows, cols = np.nonzero(~np.isnan(tail[start:stop]))
+        state = climatology.update(state, days[start:stop][rows], codes[cols], tail[start:stop][rows, cols])
+
+    np.testing.assert_array_equal(state["codes"], one_pass["codes"])
+    np.testing.assert_array_equal(state["count"], one_pass["count"])
+    np.testing.assert_allclose(state["mean"], one_pass["mean"], rtol=1e-12)
+    np.testing.assert_allclose(state["m2"], one_pass["m2"], rtol=1e-9, atol=1e-9)
+
+
+def test_state_round_trip(tmp_path):
+    days, codes, values = matrix()
+    state = climatology.from_matrix(days, codes, values)
+
+    generation = climatology.save_state(state, str(tmp_path / "stats"))
+
+    loaded = climatology.load_state(str(tmp_path / "stats"))
+    assert loaded["generation"] == generation
+    for key in climatology.STATE_FILES:
+        np.testing.assert_array_equal(loaded[key], state[key])
+
+
+def test_annual_curves_match_pandas():
+    days, codes, values = matrix()
+    state = climatology.from_matrix(days, codes, values)
+
+    doys, means = climatology.annual_means(state)
+
+    expected = reference(days, codes, values)["mean"].unstack().reindex(columns=codes)
+    assert list(doys) == list(expected.index + 1)
+    np.testing.assert_allclose(means, expected.to_numpy(), rtol=1e-6)
+
+    normalized = climatology.normalize(means)
+    df = pd.DataFrame(means.astype(np.float64))
+    np.testing.assert_allclose(normalized, (df - df.mean()) / df.std(), rtol=1e-4, atol=1e-5)
+
+    smoothed = climatology.smooth(normalized, window=5)
+    padded = pd.DataFrame(np.concatenate([normalized[-2:], normalized, normalized[:2]]))
+    expected_smooth = padded.rolling(5, center=True).mean().to_numpy()[2:-2]
+    np.testing.assert_allclose(smoothed, expected_smooth, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sklearn.cluster import DBSCAN, KMeans
+from sklearn.datasets import make_blobs
+from sklearn.metrics import silhouette_score
+
+import cluster_search
+
+# La recherche par graphe de voisinage en cache doit donner les mêmes étiquettes et silhouettes que sklearn
+
+
+@pytest.fixture
+def points():
+    X, _ = make_blobs(n_samples=150, centers=4, cluster_std=0.8, random_state=3)
+    return np.vstack([X, [[30.0, 30.0], [-30.0, 20.0]]])  # Deux points isolés (bruit)
+
+
+@pytest.mark.parametrize("eps", [0.3, 0.8, 1.5, 3.0])
+def test_dbscan_labels_match_sklearn(points, eps):
+    min_samples_values = [1, 3, 5, 10]
+    cache = cluster_search.distance_cache(points, 3.0)
+
+    labelings = cluster_search.dbscan_labels(cache, eps, min_samples_values)
+
+    for min_samples, labels in zip(min_samples_values, labelings):
+        expected = DBSCAN(eps=eps, min_samples=min_samples).fit(points).labels_
+        np.testing.assert_array_equal(labels, expected)
+
+
+@pytest.mark.parametrize("sample_size", [cluster_search.SILHOUETTE_SAMPLE, 60])
+def test_cached_silhouette_matches_sklearn(points, sample_size):
+    labels = DBSCAN(eps=1.5, min_samples=5).fit(points).labels_
+    cache = cluster_search.silhouette_cache(points, sample_size)
+
+    score = cluster_search.cached_silhouette(cache, labels)
+
+    sample = np.arange(len(points)) if cache["sample"] is None else cache["sample"]
+    assert score == pytest.approx(silhouette_score(points[sample], labels[sample]), abs=1e-12)
+    assert cluster_search.cached_silhouette(cache, np.zeros(len(points), dtype=int)) is None
+
+
+def test_search_dbscan_returns_the_best_candidate(points):
+    eps_values, min_samples_values = [0.5, 1.0, 2.0], [3, 5]
+
+    best, candidates = cluster_search.search_dbscan(points, eps_values, min_samples_values, allow_noise=True,
+                                                    max_workers=2)
+
+    assert len(candidates) == 6
+    scores = {}
+    for eps in eps_values:
+        for min_samples in min_samples_values:
+            labels = DBSCAN(eps=eps, min_samples=min_samples).fit(points).labels_
+            if len(set(labels)) > 1:
+                scores[(eps, min_samples)] = silhouette_score(points, labels)
+    expected = max(scores, key=scores.get)
+    assert (best["eps"], best["min_samples"]) == expected
+    assert best["score"] == pytest.approx(scores[expected], abs=1e-12)
+    np.testing.assert_array_equal(best["labels"], DBSCAN(eps=expected[0], min_samples=expected[1]).fit(points).labels_)
+
+
+def test_search_kmeans_matches_sklearn(points):
+    best, candidates = cluster_search.search_kmeans(points, [2, 3, 4, 5, 500], max_workers=2)
+
+    assert list(candidates["k"]) == [2, 3, 4, 5]
+    for k, inertia, score in zip(candidates["k"], candidates["inertia"], candidates["score"]):
+        model = KMeans(n_clusters=k, random_state=cluster_search.KMEANS_RANDOM_STATE,
+                       n_init=cluster_search.KMEANS_N_INIT).fit(points)
+        assert inertia == pytest.approx(model.inertia_)
+        assert score == pytest.approx(silhouette_score(points, model.labels_), abs=1e-12)
+    assert best["k"] == candidates.loc[candidates["score"].idxmax(), "k"]
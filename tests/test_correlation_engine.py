@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import correlation_engine
+
+# Le moteur par blocs doit reproduire DataFrame.corr (Pearson, valeurs manquantes traitées paire par paire)
+
+
+def levels(n_days=120, n_stations=23, missing=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    common = rng.standard_normal((n_days, 3))
+    values = common @ rng.standard_normal((3, n_stations)) + 0.5 * rng.standard_normal((n_days, n_stations))
+    values[rng.random(values.shape) < missing] = np.nan
+    codes = [f"S{j:03d}" for j in range(n_stations)]
+    return pd.DataFrame(values.astype(np.float32), columns=codes)
+
+
+@pytest.mark.parametrize("missing", [0.0, 0.3])
+@pytest.mark.parametrize("block_size", [4, 1024])
+def test_correlation_matrix_matches_dataframe_corr(missing, block_size):
+    df = levels(missing=missing)
+    df["constante"] = np.float32(1.0)
+    df["vide"] = np.float32(np.nan)
+
+    matrix = correlation_engine.correlation_matrix(df.to_numpy(), block_size=block_size)
+
+    np.testing.assert_allclose(matrix, df.corr().to_numpy(), atol=1e-5, equal_nan=True)
+
+
+def test_top_k_neighbors_match_the_full_matrix():
+    df = levels(missing=0.2)
+    expected = df.corr().to_numpy(copy=True)
+    np.fill_diagonal(expected, np.nan)
+
+    neighbors = correlation_engine.top_k_neighbors(df.to_numpy(), df.columns, k=3, block_size=5)
+
+    assert list(neighbors.columns) == ["CODE_BSS", "rang", "voisin", "correlation", "n_communs"]
+    assert len(neighbors) == 3 * df.shape[1]
+    for code, group in neighbors.groupby("CODE_BSS"):
+        j = df.columns.get_loc(code)
+        best = np.sort(expected[:, j][~np.isnan(expected[:, j])])[::-1][:3]
+        assert list(group["rang"]) == [1, 2, 3]
+        np.testing.assert_allclose(group["correlation"], best, atol=1e-5)
+        pairs = df[[code] + list(group["voisin"])].notna()
+        assert list(group["n_communs"]) == [int((pairs[code] & pairs[v]).sum()) for v in group["voisin"]]
+
+
+def test_correlation_graph_keeps_pairs_above_threshold():
+    df = levels(missing=0.1)
+    expected = df.corr().to_numpy()
+    rows, cols = np.nonzero(np.triu(np.abs(expected) >= 0.5, k=1))
+
+    graph = correlation_engine.correlation_graph(df.to_numpy(), df.columns, 0.5, block_size=6)
+
+    graph = graph.sort_values(["station_a", "station_b"], ignore_index=True)
+    assert list(zip(graph["station_a"], graph["station_b"])) == [(df.columns[i], df.columns[j])
+                                                                 for i, j in zip(rows, cols)]
+    np.testing.assert_allclose(graph["correlation"], expected[rows, cols], atol=1e-5)
+
+
+def test_binned_matrix_averages_the_full_matrix():
+    df = levels(n_stations=12)
+    matrix = df.corr().to_numpy()
+
+    binned = correlation_engine.binned_matrix(df.to_numpy(), np.arange(12), 3, block_size=5)
+
+    expected = matrix.reshape(3, 4, 3, 4).mean(axis=(1, 3))
+    np.testing.assert_allclose(binned, expected, atol=1e-5)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import crosscorr
+
+# Les corrélations décalées calculées par FFT doivent reproduire np.corrcoef sur chaque fenêtre recouvrante
+
+
+def series(rng, lengths):
+    x_list, y_list = [], []
+    for n in lengths:
+        x = rng.standard_normal(n).cumsum()
+        y = np.roll(x, 5) + 0.5 * rng.standard_normal(n)  # y suit x avec 5 jours de retard
+        x_list.append(x + 100)
+        y_list.append(y)
+    return x_list, y_list
+
+
+def reference(x, y, max_lag):
+    corr = np.full(max_lag, np.nan)
+    for k in range(1, max_lag + 1):
+        if len(x) - k >= 2:
+            corr[k - 1] = np.corrcoef(x[:len(x) - k], y[k:])[0, 1]
+    return corr
+
+
+def test_lagged_correlation_matches_corrcoef():
+    rng = np.random.default_rng(0)
+    x_list, y_list = series(rng, [60, 200, 35])
+    max_lag = 40
+
+    corr = crosscorr.lagged_correlation(x_list, y_list, max_lag)
+
+    assert corr.shape == (3, max_lag)
+    for i, (x, y) in enumerate(zip(x_list, y_list)):
+        np.testing.assert_allclose(corr[i], reference(x, y, max_lag), atol=1e-9, equal_nan=True)
+
+
+def test_constant_series_has_no_correlation():
+    corr = crosscorr.lagged_correlation([np.ones(50)], [np.arange(50.0)], 10)
+
+    assert np.isnan(corr).all()
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 256])
+def test_best_lags_finds_the_delay(batch_size):
+    rng = np.random.default_rng(1)
+    x_list, y_list = series(rng, [300, 250, 400])
+    x_list.append(np.ones(300))  # Aucune corrélation définie
+    y_list.append(rng.standard_normal(300))
+
+    lags, corrs = crosscorr.best_lags(x_list, y_list, max_lag=30, batch_size=batch_size)
+
+    for i in range(3):
+        expected = reference(x_list[i], y_list[i], 30)
+        assert lags[i] == np.nanargmax(expected) + 1 == 5
+        assert corrs[i] == pytest.approx(np.nanmax(expected), abs=1e-9)
+    assert lags[3] == -1 and np.isnan(corrs[3])
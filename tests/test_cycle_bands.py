@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cycle_bands
+
+# Le classement vectorisé doit reproduire la boucle « pour chaque bande, low <= période <= high »
+
+
+def reference_presence(peaks_per_series, bands):
+    return np.array([[int(any(low <= period <= high for period in peaks)) for _, low, high in bands]
+                     for peaks in peaks_per_series], dtype=np.uint8)
+
+
+def test_presence_matrix_matches_a_loop_over_bands():
+    rng = np.random.default_rng(0)
+    peaks_per_series = [rng.uniform(1, 5000, rng.integers(0, 8)) for _ in range(50)]
+    peaks_per_series += [[], [5, 9, 25, 35, 4150], [4.999, 9.001, 395.5]]  # Bornes incluses, hors bandes
+    names, lows, highs = cycle_bands.band_table(cycle_bands.DEFAULT_BANDS)
+
+    periods, series = cycle_bands.flatten_peaks(peaks_per_series)
+    matrix = cycle_bands.presence_matrix(periods, series, len(peaks_per_series), lows, highs)
+
+    assert names == [name for name, _, _ in cycle_bands.DEFAULT_BANDS]
+    np.testing.assert_array_equal(matrix, reference_presence(peaks_per_series, cycle_bands.DEFAULT_BANDS))
+    assert matrix[-2].tolist() == [1, 1, 0, 0, 0, 1]
+    assert matrix[-1].tolist() == [0] * 6
+
+
+def test_band_table_sorts_bands_and_classify_follows():
+    bands = [("Long", 300, 400), ("Court", 1, 10), ("Moyen", 20, 30)]
+
+    names, lows, highs = cycle_bands.band_table(bands)
+
+    assert names == ["Court", "Moyen", "Long"]
+    assert cycle_bands.classify([0.5, 1, 10, 15, 25, 400, 401], lows, highs).tolist() == [-1, 0, 0, -1, 1, 2, -1]
+
+
+@pytest.mark.parametrize("bands, message", [
+    ([], "Aucune bande"),
+    ([("A", 1, 10), ("A", 20, 30)], "double"),
+    ([("A", 10, 1)], "borne haute"),
+    ([("A", 1, 10), ("B", 10, 20)], "chevauchent"),
+])
+def test_band_table_rejects_invalid_bands(bands, message):
+    with pytest.raises(ValueError, match=message):
+        cycle_bands.band_table(bands)
+
+
+def test_bands_file_replaces_the_defaults(tmp_path, monkeypatch):
+    path = tmp_path / "bandes.csv"
+    pd.DataFrame({"nom": ["Annuel", "Mensuel"], "min": [300, 25], "max": [430, 35]}).to_csv(path, sep=";",
+                                                                                            index=False)
+    monkeypatch.setattr(cycle_bands, "BANDS_FILE", str(path))
+
+    names, lows, highs = cycle_bands.band_table()
+
+    assert names == ["Mensuel", "Annuel"]
+    np.testing.assert_array_equal(lows, [25, 300])
+    np.testing.assert_array_equal(highs, [35, 430])
+
+
+def test_flatten_peaks_without_any_peak():
+    periods, series = cycle_bands.flatten_peaks([[], []])
+
+    matrix = cycle_bands.presence_matrix(periods, series, 2, *cycle_bands.band_table(cycle_bands.DEFAULT_BANDS)[1:])
+
+    assert matrix.shape == (2, 6) and not matrix.any()
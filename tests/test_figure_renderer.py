@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import figure_renderer
+
+# Les figures dont les données n'ont pas changé sont sautées ; une figure en erreur n'empêche pas les autres
+
+
+def specs(directory, n=4, shift=0.0):
+    x = pd.date_range("2020-01-01", periods=50).to_numpy()
+    rng = np.random.default_rng(0)
+    result = []
+    for i in range(n):
+        data = {"x": x, "level": rng.standard_normal(50) + shift, "rain": rng.random(50)}
+        result.append(figure_renderer.figure_spec("level_rain", str(directory / f"station_{i}"), data,
+                                                  title=f"Station {i}"))
+    return result
+
+
+def test_unchanged_figures_are_skipped(tmp_path):
+    rendered, skipped, errors = figure_renderer.render_figures(specs(tmp_path), max_workers=1)
+    assert (len(rendered), skipped, errors) == (4, 0, {})
+    assert sorted(json.loads((tmp_path / figure_renderer.MANIFEST_FILE).read_text())) == [
+        f"station_{i}.png" for i in range(4)]
+
+    rendered, skipped, _ = figure_renderer.render_figures(specs(tmp_path), max_workers=1)
+    assert (rendered, skipped) == ([], 4)
+
+    # Données modifiées, fichier supprimé ou format différent : la figure est refaite
+    changed = specs(tmp_path)
+    changed[1]["data"]["rain"] = changed[1]["data"]["rain"] * 2
+    (tmp_path / "station_2.png").unlink()
+    rendered, skipped, _ = figure_renderer.render_figures(changed, max_workers=1)
+    assert (sorted(rendered), skipped) == ([str(tmp_path / "station_1.png"), str(tmp_path / "station_2.png")], 2)
+
+    rendered, skipped, _ = figure_renderer.render_figures(specs(tmp_path), fmt="svg", max_workers=1)
+    assert (len(rendered), skipped) == (4, 0)
+    assert (tmp_path / "station_0.svg").read_text().lstrip().startswith("<?xml")
+
+
+def test_errors_do_not_stop_other_figures(tmp_path, capsys):
+    batch = specs(tmp_path, n=3)
+    del batch[1]["data"]["rain"]
+
+    rendered, skipped, errors = figure_renderer.render_figures(batch, max_workers=1)
+
+    assert sorted(rendered) == [str(tmp_path / "station_0.png"), str(tmp_path / "station_2.png")]
+    assert list(errors) == [str(tmp_path / "station_1")]
+    assert "KeyError" in errors[str(tmp_path / "station_1")]
+    assert "station_1.png" not in json.loads((tmp_path / figure_renderer.MANIFEST_FILE).read_text())
+
+    # La figure en erreur est retentée à l'exécution suivante
+    rendered, skipped, errors = figure_renderer.render_figures(specs(tmp_path, n=3), max_workers=1)
+    assert (rendered, skipped, errors) == ([str(tmp_path / "station_1.png")], 2, {})
+
+
+def test_parallel_rendering_matches_serial(tmp_path):
+    serial, parallel = tmp_path / "serial", tmp_path / "parallel"
+    serial.mkdir()
+    parallel.mkdir()
+
+    rendered_serial, _, _ = figure_renderer.render_figures(specs(serial, n=6), max_workers=1)
+    rendered_parallel, _, errors = figure_renderer.render_figures(specs(parallel, n=6), max_workers=2)
+
+    assert errors == {}
+    assert sorted(path.replace(str(parallel), str(serial)) for path in rendered_parallel) == sorted(rendered_serial)
+    assert (json.loads((serial / figure_renderer.MANIFEST_FILE).read_text())
+            == json.loads((parallel / figure_renderer.MANIFEST_FILE).read_text()))
+
+
+@pytest.mark.parametrize("kind, data, options", [
+    ("line", {"x": np.arange(10), "y": np.arange(10) ** 2}, {"title": "Courbe"}),
+    ("decomposition", {name: np.arange(20.0) for name in ["x", "observed", "trend", "seasonal", "resid"]}, {}),
+    ("acf", {"acf": np.r_[1.0, 0.5, 0.25, 0.1, np.nan], "n": 30}, {}),
+    ("spectrum", {"periods": np.array([10.0, 20.0, 30.0]), "power": np.array([1.0, 5.0, 2.0]),
+                  "peaks": np.array([1])}, {"max_period": 40}),
+])
+def test_every_renderer_draws(tmp_path, kind, data, options):
+    spec = figure_renderer.figure_spec(kind, str(tmp_path / kind), data, **options)
+
+    rendered, _, errors = figure_renderer.render_figures([spec], max_workers=1)
+
+    assert errors == {}
+    assert rendered == [str(tmp_path / f"{kind}.png")]
+
+
+def test_spec_digest_depends_on_data_options_and_format(tmp_path):
+    spec = specs(tmp_path, n=1)[0]
+    digest = figure_renderer.spec_digest(spec, "png")
+
+    assert figure_renderer.spec_digest(specs(tmp_path, n=1)[0], "png") == digest
+    assert figure_renderer.spec_digest(spec, "svg") != digest
+    assert figure_renderer.spec_digest(specs(tmp_path, n=1, shift=1.0)[0], "png") != digest
+    other = dict(spec, options={"title": "Autre"})
+    assert figure_renderer.spec_digest(other, "png") != digest
+    as_float32 = dict(spec, data=dict(spec["data"], level=spec["data"]["level"].astype(np.float32)))
+    assert figure_renderer.spec_digest(as_float32, "png") != digest
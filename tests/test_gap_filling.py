@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.interpolate import CubicSpline, PchipInterpolator
+
+import gap_filling
+
+# Seuls les trous intérieurs d'au plus max_gap jours sont comblés, et le masque désigne exactement ces valeurs
+
+
+def levels(n_days=120, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=n_days, freq="D")
+    df = pd.DataFrame({"date_mesure": dates})
+    for j in range(3):
+        values = np.sin(np.arange(n_days) / 9 + j) * 2 + 50 + rng.standard_normal(n_days) * 0.1
+        values[rng.random(n_days) < 0.25] = np.nan
+        df[f"0047{j}X0095/S1"] = values.astype(np.float32)
+    return df
+
+
+def test_only_interior_gaps_up_to_max_gap_are_filled():
+    y = np.array([np.nan, 1, np.nan, 3, np.nan, np.nan, np.nan, 7, np.nan])
+    days = np.arange(len(y), dtype=np.float64)
+
+    mask = gap_filling.fill_series(y, days, None, method="linear", max_gap=2)
+
+    assert mask.tolist() == [False, False, True, False, False, False, False, False, False]
+    np.testing.assert_array_equal(y, [np.nan, 1, 2, 3, np.nan, np.nan, np.nan, 7, np.nan])
+
+
+def test_max_gap_counts_missing_days_not_rows():
+    # Deux lignes consécutives séparées de 10 jours : le trou compte 9 jours manquants
+    y = np.array([1.0, np.nan, 3.0])
+    days = np.array([0.0, 5.0, 10.0])
+
+    assert not gap_filling.fill_series(y.copy(), days, None, method="linear", max_gap=8).any()
+    assert gap_filling.fill_series(y.copy(), days, None, method="linear", max_gap=9).tolist() == [False, True, False]
+
+
+@pytest.mark.parametrize("method", gap_filling.METHODS)
+def test_fill_gaps_mask_marks_the_filled_cells(method):
+    df = levels()
+
+    filled, mask = gap_filling.fill_gaps(df, method=method, max_gap=3)
+
+    stations = [col for col in df.columns if col != "date_mesure"]
+    assert list(filled.columns) == list(mask.columns) == list(df.columns)
+    assert (filled[stations].dtypes == np.float32).all()
+    before, after = df[stations].isna(), filled[stations].isna()
+    assert (mask[stations] == (before & ~after)).all().all()
+    pd.testing.assert_frame_equal(filled[stations][~before], df[stations][~before])
+
+
+@pytest.mark.parametrize("method, interpolator", [("linear", None), ("pchip", PchipInterpolator)])
+def test_interpolation_matches_scipy(method, interpolator):
+    df = levels()
+    code = df.columns[1]
+
+    filled, mask = gap_filling.fill_gaps(df[["date_mesure", code]], method=method, max_gap=1000)
+
+    x = np.arange(len(df), dtype=np.float64)
+    valid = df[code].notna().to_numpy()
+    imputed = mask[code].to_numpy()
+    y = df[code].to_numpy(np.float64)
+    if interpolator is None:
+        expected = np.interp(x[imputed], x[valid], y[valid])
+    else:
+        expected = interpolator(x[valid], y[valid])(x[imputed])
+    np.testing.assert_allclose(filled[code].to_numpy()[imputed], expected, rtol=1e-6)
+
+
+def test_spline_is_local_and_bounded():
+    y = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0, 1, np.nan, np.nan, 5, 4, 5, 4, 5, 4, 5, 4, 5, 4], dtype=np.float64)
+    days = np.arange(len(y), dtype=np.float64)
+
+    filled = y.copy()
+    gap_filling.fill_series(filled, days, None, method="spline", max_gap=60)
+
+    context = gap_filling.SPLINE_CONTEXT
+    points = np.flatnonzero(~np.isnan(y))[10 - context:10 + context]
+    spline = CubicSpline(days[points], y[points])(days[10:12])
+    np.testing.assert_allclose(filled[10:12], np.clip(spline, y[points].min(), y[points].max()))
+
+    # Une mesure hors de la fenêtre du trou ne change pas son comblement
+    far = y.copy()
+    far[0] = 100
+    gap_filling.fill_series(far, days, None, method="spline", max_gap=60)
+    np.testing.assert_array_equal(far[10:12], filled[10:12])
+
+
+def test_parallel_fill_matches_serial(monkeypatch):
+    df = levels(seed=1)
+    serial = gap_filling.fill_gaps(df, method="spline", max_workers=1)
+    monkeypatch.setattr(gap_filling, "PARALLEL_MIN_CELLS", 0)
+    monkeypatch.setattr(gap_filling, "ROWS_PER_TASK", 1)
+
+    parallel = gap_filling.fill_gaps(df, method="spline", max_workers=2)
+
+    for expected, result in zip(serial, parallel):
+        pd.testing.assert_frame_equal(result, expected)
+
+
+def test_default_method_is_read_at_call_time(monkeypatch):
+    df = levels()
+    monkeypatch.setattr(gap_filling, "METHOD", "linear")
+    expected = gap_filling.fill_gaps(df, method="linear")[0]
+
+    pd.testing.assert_frame_equal(gap_filling.fill_gaps(df)[0], expected)
+    monkeypatch.setattr(gap_filling, "METHOD", "inconnue")
+    with pytest.raises(ValueError):
+        gap_filling.fill_gaps(df)
@@ -0,0 +1,109 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pandas as pd
+import pytest
+
+import geo_description
+
+# Résolution commune -> département servie par un serveur HTTP local à la manière de geo.api.gouv.fr
+
+COMMUNES = {"80733": ("80", "Senlis-le-Sec"), "02691": ("02", "Saint-Quentin"), "2A004": ("2A", "Ajaccio")}
+
+
+class GeoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        self.server.requests.append(path)
+        if path == "/communes":
+            body = [{"code": code, "codeDepartement": dep, "nom": nom} for code, (dep, nom) in COMMUNES.items()]
+        elif path.split("/")[-1] in COMMUNES:
+            dep, nom = COMMUNES[path.split("/")[-1]]
+            body = {"codeDepartement": dep, "nom": nom}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), GeoHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(geo_description, "API_URL", f"http://127.0.0.1:{httpd.server_address[1]}/communes/")
+    monkeypatch.setattr(geo_description, "REQUESTS_PER_SECOND", 0)
+    monkeypatch.setattr(geo_description.time, "sleep", lambda seconds: None)  # Pas d'attente entre les reprises
+    monkeypatch.chdir(tmp_path)
+    points = pd.DataFrame({"CODE_BSS": ["A", "B", "C", "D", "E"],
+                           "CODE_INSEE_COMMUNE": ["80733", "02691", "80733", "2A004", "97101"],
+                           "Nom Département": ["x", "x", "x", "x", "Ancien nom"]})
+    points.to_csv(tmp_path / geo_description.INPUT_FILE, sep=";", index=False)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read_points():
+    return pd.read_csv(geo_description.INPUT_FILE, sep=";", dtype=str)
+
+
+@pytest.mark.parametrize("code, expected", [("80733", "80"), ("2691", "02"), ("2A004", "2A"), ("97101", "971")])
+def test_departement_from_insee(code, expected):
+    assert geo_description.departement_from_insee(code) == expected
+
+
+@pytest.mark.parametrize("bulk_threshold", [200, 1])
+def test_each_commune_is_resolved_once_then_cached(server, monkeypatch, bulk_threshold):
+    monkeypatch.setattr(geo_description, "BULK_THRESHOLD", bulk_threshold)
+
+    geo_description.main()
+
+    points = read_points()
+    assert list(points["Code Département"]) == ["80", "02", "80", "2A", "971"]
+    assert list(points["Nom Département"]) == ["Senlis-le-Sec", "Saint-Quentin", "Senlis-le-Sec", "Ajaccio",
+                                               "Ancien nom"]
+    if bulk_threshold == 1:
+        assert server.requests == ["/communes"]
+    else:
+        assert sorted(server.requests) == ["/communes/02691", "/communes/2A004", "/communes/80733",
+                                           "/communes/97101"]
+
+    # Deuxième exécution : seule la commune inconnue de l'API est redemandée
+    server.requests.clear()
+    geo_description.main()
+    assert server.requests == ["/communes/97101"]
+    pd.testing.assert_frame_equal(read_points(), points)
+
+
+def test_expired_cache_entries_are_resolved_again(server):
+    geo_description.main()
+    with open(geo_description.CACHE_FILE, "r", encoding="utf-8") as f:
+        cache = json.load(f)
+    cache["80733"]["fetched"] -= geo_description.CACHE_TTL + 1
+    with open(geo_description.CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+
+    server.requests.clear()
+    geo_description.main()
+
+    assert sorted(server.requests) == ["/communes/80733", "/communes/97101"]
+
+
+def test_offline_mode_makes_no_request(server, monkeypatch):
+    monkeypatch.setattr(geo_description, "OFFLINE", True)
+
+    geo_description.main()
+
+    assert server.requests == []
+    assert list(read_points()["Code Département"]) == ["80", "02", "80", "2A", "971"]
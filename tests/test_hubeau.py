@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+import hubeau
+
+# Chroniques servies par un serveur HTTP local à la manière de l'API Hub'Eau (CSV trié par date, filtré par
+# date_debut_mesure et limité à size lignes)
+
+
+def chronicle(code_bss, start, n_days):
+    dates = pd.date_range(start, periods=n_days, freq="D").strftime("%Y-%m-%d")
+    return [{"code_bss": code_bss, "date_mesure": date, "niveau_nappe_eau": f"{i / 10:.1f}"}
+            for i, date in enumerate(dates)]
+
+
+class HubeauHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        state = self.server.state
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        code_bss = params["code_bss"]
+        with state["lock"]:
+            state["requests"].append(params)
+            failures = state["failures"].get(code_bss, 0)
+            if failures:
+                state["failures"][code_bss] = failures - 1
+        if failures:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if code_bss in state["raw"]:
+            body = state["raw"][code_bss]
+        else:
+            rows = [row for row in state["chronicles"].get(code_bss, [])
+                    if row["date_mesure"] >= params.get("date_debut_mesure", "")]
+            page = pd.DataFrame(rows[:int(params["size"])], columns=["code_bss", "date_mesure", "niveau_nappe_eau"])
+            body = page.to_csv(sep=";", index=False)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), HubeauHandler)
+    httpd.state = {"lock": threading.Lock(), "requests": [], "failures": {}, "chronicles": {}, "raw": {}}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/chroniques.csv"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(hubeau.time, "sleep", calls.append)
+    return calls
+
+
+def download(server, codes, output_dir):
+    return hubeau.download_all(codes, str(output_dir), api_url=server.url, max_workers=2, requests_per_second=0)
+
+
+def read_local(output_dir, code_bss):
+    return pd.read_csv(os.path.join(output_dir, f"{hubeau.sanitize_filename(code_bss)}.csv"), sep=";", dtype=str)
+
+
+def requested_codes(server):
+    return {params["code_bss"] for params in server.state["requests"]}
+
+
+def test_fetch_chronicle_follows_pages_beyond_page_size(server):
+    server.state["chronicles"]["A"] = chronicle("A", "2020-01-01", 45)
+    session = hubeau.create_session(1)
+
+    df = hubeau.fetch_chronicle(session, hubeau.HostRateLimiter(0), "A", api_url=server.url, page_size=10)
+
+    assert len(server.state["requests"]) > 1
+    assert "date_debut_mesure" not in server.state["requests"][0]
+    assert all("date_debut_mesure" in params for params in server.state["requests"][1:])
+    assert list(df["date_mesure"]) == [row["date_mesure"] for row in server.state["chronicles"]["A"]]
+
+
+def test_server_errors_are_retried_with_backoff(server, sleeps, tmp_path):
+    server.state["chronicles"]["A"] = chronicle("A", "2020-01-01", 5)
+    server.state["failures"]["A"] = 2
+
+    manifest = download(server, ["A"], tmp_path)
+
+    assert manifest["complete"]
+    assert manifest["stations"]["A"]["status"] == "ok"
+    assert len(read_local(tmp_path, "A")) == 5
+    assert len(sleeps) == 2 and 0 < sleeps[0] < sleeps[1]
+
+
+def test_failed_station_is_retried_and_completed_ones_are_skipped(server, sleeps, tmp_path):
+    server.state["chronicles"]["A"] = chronicle("A", "2020-01-01", 5)
+    server.state["chronicles"]["B"] = chronicle("B", "2020-01-01", 7)
+    server.state["failures"]["B"] = hubeau.MAX_RETRIES + 1
+
+    manifest = download(server, ["A", "B"], tmp_path)
+    assert not manifest["complete"]
+    assert manifest["stations"]["A"]["status"] == "ok"
+    assert manifest["stations"]["B"]["status"] == "failed"
+    assert not os.path.exists(tmp_path / "B.csv")
+
+    server.state["requests"].clear()
+    manifest = download(server, ["A", "B"], tmp_path)
+    assert requested_codes(server) == {"B"}
+    assert manifest["complete"]
+    assert len(read_local(tmp_path, "B")) == 7
+
+
+def test_unreadable_response_marks_station_failed(server, tmp_path):
+    server.state["chronicles"]["A"] = chronicle("A", "2020-01-01", 5)
+    server.state["raw"]["BAD"] = "colonne;autre\n1;2\n"
+
+    manifest = download(server, ["BAD", "A"], tmp_path)
+
+    assert manifest["stations"]["BAD"]["status"] == "failed"
+    assert manifest["stations"]["A"]["status"] == "ok"
+    with open(tmp_path / hubeau.MANIFEST_FILE, "r", encoding="utf-8") as f:
+        assert json.load(f)["stations"]["BAD"]["status"] == "failed"
+
+
+def test_new_measurements_are_appended_once(server, tmp_path):
+    full = chronicle("A", "2020-01-01", 20)
+    server.state["chronicles"]["A"] = full[:12]
+    download(server, ["A"], tmp_path)
+
+    # Ajout interrompu après l'écriture mais avant la sauvegarde du watermark : les lignes sont déjà en local
+    pd.DataFrame(full[12:15]).to_csv(tmp_path / "A.csv", sep=";", index=False, header=False, mode="a")
+    server.state["chronicles"]["A"] = full
+    server.state["requests"].clear()
+    download(server, ["A"], tmp_path)
+
+    local = read_local(tmp_path, "A")
+    assert server.state["requests"][0]["date_debut_mesure"] == full[11]["date_mesure"]
+    assert list(local["date_mesure"]) == [row["date_mesure"] for row in full]
+
+
+@pytest.mark.parametrize("content", ["", "A;2020-01-01;0.0\n"])
+def test_unreadable_local_file_is_downloaded_again(server, tmp_path, content):
+    server.state["chronicles"]["A"] = chronicle("A", "2020-01-01", 5)
+    (tmp_path / "A.csv").write_text(content, encoding="utf-8")
+    with open(tmp_path / hubeau.WATERMARK_FILE, "w", encoding="utf-8") as f:
+        json.dump({"A": "2020-01-03"}, f)
+
+    manifest = download(server, ["A"], tmp_path)
+
+    assert manifest["stations"]["A"]["status"] == "ok"
+    assert "date_debut_mesure" not in server.state["requests"][0]
+    assert len(read_local(tmp_path, "A")) == 5
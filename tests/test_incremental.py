@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import concat_data
+import gap_filling
+import incremental
+import merge_pluvio
+import pivot_data
+import pluvio_cube
+import preprocess_data_all
+import preprocess_data_one_year
+import process_pluvio_data
+from pivot_engine import load_meta, load_pivot
+from storage import is_segmented, list_partitions, partition_files, read_table
+
+# Les étapes des nappes exécutées en mode incrémental après un ajout aux chroniques doivent produire les mêmes
+# tables qu'une reconstruction complète sur les chroniques finales, pour chaque méthode de comblement des trous
+
+STATIONS = {"00471X0095/PZ2013": "80", "00487X0015/S1": "80", "01258X0020/S1": "76"}
+NEW_STATION = "00755X0006/S1"  # Station n'apparaissant qu'avec l'ajout
+NEW_STATION_START = "2020-05-20"
+CUT = "2020-05-01"  # Les chroniques initiales s'arrêtent la veille
+LAST_RAIN = "2020-06-15"  # Au-delà, les mesures restent en attente de pluie
+NAPPES_STAGES = (concat_data, pivot_data, preprocess_data_all, preprocess_data_one_year, merge_pluvio)
+
+
+def chronicles(rng):
+    frames = []
+    for i, code in enumerate(list(STATIONS) + [NEW_STATION]):
+        dates = pd.date_range(NEW_STATION_START if code == NEW_STATION else "2020-01-01", "2020-06-30", freq="D")
+        dates = dates[rng.random(len(dates)) > 0.2]
+        frames.append(pd.DataFrame({"code_bss": code, "urn_bss": "x", "date_mesure": dates.strftime("%Y-%m-%d"),
+                                    "niveau_nappe_eau": (50 + i + rng.standard_normal(len(dates))).round(2)}))
+    return frames
+
+
+def write_inputs(directory, rng):
+    os.makedirs(directory / "data")
+    os.makedirs(directory / "data_meteo")
+    points = pd.DataFrame({"CODE_BSS": list(STATIONS) + [NEW_STATION], "LATITUDE": [49.9, 49.8, 49.5, 48.9],
+                           "LONGITUDE": [2.5, 3.0, 1.1, 2.9], "Code Département": list(STATIONS.values()) + ["77"]})
+    points.to_csv(directory / "points_eau.csv", sep=";", index=False)
+    for department in ("76", "77", "80"):
+        dates = pd.date_range("2020-01-01", LAST_RAIN, freq="D")
+        rain = pd.DataFrame({"NUM_POSTE": f"{department}001001", "LAT": 49.5, "LON": 2.0,
+                             "AAAAMMJJ": dates.strftime("%Y%m%d"), "RR": rng.gamma(1.5, 4, len(dates)).round(1)})
+        rain.to_csv(directory / "data_meteo" / f"Q_{department}_previous-1950-2022_RR-T-Vent.csv", sep=";", index=False)
+
+
+# Mesures des jours [start, stop) ajoutées en fin de fichier (fichier créé avec son en-tête s'il n'existe pas)
+def write_chronicles(directory, frames, start="", stop="9999"):
+    for frame in frames:
+        path = directory / "data" / f"{frame['code_bss'].iloc[0].replace('/', '_')}.csv"
+        frame = frame[(frame["date_mesure"] >= start) & (frame["date_mesure"] < stop)]
+        if len(frame):
+            frame.to_csv(path, sep=";", index=False, header=not path.exists(), mode="a")
+
+
+def run(directory, monkeypatch, stages):
+    monkeypatch.chdir(directory)
+    for stage in stages:
+        stage.main()
+
+
+def sorted_table(name, keys):
+    df = read_table(name)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df.sort_values(keys, ignore_index=True)
+
+
+# Une reconstruction par méthode, partagée par les tests du module
+@pytest.fixture(scope="module", params=gap_filling.METHODS)
+def rebuilt(request, tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(incremental, "INCREMENTAL", True)
+        monkeypatch.setattr(preprocess_data_all, "METHOD", request.param)
+        frames = chronicles(np.random.default_rng(0))
+        directory = tmp_path_factory.mktemp(request.param)
+        updated, full = directory / "incremental", directory / "full"
+        for path in (updated, full):
+            write_inputs(path, np.random.default_rng(1))
+            run(path, monkeypatch, (process_pluvio_data, pluvio_cube))
+
+        write_chronicles(updated, frames, stop=CUT)
+        run(updated, monkeypatch, NAPPES_STAGES)
+        write_chronicles(updated, frames, start=CUT)
+        run(updated, monkeypatch, NAPPES_STAGES)
+
+        write_chronicles(full, frames)
+        run(full, monkeypatch, NAPPES_STAGES)
+    return updated, full
+
+
+def test_incremental_run_takes_the_incremental_path(rebuilt, monkeypatch):
+    updated, full = rebuilt
+    monkeypatch.chdir(updated)
+    assert is_segmented(concat_data.OUTPUT_TABLE)
+    assert len(load_meta(pivot_data.OUTPUT_TABLE)["segments"]) == 1
+    assert is_segmented(preprocess_data_all.OUTPUT_TABLE)
+    assert incremental.load_marks(preprocess_data_one_year.STAGE) is not None
+    # Le département de NEW_STATION n'a que la partie écrite par l'ajout
+    assert {value: len(partition_files(merge_pluvio.OUTPUT_TABLE, value))
+            for value in list_partitions(merge_pluvio.OUTPUT_TABLE)} == {"76": 2, "77": 1, "80": 2}
+
+
+def test_concat_matches_full_rebuild(rebuilt):
+    updated, full = rebuilt
+    keys = ["code_bss", "date_mesure"]
+    pd.testing.assert_frame_equal(sorted_table(updated / concat_data.OUTPUT_TABLE, keys),
+                                  sorted_table(full / concat_data.OUTPUT_TABLE, keys))
+
+
+def test_pivot_matches_full_rebuild(rebuilt, monkeypatch):
+    updated, full = rebuilt
+    monkeypatch.chdir(updated)
+    pivot = load_pivot(pivot_data.OUTPUT_TABLE)
+    monkeypatch.chdir(full)
+    expected = load_pivot(pivot_data.OUTPUT_TABLE)
+    assert NEW_STATION in pivot.columns
+    pd.testing.assert_frame_equal(pivot, expected)
+
+
+@pytest.mark.parametrize("name", [merge_pluvio.OUTPUT_TABLE, merge_pluvio.PENDING_TABLE])
+def test_merge_matches_full_rebuild(rebuilt, name):
+    updated, full = rebuilt
+    keys = ["code_bss", "date_mesure"]
+    merged, expected = sorted_table(updated / name, keys), sorted_table(full / name, keys)
+    assert len(expected)
+    pd.testing.assert_frame_equal(merged[expected.columns], expected)
+
+
+@pytest.mark.parametrize("name", [preprocess_data_all.OUTPUT_TABLE, preprocess_data_all.OUTPUT_MASK])
+def test_preprocess_all_matches_full_rebuild(rebuilt, name):
+    updated, full = rebuilt
+    result, expected = sorted_table(updated / name, ["date_mesure"]), sorted_table(full / name, ["date_mesure"])
+    assert NEW_STATION in expected.columns
+    assert result.drop(columns="date_mesure").to_numpy().any()
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_exact=True)
+
+
+@pytest.mark.parametrize("name", [preprocess_data_one_year.OUTPUT_TABLE, preprocess_data_one_year.OUTPUT_TABLE_SMOOTHED])
+def test_preprocess_one_year_matches_full_rebuild(rebuilt, name):
+    updated, full = rebuilt
+    result, expected = sorted_table(updated / name, ["jour_annee"]), sorted_table(full / name, ["jour_annee"])
+    assert NEW_STATION in expected.columns
+    pd.testing.assert_frame_equal(result[expected.columns], expected, rtol=1e-5)
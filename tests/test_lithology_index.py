@@ -0,0 +1,136 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+import lithology_index
+
+# Les requêtes sur l'index doivent reproduire la jointure spatiale complète du GeoPackage (read_geopackage
+# historique) : lithologie la plus fréquente et lithologies distinctes dans l'ordre de rencontre
+
+LAYER_POLYGONS = "entites"
+LAYER_LITHO = "lithologies"
+
+
+def write_geopackage(path, seed=0):
+    rng = np.random.default_rng(seed)
+    x0, y0 = rng.uniform(100_000, 1_100_000, 400), rng.uniform(6_100_000, 7_100_000, 400)
+    sizes = rng.uniform(20_000, 150_000, 400)
+    polygons = gpd.GeoDataFrame({"codeeh": [f"EH{i % 120:03d}" for i in range(400)],
+                                 "autre": np.arange(400)},
+                                geometry=[box(x, y, x + s, y + s) for x, y, s in zip(x0, y0, sizes)],
+                                crs="EPSG:2154")
+    codes = [f"EH{i:03d}" for i in range(115)]  # Quelques entités sans lithologie
+    litho = pd.DataFrame({"CodeEH": codes + codes[:40] + ["EH000"],
+                          "LbLitho": [f"L{i % 9}" for i in range(115)] + [f"L{i % 4}" for i in range(40)] + [None]})
+    polygons.to_file(path, layer=LAYER_POLYGONS, driver="GPKG")
+    gpd.GeoDataFrame(litho).to_file(path, layer=LAYER_LITHO, driver="GPKG")
+
+
+def points(n=150, seed=1):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"CODE_BSS": [f"BSS{i:03d}" for i in range(n)],
+                       "LATITUDE": rng.uniform(42.5, 50.5, n), "LONGITUDE": rng.uniform(-4.0, 7.5, n)})
+    df.loc[3, ["LATITUDE", "LONGITUDE"]] = np.nan
+    df.loc[4, ["LATITUDE", "LONGITUDE"]] = [30.0, -30.0]  # Hors de toute entité
+    return df
+
+
+# Jointure spatiale complète (code historique de read_geopackage.py)
+def full_join(gpkg_file, df_points):
+    polygons = gpd.read_file(gpkg_file, layer=LAYER_POLYGONS)[["codeeh", "geometry"]]
+    litho = gpd.read_file(gpkg_file, layer=LAYER_LITHO)[["CodeEH", "LbLitho"]]
+    polygons = polygons.merge(litho, left_on="codeeh", right_on="CodeEH", how="left")
+    located = df_points.dropna(subset=["LATITUDE", "LONGITUDE"])
+    gdf_points = gpd.GeoDataFrame(located, geometry=gpd.points_from_xy(located["LONGITUDE"], located["LATITUDE"]),
+                                  crs="EPSG:4326").to_crs(polygons.crs)
+    joined = gpd.sjoin(gdf_points, polygons, how="inner", predicate="intersects")
+    joined = joined.rename_axis("point").reset_index().sort_values(["point", "index_right"], kind="stable")
+    joined = joined.dropna(subset=["LbLitho"])
+    grouped = joined.groupby("CODE_BSS")["LbLitho"]
+    return pd.DataFrame({"main_soil_type": grouped.agg(lambda x: x.value_counts().idxmax()),
+                         "all_soil_types": grouped.agg(lambda x: ", ".join(x.unique()))}).reset_index()
+
+
+@pytest.fixture
+def gpkg(tmp_path):
+    path = str(tmp_path / "bdlisa.gpkg")
+    write_geopackage(path)
+    return path
+
+
+@pytest.mark.parametrize("query_grid, row_group_size", [(20, 1000), (3, 16)])
+def test_index_queries_match_the_full_spatial_join(gpkg, monkeypatch, query_grid, row_group_size):
+    monkeypatch.setattr(lithology_index, "QUERY_GRID", query_grid)
+    monkeypatch.setattr(lithology_index, "ROW_GROUP_SIZE", row_group_size)
+    df_points = points()
+
+    result = lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, df_points)
+
+    expected = full_join(gpkg, df_points).sort_values("CODE_BSS", ignore_index=True)
+    assert len(expected) > 50
+    pd.testing.assert_frame_equal(result, expected[["CODE_BSS", "main_soil_type", "all_soil_types"]],
+                                  check_dtype=False)
+
+
+def test_candidates_are_read_only_near_the_points(gpkg, monkeypatch):
+    monkeypatch.setattr(lithology_index, "ROW_GROUP_SIZE", 16)
+    meta = lithology_index.ensure_index(gpkg, LAYER_POLYGONS, LAYER_LITHO)
+    directory = lithology_index.index_dir(gpkg)
+    x, y = np.array([300_000.0, 310_000.0]), np.array([6_500_000.0, 6_505_000.0])
+
+    candidates = lithology_index.read_candidates(directory, meta, x, y)
+
+    polygons = gpd.read_file(gpkg, layer=LAYER_POLYGONS)
+    touching = polygons.intersects(gpd.GeoSeries(gpd.points_from_xy(x, y)).union_all())
+    assert set(np.flatnonzero(touching)) <= set(candidates["rang"])
+    assert len(candidates) < len(polygons) / 4
+
+
+def test_only_new_or_moved_points_are_queried(gpkg, monkeypatch):
+    df_points = points()
+    first = lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, df_points)
+
+    queried = []
+    query = lithology_index.query_soil_types
+    monkeypatch.setattr(lithology_index, "query_soil_types",
+                        lambda directory, meta, todo: queried.append(sorted(todo["CODE_BSS"]))
+                        or query(directory, meta, todo))
+
+    # Rien de nouveau : aucune requête, même résultat
+    pd.testing.assert_frame_equal(lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, df_points),
+                                  first)
+    assert queried == []
+
+    moved = df_points.copy()
+    moved.loc[10, ["LATITUDE", "LONGITUDE"]] = [45.0, 1.0]
+    moved = pd.concat([moved, pd.DataFrame({"CODE_BSS": ["NOUVEAU"], "LATITUDE": [47.0],
+                                            "LONGITUDE": [2.0]})], ignore_index=True)
+    result = lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, moved)
+
+    assert queried == [["BSS010", "NOUVEAU"]]
+    expected = full_join(gpkg, moved).sort_values("CODE_BSS", ignore_index=True)
+    pd.testing.assert_frame_equal(result, expected[["CODE_BSS", "main_soil_type", "all_soil_types"]],
+                                  check_dtype=False)
+
+
+def test_index_is_rebuilt_when_the_geopackage_changes(gpkg):
+    df_points = points()
+    lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, df_points)
+    meta_path = os.path.join(lithology_index.index_dir(gpkg), lithology_index.META_FILE)
+    built = os.stat(meta_path).st_mtime_ns
+
+    lithology_index.ensure_index(gpkg, LAYER_POLYGONS, LAYER_LITHO)
+    assert os.stat(meta_path).st_mtime_ns == built
+
+    os.remove(gpkg)
+    write_geopackage(gpkg, seed=5)
+    result = lithology_index.resolve_soil_types(gpkg, LAYER_POLYGONS, LAYER_LITHO, df_points)
+
+    assert os.stat(meta_path).st_mtime_ns != built
+    expected = full_join(gpkg, df_points).sort_values("CODE_BSS", ignore_index=True)
+    pd.testing.assert_frame_equal(result, expected[["CODE_BSS", "main_soil_type", "all_soil_types"]],
+                                  check_dtype=False)
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import overview_plots
+
+# La décimation doit conserver l'enveloppe (min/max par tranche) et la carte de densité compter chaque mesure
+
+
+def series(n_days=1000, n_stations=5, missing=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.cumsum(rng.standard_normal((n_days, n_stations)), axis=0)
+    values[rng.random(values.shape) < missing] = np.nan
+    return np.arange(n_days, dtype=np.float64), values
+
+
+@pytest.mark.parametrize("n_pixels", [7, 50, 333])
+def test_decimate_keeps_the_min_and_max_of_each_bucket(n_pixels):
+    x, values = series()
+    values[100:300, 0] = np.nan  # Tranches entièrement vides
+
+    dec_x, dec_values = overview_plots.decimate(x, values, n_pixels)
+
+    size = int(np.ceil(len(x) / n_pixels))
+    buckets = np.arange(len(x)) // size
+    for j in range(values.shape[1]):
+        grouped = pd.Series(values[:, j]).groupby(buckets)
+        low, high = grouped.min().to_numpy(), grouped.max().to_numpy()
+        np.testing.assert_array_equal(np.fmin(dec_values[0::2, j], dec_values[1::2, j]), low)
+        np.testing.assert_array_equal(np.fmax(dec_values[0::2, j], dec_values[1::2, j]), high)
+        assert np.all(np.diff(dec_x[:, j]) >= 0)  # Ordre chronologique conservé
+        kept = ~np.isnan(dec_values[:, j])
+        np.testing.assert_array_equal(values[dec_x[kept, j].astype(np.int64), j], dec_values[kept, j])
+
+
+def test_decimate_keeps_short_series_unchanged():
+    x, values = series(n_days=100)
+
+    dec_x, dec_values = overview_plots.decimate(x, values, 100)
+
+    np.testing.assert_array_equal(dec_values, values)
+    np.testing.assert_array_equal(dec_x[:, 3], x)
+
+
+def test_density_counts_every_measure_once():
+    x, values = series(n_stations=40)
+    n_pixels, n_bins = 60, 25
+
+    counts, (x0, x1, low, high) = overview_plots.density(x, values, n_pixels, n_bins=n_bins)
+
+    assert counts.shape == (n_pixels, n_bins)
+    assert counts.sum() == np.isfinite(values).sum()
+    assert (x0, x1, low, high) == (x[0], x[-1], np.nanmin(values), np.nanmax(values))
+    columns = np.minimum((x / x[-1] * n_pixels).astype(np.int64), n_pixels - 1)
+    np.testing.assert_array_equal(counts.sum(axis=1), np.bincount(columns, weights=np.isfinite(values).sum(axis=1),
+                                                                  minlength=n_pixels))
+
+
+@pytest.mark.parametrize("n_stations", [0, 3, 12])
+def test_plot_overview_writes_the_figure(tmp_path, n_stations):
+    _, values = series(n_days=400, n_stations=n_stations)
+    dates = pd.date_range("2020-01-01", periods=400).to_numpy()
+    output_file = tmp_path / "overview.png"
+
+    overview_plots.plot_overview(dates, values, [f"S{j}" for j in range(n_stations)], output_file,
+                                 "Titre", "Date", "Niveau", max_lines=5, dpi=20)
+
+    assert output_file.read_bytes().startswith(b"\x89PNG")
@@ -0,0 +1,57 @@
+import pipeline
+
+# Étape network : téléchargement seulement si ses sorties sont vides, avec --fetch ou --force ;
+# les fichiers de suivi du dossier téléchargé ne changent pas l'empreinte des étapes qui le lisent
+
+FETCH = "import os\nwith open(os.path.join('data', 'A.csv'), 'a') as f:\n    f.write('x\\n')\n"
+CONCAT = "with open('concat.log', 'a') as f:\n    f.write('x\\n')\n"
+STAGES = [
+    {"name": "fetch", "script": "fetch.py", "inputs": ["points.csv"], "outputs": ["data"], "network": True},
+    {"name": "concat", "script": "concat.py", "inputs": ["data"], "outputs": ["concat.log"]},
+]
+
+
+def setup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "points.csv").write_text("CODE_BSS\nA\n")
+    (tmp_path / "fetch.py").write_text(FETCH)
+    (tmp_path / "concat.py").write_text(CONCAT)
+    (tmp_path / "data").mkdir()
+
+
+def run(**options):
+    status = pipeline.run_pipeline(stages=STAGES, max_parallel=1, **options)
+    assert "failed" not in status.values()
+    return status
+
+
+def fetched(tmp_path):
+    return len((tmp_path / "data" / "A.csv").read_text().splitlines())
+
+
+def test_network_stage_runs_only_when_its_outputs_are_empty(tmp_path, monkeypatch):
+    setup(tmp_path, monkeypatch)
+    run()
+    assert fetched(tmp_path) == 1
+
+    (tmp_path / "points.csv").write_text("CODE_BSS\nA\nB\n")
+    run()
+    assert fetched(tmp_path) == 1
+    run(fetch=True)
+    assert fetched(tmp_path) == 2
+    run(force=True)
+    assert fetched(tmp_path) == 3
+
+
+def test_bookkeeping_files_do_not_change_the_digest(tmp_path, monkeypatch):
+    setup(tmp_path, monkeypatch)
+    run()
+    (tmp_path / "data" / "_manifest.json").write_text("{}")
+    (tmp_path / "data" / "B.csv.part").write_text("x")
+    (tmp_path / "data" / "table").mkdir()
+    (tmp_path / "data" / "table" / "_segments.json").write_text("{}")
+
+    assert run()["concat"] == "done"
+    assert (tmp_path / "concat.log").read_text() == "x\nx\n"
+    (tmp_path / "data" / "_manifest.json").write_text('{"complete": true}')
+    assert run()["concat"] == "skipped"
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pluvio_cube
+from storage import partition_path, save_table
+
+# Les requêtes sur le cube doivent reproduire les mêmes agrégats calculés avec pandas sur les mesures brutes
+
+STATIONS = {"80001001": "80", "80002001": "80", "76001001": "76", "76002001": "76", "02001001": "02"}
+
+
+@pytest.fixture
+def precipitation(tmp_path):
+    rng = np.random.default_rng(4)
+    frames = []
+    for i, (code, department) in enumerate(STATIONS.items()):
+        dates = pd.date_range("2020-01-01" if i % 2 else "2020-01-20", "2020-04-30", freq="D")
+        dates = dates[rng.random(len(dates)) > 0.3]
+        rr = rng.gamma(1.2, 4, len(dates)).round(1)
+        rr[rng.random(len(rr)) < 0.05] = np.nan  # Mesures manquantes : ignorées par le cube
+        frames.append(pd.DataFrame({"NUM_POSTE": code, "LAT": 49.0 + i / 10, "LON": 2.0 + i / 10, "Date": dates,
+                                    "RR": rr, "departement": department}))
+    df = pd.concat(frames, ignore_index=True)
+    # Deux mesures le même jour pour quelques stations
+    df = pd.concat([df, df.sample(40, random_state=0).assign(RR=lambda d: d["RR"] + 1)], ignore_index=True)
+    input_dir, cube_dir = str(tmp_path / "precipitation"), str(tmp_path / "cube")
+    for department, part in df.groupby("departement"):
+        save_table(part.drop(columns="departement"), f"{partition_path(input_dir, department)}/part-00000")
+    pluvio_cube.build_cube(input_dir, cube_dir, chunk_rows=50)
+    return df.dropna(subset=["RR"]), cube_dir
+
+
+def reference(df, key):
+    grouped = df.assign(sumsq=df["RR"].astype(np.float64) ** 2).groupby(["Date", key])
+    expected = grouped.agg(count=("RR", "size"), sum=("RR", "sum"), max=("RR", "max"), sumsq=("sumsq", "sum"))
+    return expected.reset_index()
+
+
+@pytest.mark.parametrize("level, key, column", [("station", "NUM_POSTE", "NUM_POSTE"),
+                                                 ("departement", "Code Département", "departement")])
+def test_query_matches_pandas_groupby(precipitation, level, key, column):
+    df, cube_dir = precipitation
+    start, end = "2020-02-01", "2020-03-15"
+    selected = df[(df["Date"] >= start) & (df["Date"] <= end) & (df["departement"] != "02")]
+
+    result = pluvio_cube.query(start, end, level=level, departments=["80", "76"], cube_dir=cube_dir)
+
+    expected = reference(selected.rename(columns={column: key}), key)
+    result = result.astype({key: str}).sort_values(["Date", key], ignore_index=True)
+    assert len(result) == len(expected)
+    assert (result["Date"].to_numpy() == expected["Date"].to_numpy()).all()
+    assert list(result[key]) == list(expected[key])
+    assert list(result["count"]) == list(expected["count"])
+    for name in ("sum", "max", "sumsq"):
+        np.testing.assert_allclose(result[name], expected[name], rtol=1e-5)
+    np.testing.assert_allclose(result["mean"], expected["sum"] / expected["count"], rtol=1e-5)
+
+
+def test_query_filters_stations(precipitation):
+    df, cube_dir = precipitation
+
+    result = pluvio_cube.query(level="station", stations=["80002001", "02001001"], cube_dir=cube_dir)
+
+    assert set(result["NUM_POSTE"].astype(str)) == {"80002001", "02001001"}
+    assert set(result.loc[result["NUM_POSTE"] == "02001001", "Code Département"]) == {"02"}
+    assert len(result) == df[df["NUM_POSTE"].isin(["80002001", "02001001"])].groupby(["Date", "NUM_POSTE"]).ngroups
+
+
+def test_antecedent_rainfall_matches_pandas_rolling(precipitation):
+    df, cube_dir = precipitation
+    windows, start, end = (3, 10), "2020-01-05", "2020-04-30"
+
+    result = pluvio_cube.antecedent_rainfall(windows, start, end, departments=["80", "76"], cube_dir=cube_dir)
+
+    meta = pluvio_cube.load_meta(cube_dir)
+    days = pd.date_range(pluvio_cube.ordinals_to_dates([meta["first_day"]])[0], end, freq="D")
+    for department in ("80", "76"):
+        daily = df[df["departement"] == department].groupby("Date")["RR"].agg(["sum", "count"]).reindex(days)
+        rain = (daily["sum"] / daily["count"]).fillna(0)
+        observed = daily["count"].fillna(0) > 0
+        rows = result[result["Code Département"] == department].set_index("Date")
+        assert list(rows.index) == list(days[days >= start])
+        for window in windows:
+            totals = rain.rolling(window, min_periods=1).sum()
+            expected = totals.where(observed.rolling(window, min_periods=1).sum() > 0)[days >= start]
+            np.testing.assert_allclose(rows[f"cumul_{window}j"], expected, rtol=1e-6, atol=1e-9)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pluvio_cube
+import rain_gauges
+from storage import partition_path, save_table
+
+# Jointure piézomètre -> pluviomètres : mêmes voisins et poids qu'une recherche exhaustive en distance
+# orthodromique, et jointure incrémentale identique à un recalcul complet
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * rain_gauges.EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def gauges(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"NUM_POSTE": [f"80{i:06d}" for i in range(n)], "LAT": rng.uniform(48.5, 50.5, n),
+                         "LON": rng.uniform(1.0, 4.0, n)})
+
+
+def points(n=25, seed=1):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"CODE_BSS": [f"00{i:03d}X0001/S1" for i in range(n)], "LATITUDE": rng.uniform(48.0, 51.0, n),
+                       "LONGITUDE": rng.uniform(0.5, 4.5, n)})
+    df.loc[0, ["LATITUDE", "LONGITUDE"]] = [45.0, 6.0]  # Aucun pluviomètre à moins de MAX_DISTANCE_KM
+    return df
+
+
+def test_nearest_gauges_match_brute_force():
+    df_gauges, df_points = gauges(), points()
+    df_points.loc[1, ["LATITUDE", "LONGITUDE"]] = df_gauges.loc[3, ["LAT", "LON"]].to_numpy()  # Sur un pluviomètre
+
+    joined = rain_gauges.nearest_gauges(df_points, df_gauges)
+
+    assert list(joined.columns) == ["CODE_BSS", "rang", "NUM_POSTE", "distance_km", "poids"]
+    assert df_points.loc[0, "CODE_BSS"] not in set(joined["CODE_BSS"])
+    for _, point in df_points.iloc[1:].iterrows():
+        distances = haversine_km(point["LATITUDE"], point["LONGITUDE"], df_gauges["LAT"], df_gauges["LON"])
+        nearest = np.argsort(distances.to_numpy())[:rain_gauges.N_GAUGES]
+        nearest = nearest[distances.to_numpy()[nearest] <= rain_gauges.MAX_DISTANCE_KM]
+        rows = joined[joined["CODE_BSS"] == point["CODE_BSS"]]
+        expected_km = np.maximum(distances.to_numpy()[nearest], rain_gauges.MIN_DISTANCE_KM)
+        weights = expected_km ** -rain_gauges.IDW_POWER
+        assert list(rows["rang"]) == list(range(1, len(nearest) + 1))
+        assert list(rows["NUM_POSTE"]) == list(df_gauges["NUM_POSTE"].to_numpy()[nearest])
+        np.testing.assert_allclose(rows["distance_km"], expected_km, rtol=1e-6)
+        np.testing.assert_allclose(rows["poids"], weights / weights.sum(), rtol=1e-6)
+        assert not len(nearest) or rows["poids"].sum() == pytest.approx(1)
+    assert joined.loc[joined["CODE_BSS"] == df_points.loc[1, "CODE_BSS"], "poids"].iloc[0] > 0.99
+
+
+@pytest.fixture
+def cube(tmp_path):
+    df_gauges = gauges()
+    input_dir, cube_dir = str(tmp_path / "precipitation"), str(tmp_path / "cube")
+    rain = df_gauges.assign(Date=pd.Timestamp("2020-01-01"), RR=1.0)
+    save_table(rain, f"{partition_path(input_dir, '80')}/part-00000")
+    pluvio_cube.build_cube(input_dir, cube_dir)
+    return cube_dir
+
+
+def resolve(tmp_path, cube_dir, df_points, name):
+    table = str(tmp_path / name)
+    return rain_gauges.resolve_gauges(df_points, cube_dir=cube_dir, output_table=table, meta_file=table + ".json")
+
+
+def sorted_join(df):
+    df = df.assign(CODE_BSS=df["CODE_BSS"].astype(str), NUM_POSTE=df["NUM_POSTE"].astype(str),
+                   rang=df["rang"].astype(np.int64))
+    return df.sort_values(["CODE_BSS", "rang"], ignore_index=True)[["CODE_BSS", "rang", "NUM_POSTE", "poids"]]
+
+
+def test_incremental_join_matches_a_full_join(tmp_path, cube, monkeypatch):
+    df_points = points()
+    previous = resolve(tmp_path, cube, df_points.iloc[:20], "incremental")
+
+    # Un piézomètre déplacé, un retiré, cinq nouveaux : seuls le déplacé, les nouveaux et ceux qui n'avaient
+    # aucun pluviomètre sont recherchés
+    df_points.loc[5, "LATITUDE"] += 0.3
+    df_points = df_points.drop(index=7)
+    searched = []
+    nearest_gauges = rain_gauges.nearest_gauges
+    monkeypatch.setattr(rain_gauges, "nearest_gauges",
+                        lambda todo, g: searched.extend(todo["CODE_BSS"]) or nearest_gauges(todo, g))
+    joined = resolve(tmp_path, cube, df_points, "incremental")
+
+    unmatched = df_points["CODE_BSS"].iloc[:19][~df_points["CODE_BSS"].iloc[:19].isin(previous["CODE_BSS"])]
+    assert sorted(searched) == sorted({df_points.loc[5, "CODE_BSS"], *df_points["CODE_BSS"].iloc[-5:], *unmatched})
+    expected = resolve(tmp_path, cube, df_points, "full")
+    pd.testing.assert_frame_equal(sorted_join(joined), sorted_join(expected))
+    assert df_points.loc[6, "CODE_BSS"] in set(joined["CODE_BSS"])
+    assert "00007X0001/S1" not in set(joined["CODE_BSS"])
+
+
+def test_unchanged_points_reuse_the_stored_join(tmp_path, cube, monkeypatch):
+    df_points = points()
+    first = resolve(tmp_path, cube, df_points, "join")
+    monkeypatch.setattr(rain_gauges, "save_table", lambda *args: pytest.fail("table réécrite"))
+
+    again = resolve(tmp_path, cube, df_points, "join")
+
+    pd.testing.assert_frame_equal(sorted_join(again), sorted_join(first))
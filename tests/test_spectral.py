@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import periodogram
+from statsmodels.tsa.seasonal import seasonal_decompose
+from statsmodels.tsa.stattools import acf as statsmodels_acf
+
+import spectral
+
+# Les calculs par lots doivent reproduire, série par série, pandas, scipy.signal.periodogram et statsmodels
+
+
+def measures(seed=0):
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i, (start, n_days) in enumerate([("2019-03-01", 400), ("2019-01-01", 600), ("2019-06-15", 400),
+                                         ("2020-02-01", 150)]):
+        dates = pd.date_range(start, periods=n_days)
+        t = np.arange(n_days)
+        level = 10 + np.sin(2 * np.pi * t / 30) + 0.01 * t + 0.2 * rng.standard_normal(n_days)
+        df = pd.DataFrame({"code_bss": f"S{i}", "date_mesure": dates, "niveau_nappe_eau": level})
+        df = df[rng.random(n_days) > 0.1]
+        df = df[(df["date_mesure"] < dates[100]) | (df["date_mesure"] >= dates[120])]  # Trou de 20 jours
+        frames.append(pd.concat([df, df.iloc[::7].assign(niveau_nappe_eau=lambda d: d["niveau_nappe_eau"] + 1)]))
+    return pd.concat(frames, ignore_index=True)
+
+
+def regular_series(n_days=(400, 730, 365, 2), seed=0):
+    rng = np.random.default_rng(seed)
+    aligned = np.full((len(n_days), max(n_days)), np.nan)
+    for i, n in enumerate(n_days):
+        t = np.arange(n)
+        aligned[i, :n] = np.sin(2 * np.pi * t / 30) + 0.01 * t + 0.3 * rng.standard_normal(n)
+    return aligned, np.array(n_days)
+
+
+def test_daily_grid_matches_a_pandas_pivot():
+    df = measures()
+
+    codes, dates, grid = spectral.daily_grid(df)
+
+    expected = df.pivot_table(index="date_mesure", columns="code_bss", values="niveau_nappe_eau", aggfunc="mean")
+    expected = expected.reindex(pd.date_range(expected.index.min(), expected.index.max()))
+    assert list(codes) == list(expected.columns)
+    assert list(dates) == list(expected.index)
+    np.testing.assert_allclose(grid, expected.to_numpy().T, rtol=1e-6)
+    assert grid.dtype == np.float32
+
+
+def test_regularize_interpolates_each_series_over_its_own_period():
+    _, _, grid = spectral.daily_grid(measures())
+
+    aligned, starts, lengths = spectral.regularize(grid)
+
+    for i, row in enumerate(grid):
+        series = pd.Series(row, dtype=np.float64)
+        valid = series.dropna().index
+        assert (starts[i], lengths[i]) == (valid[0], valid[-1] - valid[0] + 1)
+        expected = series.loc[valid[0]:valid[-1]].interpolate(method="linear").to_numpy()
+        np.testing.assert_allclose(aligned[i, :lengths[i]], expected, rtol=1e-6)
+        assert np.isnan(aligned[i, lengths[i]:]).all()
+
+
+def test_periodograms_match_scipy():
+    aligned, lengths = regular_series(n_days=(400, 730, 365, 400, 1))
+
+    results = spectral.periodograms(aligned, lengths)
+
+    assert results[-1] is None
+    for i, (frequencies, power) in enumerate(results[:-1]):
+        expected_frequencies, expected_power = periodogram(aligned[i, :lengths[i]], scaling="spectrum")
+        np.testing.assert_allclose(frequencies, expected_frequencies)
+        np.testing.assert_allclose(power, expected_power, rtol=1e-9, atol=1e-15)
+
+
+def test_spectrum_peaks_find_the_injected_period():
+    t = np.arange(3000)
+    series = np.sin(2 * np.pi * t / 30) + 0.3 * np.random.default_rng(0).standard_normal(3000)
+    frequencies, power = spectral.periodograms(series[None, :], np.array([3000]))[0]
+
+    periods, peaks = spectral.spectrum_peaks(frequencies, power)
+
+    assert np.isnan(periods[0])
+    assert np.any(np.abs(periods[peaks] - 30) < 1)
+
+
+@pytest.mark.parametrize("max_lag", [10, 500])
+def test_acf_matches_statsmodels(max_lag):
+    aligned, lengths = regular_series()
+
+    result = spectral.acf(aligned, lengths, max_lag=max_lag)
+
+    assert result.shape == (len(lengths), max_lag + 1)
+    for i, n in enumerate(lengths):
+        n_lags = min(max_lag, n - 1)
+        expected = statsmodels_acf(aligned[i, :n], nlags=n_lags, fft=True)
+        np.testing.assert_allclose(result[i, :n_lags + 1], expected, atol=1e-10)
+        assert np.isnan(result[i, n_lags + 1:]).all()
+
+
+@pytest.mark.parametrize("period", [7, 30])
+def test_decompose_matches_seasonal_decompose(period):
+    aligned, lengths = regular_series()
+
+    trend, seasonal, resid = spectral.decompose(aligned, lengths, period=period)
+
+    for i in np.flatnonzero(lengths > 2 * period):
+        n = lengths[i]
+        expected = seasonal_decompose(aligned[i, :n], model="additive", period=period)
+        np.testing.assert_allclose(trend[i, :n], expected.trend, atol=1e-10)
+        np.testing.assert_allclose(seasonal[i, :n], expected.seasonal, atol=1e-10)
+        np.testing.assert_allclose(resid[i, :n], expected.resid, atol=1e-10)
+        assert np.isnan(seasonal[i, n:]).all()
+
+
+def test_batches_cover_every_station_once():
+    chunks = list(spectral.batches(10, batch_size=4))
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    np.testing.assert_array_equal(np.concatenate(chunks), np.arange(10))
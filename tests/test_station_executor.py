@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import station_executor
+
+# Le découpage par station et l'exécution répartie doivent donner les mêmes résultats qu'un groupby pandas
+
+
+def measures():
+    rng = np.random.default_rng(2)
+    codes = rng.choice(["A", "B", "C", "D", "E"], 300)
+    codes[::37] = None  # Lignes sans station : ignorées
+    return pd.DataFrame({"code_bss": codes, "niveau_nappe_eau": rng.standard_normal(300), "rang": np.arange(300)})
+
+
+def summary(station_id, arrays, offset):
+    if station_id == "C":
+        raise ValueError("station en erreur")
+    return float(arrays["niveau_nappe_eau"].sum()) + offset, arrays["rang"].tolist()
+
+
+def test_iter_stations_matches_groupby():
+    df = measures()
+
+    stations = list(station_executor.iter_stations(df))
+
+    assert [station_id for station_id, _ in stations] == list(df["code_bss"].dropna().unique())
+    for station_id, df_station in stations:
+        pd.testing.assert_frame_equal(df_station, df[df["code_bss"] == station_id])
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_run_per_station_matches_groupby(max_workers):
+    df = measures()
+
+    results, errors = station_executor.run_per_station(summary, df, ["niveau_nappe_eau", "rang"], args=(10,),
+                                                       max_workers=max_workers)
+
+    expected = df.groupby("code_bss", sort=False)
+    assert list(results) == [code for code in df["code_bss"].dropna().unique() if code != "C"]
+    assert list(errors) == ["C"] and "station en erreur" in errors["C"]
+    for station_id, (total, rows) in results.items():
+        group = expected.get_group(station_id)
+        assert total == pytest.approx(group["niveau_nappe_eau"].sum() + 10)
+        assert rows == group["rang"].tolist()
@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import concat_data
+import storage
+
+
+def measures(n=50, codes=("A", "B")):
+    dates = pd.date_range("2020-01-01", periods=n, freq="D")
+    return pd.DataFrame({
+        "code_bss": np.resize(np.asarray(codes), n),
+        "date_mesure": dates.strftime("%Y-%m-%d"),
+        "niveau_nappe_eau": np.linspace(10, 20, n),
+    })
+
+
+def assert_typed(df):
+    assert pd.api.types.is_datetime64_any_dtype(df["date_mesure"])
+    assert isinstance(df["code_bss"].dtype, pd.CategoricalDtype)
+    assert df["niveau_nappe_eau"].dtype == np.float32
+
+
+def assert_same_measures(df, expected):
+    assert list(df["code_bss"].astype(str)) == list(expected["code_bss"])
+    assert (df["date_mesure"] == pd.to_datetime(expected["date_mesure"])).all()
+    np.testing.assert_array_equal(df["niveau_nappe_eau"], expected["niveau_nappe_eau"].astype(np.float32))
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_save_table_round_trip(tmp_path, fmt):
+    df = measures()
+    name = str(tmp_path / "data_all" / "nappes")
+
+    path = storage.save_table(df, name, fmt=fmt)
+
+    assert path.endswith(f".{fmt}")
+    assert storage.existing_table_path(name) == path
+    result = storage.read_table(name)
+    assert_typed(result)
+    assert_same_measures(result, df)
+    assert list(storage.read_table(name, columns=["date_mesure"]).columns) == ["date_mesure"]
+
+
+def test_save_table_leaves_the_caller_frame_unchanged(tmp_path):
+    df = measures()
+    dtypes = df.dtypes.copy()
+
+    storage.save_table(df, str(tmp_path / "nappes"), fmt="parquet")
+
+    pd.testing.assert_series_equal(df.dtypes, dtypes)
+
+
+def test_saving_in_another_format_removes_the_old_file(tmp_path):
+    name = str(tmp_path / "nappes")
+    storage.save_table(measures(), name, fmt="csv")
+    storage.save_table(measures(10), name, fmt="parquet")
+
+    assert storage.existing_table_path(name) == f"{name}.parquet"
+    assert len(storage.read_table(name)) == 10
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_table_writer_concatenates_chunks(tmp_path, fmt):
+    df = measures(30)
+    name = str(tmp_path / "nappes")
+
+    with storage.TableWriter(name, fmt=fmt) as writer:
+        for start in range(0, len(df), 7):
+            writer.write(df.iloc[start:start + 7])
+
+    assert writer.rows == len(df)
+    assert_same_measures(storage.read_table(name), df)
+
+
+def test_table_writer_discards_an_interrupted_table(tmp_path):
+    name = str(tmp_path / "nappes")
+    with pytest.raises(RuntimeError):
+        with storage.TableWriter(name) as writer:
+            writer.write(measures())
+            raise RuntimeError("interruption")
+
+    assert not storage.table_exists(name)
+    assert not list(tmp_path.iterdir())
+
+
+def test_segments_append_and_replace(tmp_path):
+    df = measures(40)
+    name = str(tmp_path / "nappes")
+    storage.save_table(df.iloc[:20], name)
+    generation = storage.table_version(name)[0]
+
+    version = storage.append_segment(df.iloc[20:], name, column="date_mesure")
+    assert version == [generation, 2]
+    assert_same_measures(storage.read_table(name), df)
+    assert_same_measures(storage.read_segments(name, start=1), df.iloc[20:].reset_index(drop=True))
+
+    replaced = df.iloc[30:].assign(niveau_nappe_eau=-1.0)
+    version = storage.replace_segments_from(replaced, name, df["date_mesure"][30], "date_mesure")
+    assert version[0] != generation
+    expected = pd.concat([df.iloc[:30], replaced], ignore_index=True)
+    assert_same_measures(storage.read_table(name), expected)
+    since = storage.read_segments(name, since=df["date_mesure"][25])
+    assert_same_measures(since, expected.iloc[25:].reset_index(drop=True))
+
+
+def test_concat_reads_only_the_projected_columns(tmp_path):
+    df = measures(10).assign(urn_bss="x", qualification="Correcte")
+    path = tmp_path / "A.csv"
+    df.to_csv(path, sep=";", index=False)
+    size = path.stat().st_size
+    df_more = measures(15).iloc[10:].assign(urn_bss="x", qualification="Correcte")
+    df_more.to_csv(path, sep=";", index=False, header=False, mode="a")
+
+    chronicle = concat_data.read_chronicle(str(path))
+    assert list(chronicle.columns) == concat_data.COLUMNS
+    assert chronicle["niveau_nappe_eau"].dtype == np.float32
+    assert len(chronicle) == 15
+
+    appended = concat_data.read_chronicle(str(path), size, path.stat().st_size)
+    assert list(appended["date_mesure"].dt.strftime("%Y-%m-%d")) == list(df_more["date_mesure"])
+
+
+def test_partitioned_table_round_trip(tmp_path):
+    df = measures(40).assign(departement=lambda d: np.where(d.index % 3, "80", "76"))
+    name = str(tmp_path / "merged_data")
+    storage.save_table(measures(5), name)  # Ancienne version en un seul fichier
+
+    tmp_dir = name + ".tmp"
+    for value, part in df.groupby("departement"):
+        for i, start in enumerate(range(0, len(part), 8)):
+            path = os.path.join(storage.partition_path(tmp_dir, value), f"part-{i:05d}")
+            with storage.TableWriter(path) as writer:
+                writer.write(part.iloc[start:start + 8].drop(columns="departement"))
+    storage.replace_partitioned(tmp_dir, name)
+
+    assert storage.existing_table_path(name) is None
+    assert storage.list_partitions(name) == ["76", "80"]
+    for value, part in df.groupby("departement"):
+        chunks = [chunk for file in storage.partition_files(name, value)
+                  for chunk in storage.iter_file_chunks(file, chunk_rows=3)]
+        assert_same_measures(pd.concat(chunks, ignore_index=True), part.reset_index(drop=True))
+    expected = pd.concat([part for _, part in df.groupby("departement")], ignore_index=True)
+    assert_same_measures(storage.read_table(name), expected)
+
+    storage.save_table(measures(5), name)
+    assert not storage.is_partitioned(name)
+    assert len(storage.read_table(name)) == 5
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_only_known_columns_are_converted(tmp_path, fmt):
+    df = pd.DataFrame({"date_mesure": ["2020-01-01", "2020-01-02"], "00471X0095/PZ2013": ["1.5", None],
+                       "BSS000EBLL": [2.5, 3.5], "CODE_INSEE_COMMUNE": ["08105", "80733"], "rang": ["1", "2"]})
+    name = str(tmp_path / "pivot")
+
+    storage.save_table(df, name, fmt=fmt)
+
+    result = storage.read_table(name)
+    assert result["00471X0095/PZ2013"].dtype == np.float32 and result["BSS000EBLL"].dtype == np.float32
+    assert list(result["CODE_INSEE_COMMUNE"]) == ["08105", "80733"]
+    assert list(result["rang"]) == [1, 2]
+
+
+def test_table_writer_keeps_missing_categories(tmp_path):
+    df = measures(6).assign(**{"Code Département": ["80", None, "02", "80", None, "02"]})
+    name = str(tmp_path / "nappes")
+
+    with storage.TableWriter(name, fmt="parquet") as writer:
+        writer.write(df.iloc[:3])
+        writer.write(df.iloc[3:])
+
+    result = storage.read_table(name)["Code Département"]
+    assert result.isna().tolist() == df["Code Département"].isna().tolist()
+    assert "nan" not in result.cat.categories
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+from io import BytesIO
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+from PIL import Image
+from pyproj import Transformer
+
+import tile_cache
+from storage import load_table
+
+# Projection identique à pyproj, magasin local de tuiles (dossier et MBTiles) sans aucun accès réseau
+
+PARIS = (2.3522, 48.8566)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tile_bytes(color):
+    buffer = BytesIO()
+    Image.new("RGB", (tile_cache.TILE_SIZE, tile_cache.TILE_SIZE), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_mbtiles(path, tiles):
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                           "tile_data BLOB)")
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                               [(z, column, 2 ** z - 1 - row, data) for (z, column, row), data in tiles.items()])
+    connection.close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(tile_cache, "TILE_DIR", str(tmp_path / "tiles"))
+    monkeypatch.setattr(tile_cache, "MBTILES_FILE", "")
+    monkeypatch.setattr(tile_cache, "PROJECTION_TABLE", str(tmp_path / "projection"))
+    monkeypatch.setattr(tile_cache, "OUTLINE_FILE", os.path.join(ROOT, tile_cache.OUTLINE_FILE))
+    for cache in ("_mbtiles", "_zooms", "_mosaics", "_outline"):
+        monkeypatch.setattr(tile_cache, cache, {})
+    return tmp_path
+
+
+def test_web_mercator_matches_pyproj():
+    rng = np.random.default_rng(0)
+    lon, lat = rng.uniform(-180, 180, 1000), rng.uniform(-85, 85, 1000)
+
+    x, y = tile_cache.web_mercator(lon, lat)
+
+    expected_x, expected_y = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True).transform(lon, lat)
+    np.testing.assert_allclose(x, expected_x, atol=1e-6)
+    np.testing.assert_allclose(y, expected_y, atol=1e-6)
+
+
+def test_tile_index_matches_the_slippy_map_scheme():
+    x, y = tile_cache.web_mercator(*PARIS)
+
+    assert tile_cache.tile_index(float(x), float(y), 10) == (518, 352)
+    assert tile_cache.tile_index(-tile_cache.ORIGIN, tile_cache.ORIGIN, 3) == (0, 0)
+    assert tile_cache.tile_index(tile_cache.ORIGIN, -tile_cache.ORIGIN, 3) == (7, 7)
+    assert tile_cache.tile_range(-1.0, 1.0, -1.0, 1.0, 1) == (0, 1, 0, 1)
+
+
+def test_project_points_reuses_and_refreshes_the_stored_projections(store):
+    df = pd.DataFrame({"CODE_BSS": ["A", "B", "C"], "LATITUDE": [48.8566, 45.0, None],
+                       "LONGITUDE": [2.3522, 5.0, 1.0], "autre": [1, 2, 3]})
+
+    first = tile_cache.project_points(df)
+
+    x, y = tile_cache.web_mercator(df["LONGITUDE"], df["LATITUDE"])
+    np.testing.assert_allclose(first["x"][:2], x[:2], rtol=1e-6)
+    np.testing.assert_allclose(first["y"][:2], y[:2], rtol=1e-6)
+    assert first["x"].isna().tolist() == [False, False, True]
+    assert first["autre"].tolist() == [1, 2, 3]
+    assert sorted(load_table(tile_cache.PROJECTION_TABLE)["CODE_BSS"].astype(str)) == ["A", "B"]
+
+    # Un point déplacé et un nouveau point : seuls ceux-là sont projetés et ajoutés
+    moved = pd.DataFrame({"CODE_BSS": ["A", "B", "D"], "LATITUDE": [48.8566, 46.0, 43.3],
+                          "LONGITUDE": [2.3522, 5.0, 5.4], "autre": [1, 2, 4]})
+    second = tile_cache.project_points(moved)
+
+    x, y = tile_cache.web_mercator(moved["LONGITUDE"], moved["LATITUDE"])
+    np.testing.assert_array_equal(second["x"], x.astype(np.float32))
+    np.testing.assert_array_equal(second["y"], y.astype(np.float32))
+    np.testing.assert_array_equal(second["x"][:1], first["x"][:1])
+    stored = load_table(tile_cache.PROJECTION_TABLE).set_index("CODE_BSS")
+    assert sorted(stored.index.astype(str)) == ["A", "B", "D"]
+    assert stored.loc["B", "LATITUDE"] == np.float32(46.0)
+
+
+def test_read_tile_prefers_mbtiles_and_flips_rows(store, monkeypatch):
+    mbtiles = str(store / "tuiles.mbtiles")
+    write_mbtiles(mbtiles, {(2, 1, 0): tile_bytes("red")})
+    monkeypatch.setattr(tile_cache, "MBTILES_FILE", mbtiles)
+    with open(tile_cache.tile_path(2, 1, 0), "wb") as f:
+        f.write(tile_bytes("blue"))
+    with open(tile_cache.tile_path(3, 2, 1, ".jpg"), "wb") as f:
+        f.write(b"jpeg")
+
+    assert tile_cache.read_tile(2, 1, 0) == tile_bytes("red")
+    assert tile_cache.read_tile(2, 1, 3) is None
+    assert tile_cache.read_tile(3, 2, 1) == b"jpeg"
+    assert tile_cache.available_zooms() == [2, 3]
+
+
+def test_seeding_copies_tiles_from_a_directory_and_mbtiles(store, monkeypatch):
+    source = store / "source"
+    (source / "4" / "8").mkdir(parents=True)
+    (source / "4" / "8" / "5.png").write_bytes(tile_bytes("green"))
+    (source / "4" / "8" / "notes.txt").write_text("ignoré")
+    mbtiles = str(store / "source.mbtiles")
+    write_mbtiles(mbtiles, {(5, 16, 11): tile_bytes("red"), (5, 17, 11): tile_bytes("blue")})
+
+    assert tile_cache.seed_from_directory(str(source)) == 1
+    assert tile_cache.seed_from_mbtiles(mbtiles) == 2
+
+    assert tile_cache.read_tile(4, 8, 5) == tile_bytes("green")
+    assert tile_cache.read_tile(5, 17, 11) == tile_bytes("blue")
+    assert tile_cache.available_zooms() == [4, 5]
+
+    # Tuiles déjà présentes : rien n'est téléchargé
+    monkeypatch.setattr(tile_cache.urllib.request, "urlopen", lambda *args, **kwargs: pytest.fail("réseau"))
+    x, y = tile_cache.web_mercator([-1.0, 1.0], [0.5, 0.9])
+    assert tile_cache.tile_range(float(x[0]), float(x[1]), float(y[0]), float(y[1]), 0) == (0, 0, 0, 0)
+    with open(tile_cache.tile_path(0, 0, 0), "wb") as f:
+        f.write(tile_bytes("white"))
+    assert tile_cache.seed_from_url((-1.0, 0.5, 1.0, 0.9), [0], delay=0) == 0
+
+
+def test_add_basemap_uses_the_highest_zoom_with_tiles(store):
+    x, y = tile_cache.web_mercator(*PARIS)
+    for z, color in [(5, "red"), (6, "blue")]:
+        column, row = tile_cache.tile_index(float(x), float(y), z)
+        with open(tile_cache.tile_path(z, column, row), "wb") as f:
+            f.write(tile_bytes(color))
+
+    fig, ax = plt.subplots()
+    ax.set_xlim(float(x) - 1000, float(x) + 1000)
+    ax.set_ylim(float(y) - 1000, float(y) + 1000)
+    used = tile_cache.add_basemap(ax)
+
+    assert used == 6
+    assert ax.get_xlim() == (float(x) - 1000, float(x) + 1000)
+    image = ax.get_images()[0].get_array()
+    assert image.shape == (tile_cache.TILE_SIZE, tile_cache.TILE_SIZE, 3)
+    assert tuple(image[0, 0]) == (0, 0, 255)
+    plt.close(fig)
+
+
+def test_add_basemap_falls_back_to_the_outline(store):
+    fig, ax = plt.subplots()
+    x0, y0 = tile_cache.web_mercator(-5.0, 42.0)
+    x1, y1 = tile_cache.web_mercator(9.0, 51.0)
+    ax.set_xlim(float(x0), float(x1))
+    ax.set_ylim(float(y0), float(y1))
+
+    used = tile_cache.add_basemap(ax)
+
+    assert used is None
+    assert not ax.get_images()
+    assert len(ax.patches) == pd.read_csv(tile_cache.OUTLINE_FILE, sep=";")["partie"].nunique()
+    plt.close(fig)
@@ -0,0 +1,269 @@
+import argparse
+import math
+import os
+import shutil
+import sqlite3
+import time
+import urllib.request
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from storage import load_table, save_table, table_exists
+
+# Définition des paramètres
+TILE_DIR = os.environ.get("TILE_CACHE_DIR", "tiles")  # Tuiles locales : TILE_DIR/z/x/y.png
+MBTILES_FILE = os.environ.get("TILE_MBTILES", "")  # Fichier MBTiles optionnel, consulté avant TILE_DIR
+TILE_URL = os.environ.get("TILE_URL", "https://tile.openstreetmap.org/{z}/{x}/{y}.png")  # Pour l'amorçage seulement
+TILE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+TILE_SIZE = 256
+MAX_ZOOM = 12
+MAX_TILES = 64  # Nombre maximal de tuiles assemblées pour un fond de carte
+ATTRIBUTION = "© OpenStreetMap contributors"
+FRANCE_BOUNDS = (-5.5, 41.2, 9.8, 51.2)  # Emprise (lon min, lat min, lon max, lat max) amorcée par défaut
+OUTLINE_FILE = "data_fixed/france_outline.csv"  # Contour simplifié de la France, fond de repli sans tuiles
+PROJECTION_TABLE = "data/points_eau_web_mercator"  # Coordonnées Web Mercator des points d'eau déjà calculées
+EARTH_RADIUS = 6378137.0
+ORIGIN = math.pi * EARTH_RADIUS  # Demi-largeur du monde en Web Mercator (mètres)
+MAX_LATITUDE = 85.0511287798
+
+# Caches du processus : connexion MBTiles, niveaux de zoom disponibles, mosaïques déjà assemblées, contour
+_mbtiles = {}
+_zooms = {}
+_mosaics = {}
+_outline = {}
+
+
+# Projection Web Mercator (EPSG:3857) de coordonnées WGS84, en mètres
+def web_mercator(lon, lat):
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lon) * EARTH_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+    return x, y
+
+
+# Ajoute les colonnes x, y (Web Mercator) aux points, en réutilisant les projections déjà enregistrées
+# Seuls les points nouveaux ou dont les coordonnées ont changé sont projetés, puis ajoutés à la table
+def project_points(df, key="CODE_BSS", lat="LATITUDE", lon="LONGITUDE"):
+    points = pd.DataFrame({"CODE_BSS": df[key].astype(str).to_numpy(),
+                           "LATITUDE": pd.to_numeric(df[lat], errors="coerce").to_numpy(),
+                           "LONGITUDE": pd.to_numeric(df[lon], errors="coerce").to_numpy()})
+    cached = load_table(PROJECTION_TABLE) if table_exists(PROJECTION_TABLE) else pd.DataFrame(
+        {"CODE_BSS": pd.Series(dtype=str), "LATITUDE": pd.Series(dtype=np.float64),
+         "LONGITUDE": pd.Series(dtype=np.float64), "x": pd.Series(dtype=np.float64),
+         "y": pd.Series(dtype=np.float64)})
+    cached = cached.assign(CODE_BSS=cached["CODE_BSS"].astype(str)).drop_duplicates("CODE_BSS", keep="last")
+
+    # La table est enregistrée en float32 (cf. storage.optimize_dtypes) : comparaisons et résultats en float32,
+    # pour que les positions soient identiques que la projection vienne du cache ou d'un calcul
+    merged = points.merge(cached, "left", on="CODE_BSS", suffixes=("", "_cache"))
+    same = [merged[col].astype(np.float32) == merged[f"{col}_cache"].astype(np.float32)
+            for col in ("LATITUDE", "LONGITUDE")]
+    located = merged["LATITUDE"].notna() & merged["LONGITUDE"].notna()
+    stale = ~(same[0] & same[1]) & located
+    x, y = merged["x"].to_numpy(np.float32, copy=True), merged["y"].to_numpy(np.float32, copy=True)
+    x[stale], y[stale] = web_mercator(merged.loc[stale, "LONGITUDE"], merged.loc[stale, "LATITUDE"])
+    x[~located], y[~located] = np.nan, np.nan
+
+    if stale.any():
+        updates = merged.loc[stale, ["CODE_BSS", "LATITUDE", "LONGITUDE"]].assign(x=x[stale], y=y[stale])
+        updates = updates.drop_duplicates("CODE_BSS", keep="last")
+        kept = cached[~cached["CODE_BSS"].isin(updates["CODE_BSS"])]
+        save_table(pd.concat([kept, updates], ignore_index=True), PROJECTION_TABLE)
+
+    result = df.copy()
+    result["x"], result["y"] = x, y
+    return result
+
+
+# Indices de tuile (colonne, ligne) contenant un point Web Mercator au niveau de zoom z
+def tile_index(x, y, z):
+    n = 2 ** z
+    column = min(max(int((x + ORIGIN) / (2 * ORIGIN) * n), 0), n - 1)
+    row = min(max(int((ORIGIN - y) / (2 * ORIGIN) * n), 0), n - 1)
+    return column, row
+
+
+# Tuiles couvrant une emprise Web Mercator : colonnes et lignes extrêmes (incluses)
+def tile_range(xmin, xmax, ymin, ymax, z):
+    column_min, row_min = tile_index(xmin, ymax, z)
+    column_max, row_max = tile_index(xmax, ymin, z)
+    return column_min, column_max, row_min, row_max
+
+
+def mbtiles_connection():
+    if not MBTILES_FILE or not os.path.exists(MBTILES_FILE):
+        return None
+    if MBTILES_FILE not in _mbtiles:
+        _mbtiles[MBTILES_FILE] = sqlite3.connect(f"file:{MBTILES_FILE}?mode=ro", uri=True, check_same_thread=False)
+    return _mbtiles[MBTILES_FILE]
+
+
+# Niveaux de zoom présents dans le magasin local (MBTiles et dossier)
+def available_zooms():
+    if "zooms" not in _zooms:
+        zooms = set()
+        connection = mbtiles_connection()
+        if connection is not None:
+            zooms.update(z for (z,) in connection.execute("SELECT DISTINCT zoom_level FROM tiles"))
+        if os.path.isdir(TILE_DIR):
+            zooms.update(int(name) for name in os.listdir(TILE_DIR) if name.isdigit())
+        _zooms["zooms"] = sorted(zooms)
+    return _zooms["zooms"]
+
+
+# Contenu brut d'une tuile (schéma XYZ), None si elle n'est pas dans le magasin local
+def read_tile(z, column, row):
+    connection = mbtiles_connection()
+    if connection is not None:
+        # Les MBTiles numérotent les lignes depuis le sud (schéma TMS)
+        found = connection.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? "
+                                   "AND tile_row = ?", (z, column, 2 ** z - 1 - row)).fetchone()
+        if found is not None:
+            return found[0]
+    for extension in TILE_EXTENSIONS:
+        path = os.path.join(TILE_DIR, str(z), str(column), f"{row}{extension}")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return f.read()
+    return None
+
+
+# Mosaïque RVB des tuiles d'une plage (tuiles absentes en blanc) et nombre de tuiles trouvées
+def mosaic(z, column_min, column_max, row_min, row_max):
+    key = (z, column_min, column_max, row_min, row_max)
+    if key not in _mosaics:
+        image = np.full(((row_max - row_min + 1) * TILE_SIZE, (column_max - column_min + 1) * TILE_SIZE, 3), 255,
+                        dtype=np.uint8)
+        found = 0
+        for column in range(column_min, column_max + 1):
+            for row in range(row_min, row_max + 1):
+                data = read_tile(z, column, row)
+                if data is None:
+                    continue
+                tile = np.asarray(Image.open(BytesIO(data)).convert("RGB").resize((TILE_SIZE, TILE_SIZE)))
+                top, left = (row - row_min) * TILE_SIZE, (column - column_min) * TILE_SIZE
+                image[top:top + TILE_SIZE, left:left + TILE_SIZE] = tile
+                found += 1
+        _mosaics[key] = (image, found)
+    return _mosaics[key]
+
+
+# Fond de repli : contour vectoriel de la France (projeté une fois par processus)
+def draw_outline(ax):
+    if "parts" not in _outline:
+        df = pd.read_csv(OUTLINE_FILE, sep=";")
+        x, y = web_mercator(df["longitude"], df["latitude"])
+        _outline["parts"] = [(x[index], y[index]) for index in df.groupby("partie", sort=False).indices.values()]
+    for x, y in _outline["parts"]:
+        ax.fill(x, y, facecolor="#f2efe9", edgecolor="grey", linewidth=0.8, zorder=0)
+
+
+# Fond de carte hors ligne sous les éléments déjà tracés (axes en Web Mercator), à la place de
+# contextily.add_basemap : tuiles du magasin local au plus grand zoom disponible tenant en MAX_TILES tuiles,
+# ou contour de la France si aucune tuile ne couvre l'emprise. Retourne le zoom utilisé (None pour le contour)
+def add_basemap(ax, zoom=None, attribution=ATTRIBUTION):
+    xmin, xmax = ax.get_xlim()
+    ymin, ymax = ax.get_ylim()
+    zooms = [zoom] if zoom is not None else [z for z in reversed(available_zooms()) if z <= MAX_ZOOM]
+
+    used = None
+    for z in zooms:
+        column_min, column_max, row_min, row_max = tile_range(xmin, xmax, ymin, ymax, z)
+        if (column_max - column_min + 1) * (row_max - row_min + 1) > MAX_TILES:
+            continue
+        image, found = mosaic(z, column_min, column_max, row_min, row_max)
+        if not found:
+            continue
+        size = 2 * ORIGIN / 2 ** z
+        extent = (-ORIGIN + column_min * size, -ORIGIN + (column_max + 1) * size,
+                  ORIGIN - (row_max + 1) * size, ORIGIN - row_min * size)
+        ax.imshow(image, extent=extent, interpolation="bilinear", zorder=0)
+        if attribution:
+            ax.text(0.005, 0.005, attribution, transform=ax.transAxes, fontsize=7, ha="left", va="bottom")
+        used = z
+        break
+    if used is None:
+        draw_outline(ax)
+
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+    return used
+
+
+def tile_path(z, column, row, extension=".png"):
+    path = os.path.join(TILE_DIR, str(z), str(column), f"{row}{extension}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+# Amorçage du magasin local depuis un dossier de tuiles z/x/y
+def seed_from_directory(source):
+    copied = 0
+    for root, _, names in os.walk(source):
+        for name in names:
+            stem, extension = os.path.splitext(name)
+            parts = os.path.relpath(os.path.join(root, stem), source).split(os.sep)
+            if extension.lower() in TILE_EXTENSIONS and len(parts) == 3 and all(p.isdigit() for p in parts):
+                shutil.copyfile(os.path.join(root, name), tile_path(*map(int, parts), extension.lower()))
+                copied += 1
+    return copied
+
+
+# Amorçage du magasin local depuis un fichier MBTiles
+def seed_from_mbtiles(source):
+    copied = 0
+    with sqlite3.connect(f"file:{source}?mode=ro", uri=True) as connection:
+        for z, column, tms_row, data in connection.execute(
+                "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"):
+            with open(tile_path(z, column, 2 ** z - 1 - tms_row), "wb") as f:
+                f.write(data)
+            copied += 1
+    return copied
+
+
+# Téléchargement (si le réseau est disponible) des tuiles manquantes d'une emprise pour quelques niveaux de zoom
+def seed_from_url(bounds, zooms, delay=0.1):
+    x0, y0 = web_mercator(bounds[0], bounds[1])
+    x1, y1 = web_mercator(bounds[2], bounds[3])
+    downloaded = 0
+    for z in zooms:
+        column_min, column_max, row_min, row_max = tile_range(float(x0), float(x1), float(y0), float(y1), z)
+        for column in range(column_min, column_max + 1):
+            for row in range(row_min, row_max + 1):
+                if read_tile(z, column, row) is not None:
+                    continue
+                request = urllib.request.Request(TILE_URL.format(z=z, x=column, y=row),
+                                                 headers={"User-Agent": "piezo-analyse-tile-cache"})
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    data = response.read()
+                with open(tile_path(z, column, row), "wb") as f:
+                    f.write(data)
+                downloaded += 1
+                time.sleep(delay)
+    return downloaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Amorçage du magasin local de tuiles des fonds de carte")
+    parser.add_argument("--from-dir", help="Dossier de tuiles z/x/y à copier")
+    parser.add_argument("--from-mbtiles", help="Fichier MBTiles à copier")
+    parser.add_argument("--download", action="store_true", help="Télécharger les tuiles manquantes de la France")
+    parser.add_argument("--zoom", type=int, nargs=2, default=(5, 8), metavar=("MIN", "MAX"),
+                        help="Niveaux de zoom téléchargés (inclus)")
+    args = parser.parse_args()
+
+    if args.from_dir:
+        print(f"{seed_from_directory(args.from_dir)} tuiles copiées depuis {args.from_dir}")
+    if args.from_mbtiles:
+        print(f"{seed_from_mbtiles(args.from_mbtiles)} tuiles copiées depuis {args.from_mbtiles}")
+    if args.download:
+        zooms = range(args.zoom[0], args.zoom[1] + 1)
+        print(f"{seed_from_url(FRANCE_BOUNDS, zooms)} tuiles téléchargées dans {TILE_DIR}")
+
+
+if __name__ == "__main__":
+    main()